@@ -43,6 +43,9 @@ BANNER = """
 
 DOT_CDIST   = ".cdist"
 
+# Command in $PATH of manifests to define many objects at once
+DEFINE_COMMAND = "cdist-define"
+
 REMOTE_COPY = "scp -o User=root -q"
 REMOTE_EXEC = "ssh -o User=root -q"
 
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os
+import tempfile
+
+cdist_base_path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../"))
+
+cdist_exec_path = os.path.join(cdist_base_path, "scripts/cdist")
+
+fixtures_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "fixtures"))
+
+
+def mkdtemp(**kwargs):
+    return tempfile.mkdtemp(prefix='tmp.cdist.benchmark.', **kwargs)
+
+
+def parse_list(value):
+    """Parse a comma separated list of integers: '1,10,100' -> [1, 10, 100]"""
+    return [int(i) for i in value.split(',') if i]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import argparse
+import logging
+import sys
+
+import cdist
+import cdist.log
+from cdist import benchmark
+import cdist.benchmark.config
+import cdist.benchmark.core
+
+logging.setLoggerClass(cdist.log.Log)
+logging.basicConfig(format='%(levelname)s: %(message)s')
+
+parser = {}
+parser['main'] = argparse.ArgumentParser(description='cdist benchmarks')
+parser['main'].add_argument('-v', '--verbose',
+    help='Set log level to info, be more verbose',
+    action='store_true', default=False)
+parser['sub'] = parser['main'].add_subparsers(title="Benchmarks")
+
+parser['config'] = parser['sub'].add_parser('config',
+    help='Run cdist config against local stand-in hosts')
+parser['config'].add_argument('--hosts', type=benchmark.parse_list,
+    default=[1, 10, 100],
+    help='Comma separated list of host counts to run (default: 1,10,100)')
+parser['config'].add_argument('--objects', type=int, default=20,
+    help='Number of objects in the initial manifest (default: 20)')
+parser['config'].add_argument('-s', '--sequential',
+    help='Operate on the hosts sequentially instead of in parallel',
+    action='store_false', dest='parallel', default=True)
+parser['config'].add_argument('--keep', action='store_true', default=False,
+    help='Keep the benchmark directories')
+parser['config'].add_argument('--json',
+    help='Also write the results to JSON')
+parser['config'].set_defaults(func=cdist.benchmark.config.commandline)
+
+parser['core'] = parser['sub'].add_parser('core',
+    help='Microbenchmarks of the core object model')
+parser['core'].add_argument('--objects', type=benchmark.parse_list,
+    default=[10, 100, 1000],
+    help='Comma separated list of object counts (default: 10,100,1000)')
+parser['core'].add_argument('--fan-in', type=benchmark.parse_list,
+    default=[1, 10, 100], dest='fan_in',
+    help='Comma separated list of requirements per object (default: 1,10,100)')
+parser['core'].add_argument('--parameters', type=benchmark.parse_list,
+    default=[1, 10, 50],
+    help='Comma separated list of parameters per type (default: 1,10,50)')
+parser['core'].add_argument('--scenario', action='append',
+    choices=['fsproperty', 'list_objects', 'requirements', 'type_parameters', 'emulator'],
+    help='Only run the given scenario (can be repeated)')
+parser['core'].add_argument('--json',
+    help='Also write the results to JSON')
+parser['core'].set_defaults(func=cdist.benchmark.core.commandline)
+
+args = parser['main'].parse_args(sys.argv[1:])
+if args.verbose:
+    logging.root.setLevel(logging.INFO)
+
+if not hasattr(args, 'func'):
+    parser['main'].print_help()
+    sys.exit(0)
+
+try:
+    args.func(args)
+except cdist.Error as e:
+    logging.getLogger("cdist").error(e)
+    sys.exit(1)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import cdist
+import cdist.exec.stats
+from cdist import benchmark
+
+log = logging.getLogger(__name__)
+
+'''
+End-to-end benchmark of cdist config.
+
+An initial manifest with the requested number of __directory, __file,
+__line and __package objects is generated and applied to stand-in hosts.
+Stand-in hosts are directories below the benchmark root, which are
+reached through the remote exec and copy scripts in the fixtures, so
+neither network nor real target hosts are required. __package uses a stub
+package manager (__package_benchmark).
+
+The statistics written by cdist config --stats are summed up over all
+hosts and reported per stage of the run.
+'''
+
+remote_exec = os.path.join(benchmark.fixtures_dir, "remote", "exec")
+remote_copy = os.path.join(benchmark.fixtures_dir, "remote", "copy")
+conf_dir = os.path.join(benchmark.fixtures_dir, "conf")
+
+
+class ConfigBenchmark(object):
+    """Run cdist config against stand-in hosts and collect its statistics"""
+
+    def __init__(self, objects, parallel=True, keep=False):
+        if objects < 4:
+            raise cdist.Error("At least 4 objects are required, got %s" % objects)
+        self.objects = objects
+        self.parallel = parallel
+        self.keep = keep
+
+    def manifest(self):
+        """Return an initial manifest defining self.objects objects"""
+        directories = self.objects // 4
+        files = self.objects // 4
+        lines = self.objects // 4
+        packages = self.objects - directories - files - lines
+
+        manifest = []
+        manifest.append('root="$CDIST_BENCHMARK_ROOT/hosts/$__target_host/root"')
+        for d in range(directories):
+            manifest.append('__directory "$root/dir-%d" --parents' % d)
+        for f in range(files):
+            d = f % directories
+            manifest.append('require="__directory$root/dir-%d" '
+                '__file "$root/dir-%d/file-%d" --source "$CDIST_BENCHMARK_ROOT/source"'
+                % (d, d, f))
+        for l in range(lines):
+            f = l % files
+            d = f % directories
+            manifest.append('require="__file$root/dir-%d/file-%d" '
+                '__line line-%d --file "$root/dir-%d/file-%d" --line "line %d"'
+                % (d, f, l, d, f, l))
+        for p in range(packages):
+            manifest.append('__package package-%d --type benchmark' % p)
+
+        return "\n".join(manifest) + "\n"
+
+    def _setup(self, root):
+        os.mkdir(os.path.join(root, "home"))
+        os.mkdir(os.path.join(root, "hosts"))
+        with open(os.path.join(root, "source"), "w") as fd:
+            fd.write("cdist benchmark\n")
+        manifest_path = os.path.join(root, "manifest")
+        with open(manifest_path, "w") as fd:
+            fd.write(self.manifest())
+        return manifest_path
+
+    def _env(self, root):
+        env = os.environ.copy()
+        env['HOME'] = os.path.join(root, "home")
+        env['CDIST_BENCHMARK_ROOT'] = root
+        # The emulator is run from scripts/cdist and needs to find cdist
+        pythonpath = [ benchmark.cdist_base_path ]
+        if 'PYTHONPATH' in env:
+            pythonpath.append(env['PYTHONPATH'])
+        env['PYTHONPATH'] = os.pathsep.join(pythonpath)
+        return env
+
+    def run(self, host_count):
+        """Configure host_count stand-in hosts, return the result as a dict"""
+        root = benchmark.mkdtemp()
+        try:
+            manifest_path = self._setup(root)
+            stats_path = os.path.join(root, "stats")
+            hosts = [ "host-%04d" % i for i in range(host_count) ]
+
+            command = [ sys.executable, benchmark.cdist_exec_path, "config",
+                "--initial-manifest", manifest_path,
+                "--conf-dir", conf_dir,
+                "--remote-exec", remote_exec,
+                "--remote-copy", remote_copy,
+                "--stats", stats_path ]
+            if self.parallel:
+                command.append("--parallel")
+            command.extend(hosts)
+
+            log.info("Configuring %s host(s) with %s objects", host_count, self.objects)
+            start = time.time()
+            with open(os.devnull) as devnull:
+                try:
+                    subprocess.check_call(command, env=self._env(root), stdin=devnull)
+                except subprocess.CalledProcessError:
+                    raise cdist.Error("Benchmark run failed, kept %s" % root)
+            duration = time.time() - start
+
+            with open(stats_path) as fd:
+                host_stats = [ json.loads(line) for line in fd ]
+
+        except:
+            self.keep = True
+            raise
+        finally:
+            if self.keep:
+                log.info("Keeping benchmark directory %s", root)
+            else:
+                shutil.rmtree(root)
+
+        return self.summarise(host_count, duration, host_stats)
+
+    def summarise(self, host_count, duration, host_stats):
+        result = {
+            'hosts': host_count,
+            'objects': self.objects,
+            'parallel': self.parallel,
+            'time': duration,
+            'calls': dict((kind, 0) for kind in cdist.exec.stats.KINDS),
+            'round_trips': 0,
+            'stages': {},
+        }
+        for stats in host_stats:
+            result['round_trips'] += stats['round_trips']
+            for kind, count in stats['calls'].items():
+                result['calls'][kind] += count
+            for name, stage in stats['stages'].items():
+                total = result['stages'].setdefault(name,
+                    dict((key, 0) for key in stage))
+                for key, value in stage.items():
+                    total[key] += value
+        return result
+
+
+def report(results, out=sys.stdout):
+    """Print results of ConfigBenchmark.run in a human readable way"""
+    for result in results:
+        hosts = result['hosts']
+        out.write("%s host(s), %s objects, %s: %.2fs wall time, "
+            "%s local processes, %s round trips\n" % (
+            hosts, result['objects'],
+            result['parallel'] and "parallel" or "sequential",
+            result['time'], result['calls'][cdist.exec.stats.LOCAL],
+            result['round_trips']))
+        out.write("    %-20s %10s %12s %12s %12s\n" % ("stage (per host)",
+            "count", "time", "processes", "round trips"))
+        for name, stage in sorted(result['stages'].items(),
+                key=lambda item: item[1]['time'], reverse=True):
+            round_trips = (stage[cdist.exec.stats.REMOTE_EXEC] +
+                stage[cdist.exec.stats.REMOTE_COPY])
+            out.write("    %-20s %10.1f %11.3fs %12.1f %12.1f\n" % (name,
+                stage['count'] / hosts, stage['time'] / hosts,
+                stage[cdist.exec.stats.LOCAL] / hosts, round_trips / hosts))
+        out.write("\n")
+
+
+def commandline(args):
+    bench = ConfigBenchmark(args.objects, parallel=args.parallel, keep=args.keep)
+    results = [ bench.run(host_count) for host_count in args.hosts ]
+    report(results)
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=4)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import builtins
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import cdist
+import cdist.emulator
+from cdist import benchmark
+from cdist import core
+
+log = logging.getLogger(__name__)
+
+'''
+Microbenchmarks of the core object model.
+
+Every scenario builds a synthetic type and object tree in a temporary
+directory and measures one operation of the object model in isolation:
+
+    fsproperty      reading state, parameters and requirements of an object
+    list_objects    listing all objects of a run
+    requirements    CdistObject.requirements_unfinished with a given fan-in
+    type_parameters parsing the parameter definitions of a type
+    emulator        defining an object through Emulator.run
+
+For each operation the time and the number of file system calls
+(open, stat, listdir, ...) is reported. On Linux the number of read
+and write system calls is taken from /proc/self/io in addition.
+'''
+
+TYPE_NAME = "__benchmark"
+
+
+class FileSystemCalls(object):
+    """Count calls of file system functions while active"""
+
+    functions = [ (os, name) for name in ("stat", "lstat", "listdir",
+        "scandir", "open", "mkdir", "rmdir", "unlink", "remove", "rename",
+        "symlink", "readlink", "access") if hasattr(os, name) ]
+    functions.append((builtins, "open"))
+
+    def __init__(self):
+        self.calls = 0
+        self._saved = []
+
+    def _wrap(self, function):
+        def counting(*args, **kwargs):
+            self.calls += 1
+            return function(*args, **kwargs)
+        return counting
+
+    def __enter__(self):
+        for module, name in self.functions:
+            function = getattr(module, name)
+            self._saved.append((module, name, function))
+            setattr(module, name, self._wrap(function))
+        return self
+
+    def __exit__(self, *exc):
+        while self._saved:
+            module, name, function = self._saved.pop()
+            setattr(module, name, function)
+
+
+def read_syscalls():
+    """Return (read, write) system calls of this process or None"""
+    try:
+        with open("/proc/self/io") as fd:
+            values = dict(line.split(": ") for line in fd.read().splitlines())
+        return int(values['syscr']), int(values['syscw'])
+    except (EnvironmentError, KeyError, ValueError):
+        return None
+
+
+def measure(scenario, scale, ops, function):
+    """Run function, which does ops operations, return the result as dict"""
+    syscalls_before = read_syscalls()
+    with FileSystemCalls() as fs:
+        start = time.time()
+        function()
+        duration = time.time() - start
+    syscalls_after = read_syscalls()
+
+    result = {
+        'scenario': scenario,
+        'scale': scale,
+        'ops': ops,
+        'time': duration,
+        'time_per_op': duration / ops,
+        'fs_calls_per_op': fs.calls / ops,
+    }
+    if syscalls_before and syscalls_after:
+        # the reads of /proc/self/io itself are included
+        result['read_syscalls_per_op'] = (syscalls_after[0] - syscalls_before[0]) / ops
+        result['write_syscalls_per_op'] = (syscalls_after[1] - syscalls_before[1]) / ops
+    return result
+
+
+class Workspace(object):
+    """Temporary type and object tree for the scenarios"""
+
+    def __init__(self, parameters=1):
+        self.path = benchmark.mkdtemp()
+        self.type_path = os.path.join(self.path, "type")
+        self.object_path = os.path.join(self.path, "object")
+        os.mkdir(self.object_path)
+        self.parameter_names = [ "parameter%d" % i for i in range(parameters) ]
+        self.create_type(TYPE_NAME)
+
+    def create_type(self, name):
+        parameter_path = os.path.join(self.type_path, name, "parameter")
+        os.makedirs(parameter_path)
+        with open(os.path.join(parameter_path, "optional"), "w") as fd:
+            for parameter in self.parameter_names:
+                fd.write(parameter + "\n")
+
+    def cdist_type(self):
+        return core.CdistType(self.type_path, TYPE_NAME)
+
+    def create_objects(self, count):
+        objects = []
+        cdist_type = self.cdist_type()
+        for i in range(count):
+            cdist_object = core.CdistObject(cdist_type, self.object_path, "object/%d" % i)
+            cdist_object.create()
+            cdist_object.parameters = dict((p, "value") for p in self.parameter_names)
+            objects.append(cdist_object)
+        return objects
+
+    def cleanup(self):
+        shutil.rmtree(self.path)
+
+
+def bench_fsproperty(count):
+    workspace = Workspace()
+    try:
+        objects = workspace.create_objects(count)
+        def run():
+            for cdist_object in objects:
+                cdist_object.state
+                dict(cdist_object.parameters)
+                list(cdist_object.requirements)
+        return measure("fsproperty", count, count, run)
+    finally:
+        workspace.cleanup()
+
+
+def bench_list_objects(count):
+    workspace = Workspace()
+    try:
+        workspace.create_objects(count)
+        def run():
+            list(core.CdistObject.list_objects(workspace.object_path, workspace.type_path))
+        return measure("list_objects", count, count, run)
+    finally:
+        workspace.cleanup()
+
+
+def bench_requirements(fan_in, passes=10):
+    workspace = Workspace()
+    try:
+        objects = workspace.create_objects(fan_in + 1)
+        cdist_object = objects[0]
+        cdist_object.requirements = [ o.name for o in objects[1:] ]
+        requirements = list(cdist_object.requirements)
+        def run():
+            # Config checks the requirements on every scheduling pass
+            for i in range(passes):
+                cdist_object.requirements_unfinished(requirements)
+        return measure("requirements", fan_in, fan_in * passes, run)
+    finally:
+        workspace.cleanup()
+
+
+def bench_type_parameters(parameters, repeat=100):
+    workspace = Workspace(parameters)
+    try:
+        def run():
+            for i in range(repeat):
+                # CdistType instances are shared, __init__ resets their caches
+                cdist_type = workspace.cdist_type()
+                cdist_type.required_parameters
+                cdist_type.required_multiple_parameters
+                cdist_type.optional_parameters
+                cdist_type.optional_multiple_parameters
+                cdist_type.boolean_parameters
+                cdist_type.parameter_defaults
+        return measure("type_parameters", parameters, repeat, run)
+    finally:
+        workspace.cleanup()
+
+
+def bench_emulator(parameters, count=50):
+    workspace = Workspace(parameters)
+    env = {
+        '__global': workspace.path,
+        '__target_host': 'localhost',
+        '__cdist_manifest': os.path.join(workspace.path, "manifest"),
+        '__cdist_type_base_path': workspace.type_path,
+    }
+    arguments = []
+    for parameter in workspace.parameter_names:
+        arguments.extend([ "--" + parameter, "value" ])
+
+    level = logging.root.level
+    try:
+        def run():
+            for i in range(count):
+                argv = [ TYPE_NAME, "object/%d" % i ] + arguments
+                emulator = cdist.emulator.Emulator(argv, stdin=io.BytesIO(), env=env)
+                emulator.run()
+        return measure("emulator", parameters, count, run)
+    finally:
+        # the emulator sets up logging for its own process
+        logging.root.setLevel(level)
+        workspace.cleanup()
+
+
+def run(objects, fan_in, parameters, scenarios=None):
+    """Run the selected scenarios for all scales, return a list of results"""
+    plan = [
+        ("fsproperty", bench_fsproperty, objects),
+        ("list_objects", bench_list_objects, objects),
+        ("requirements", bench_requirements, fan_in),
+        ("type_parameters", bench_type_parameters, parameters),
+        ("emulator", bench_emulator, parameters),
+    ]
+
+    results = []
+    for name, function, scales in plan:
+        if scenarios and not name in scenarios:
+            continue
+        for scale in scales:
+            log.info("Running %s with scale %s", name, scale)
+            results.append(function(scale))
+    return results
+
+
+def report(results, out=sys.stdout):
+    out.write("%-16s %8s %8s %14s %14s %14s\n" % ("scenario", "scale", "ops",
+        "time/op", "fs calls/op", "syscalls/op"))
+    for result in results:
+        syscalls = "-"
+        if 'read_syscalls_per_op' in result:
+            syscalls = "%.1f" % (result['read_syscalls_per_op'] +
+                result['write_syscalls_per_op'])
+        out.write("%-16s %8s %8s %12.1fus %14.1f %14s\n" % (result['scenario'],
+            result['scale'], result['ops'], result['time_per_op'] * 1000000,
+            result['fs_calls_per_op'], syscalls))
+
+
+def commandline(args):
+    results = run(args.objects, args.fan_in, args.parameters, args.scenario)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=4)
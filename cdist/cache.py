@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import sys
+import time
+
+import cdist
+import cdist.exec.local
+
+try:
+    import sqlite3
+    DatabaseError = sqlite3.Error
+except ImportError:
+    # The history is optional, cdist works without sqlite3
+    sqlite3 = None
+    class DatabaseError(Exception):
+        pass
+
+log = logging.getLogger(__name__)
+
+'''
+History of the runs of all hosts in one SQLite database per controller.
+
+Every run of a host is recorded in one transaction at the end of the
+run: its global explorers, its objects with their parameters, whether
+they changed and how long they took. The cdist cache subcommand queries
+the database.
+
+The directory cache of the last run of every host (Local.save_cache)
+can be compacted: identical files and symlinks of all hosts are
+hardlinked to one copy. Cached runs are only read and replaced as a
+whole, never modified in place, so sharing their files is safe.
+
+'''
+
+HISTORY_NAME = "history.sqlite"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_host ON runs (host, started);
+CREATE TABLE IF NOT EXISTS explorers (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS explorers_run ON explorers (run, name);
+CREATE TABLE IF NOT EXISTS objects (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    changed INTEGER NOT NULL,
+    prepare REAL,
+    run_time REAL
+);
+CREATE INDEX IF NOT EXISTS objects_run ON objects (run, name);
+CREATE TABLE IF NOT EXISTS parameters (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    object TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parameters_run ON parameters (run, object);
+'''
+
+
+def default_cache_path():
+    home_dir = cdist.exec.local.home_dir()
+    if not home_dir:
+        raise cdist.Error("No homedir setup and no cache dir location given")
+    return os.path.join(home_dir, "cache")
+
+
+def _host_paths(cache_path):
+    try:
+        names = sorted(os.listdir(cache_path))
+    except EnvironmentError as e:
+        raise cdist.Error("Cannot read cache %s: %s" % (cache_path, e))
+    for name in names:
+        path = os.path.join(cache_path, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            yield name, path
+
+
+def _content_key(path, st):
+    """Return what has to be equal for two files to be hardlinked"""
+    if stat.S_ISLNK(st.st_mode):
+        return ('l', os.readlink(path))
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(65536), b''):
+            digest.update(chunk)
+    return ('f', st.st_mode, st.st_uid, st.st_gid, digest.hexdigest())
+
+
+def last_run(host_path):
+    """Return when the cached run in host_path finished.
+
+    Uses the run stamp written by Local.save_cache, not the mtime of the
+    directory, which compacting changes. Caches written before the stamp
+    existed fall back to the mtime.
+
+    """
+    try:
+        with open(os.path.join(host_path, cdist.exec.local.RUN_STAMP), "r") as fd:
+            return float(fd.read())
+    except (EnvironmentError, ValueError):
+        return os.stat(host_path).st_mtime
+
+
+def compact(cache_path, dry_run=False):
+    """Hardlink identical files and symlinks of all cached hosts.
+
+    Return a dict with the number of files seen, the number of files
+    linked and the bytes saved by linking.
+
+    """
+    result = { 'files': 0, 'linked': 0, 'saved': 0 }
+    canonical = {}
+    for host, host_path in _host_paths(cache_path):
+        for directory, dirs, files in os.walk(host_path):
+            dirs.sort()
+            # Symlinks to directories (like the conf tree) are in dirs
+            for name in sorted(dirs + files):
+                path = os.path.join(directory, name)
+                if directory == host_path and name == cdist.exec.local.RUN_STAMP:
+                    # Every host keeps its own, see last_run
+                    continue
+                try:
+                    st = os.lstat(path)
+                    if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                        continue
+                    result['files'] += 1
+                    key = _content_key(path, st)
+                    if not key in canonical:
+                        canonical[key] = path
+                        continue
+                    original = os.lstat(canonical[key])
+                    if (original.st_dev, original.st_ino) == (st.st_dev, st.st_ino):
+                        continue
+                    if not dry_run:
+                        temp_path = path + ".cdist-compact"
+                        os.link(canonical[key], temp_path, follow_symlinks=False)
+                        os.replace(temp_path, path)
+                except OSError as e:
+                    if e.errno == errno.EMLINK:
+                        # Too many links to the original, start a new one
+                        canonical[key] = path
+                        continue
+                    raise cdist.Error("Cannot compact %s: %s" % (path, e))
+                result['linked'] += 1
+                if st.st_nlink == 1:
+                    result['saved'] += st.st_size
+    log.info("Linked %s of %s cached files, saving %s bytes",
+        result['linked'], result['files'], result['saved'])
+    return result
+
+
+def prune(cache_path, max_age, dry_run=False, now=None):
+    """Remove the cache of hosts not configured for max_age seconds.
+
+    Return the names of the removed hosts.
+
+    """
+    if now is None:
+        now = time.time()
+    removed = []
+    for host, host_path in _host_paths(cache_path):
+        if now - last_run(host_path) > max_age:
+            log.debug("Removing stale cache of %s", host)
+            if not dry_run:
+                try:
+                    shutil.rmtree(host_path)
+                except EnvironmentError as e:
+                    raise cdist.Error("Cannot remove cache %s: %s" % (host_path, e))
+            removed.append(host)
+    return removed
+
+
+def default_path():
+    home_dir = cdist.exec.local.home_dir()
+    if not home_dir:
+        raise cdist.Error("No homedir setup and no history database given")
+    return os.path.join(home_dir, HISTORY_NAME)
+
+
+class History(object):
+    """The run history database"""
+
+    # Seconds to wait for other hosts writing to the database
+    timeout = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            if sqlite3 is None:
+                raise cdist.Error("The run history requires python with sqlite3 support")
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._connection = sqlite3.connect(self.path, timeout=self.timeout)
+                # Readers do not block the hosts writing their runs
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.executescript(SCHEMA)
+            except (EnvironmentError, DatabaseError) as e:
+                raise cdist.Error("Cannot open history %s: %s" % (self.path, e))
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record(self, host, started, finished, status, error=None,
+            explorers=None, objects=None):
+        """Record a run in one transaction.
+
+        explorers maps explorer names to their output, objects is a list
+        of dicts with the keys name, type, state, changed, prepare, run
+        and parameters.
+
+        """
+        try:
+            with self.connection as connection:
+                cursor = connection.execute(
+                    "INSERT INTO runs (host, started, finished, status, error) "
+                    "VALUES (?, ?, ?, ?, ?)", (host, started, finished, status, error))
+                run = cursor.lastrowid
+                connection.executemany("INSERT INTO explorers VALUES (?, ?, ?)",
+                    ((run, name, value) for name, value in sorted((explorers or {}).items())))
+                objects = objects or []
+                connection.executemany("INSERT INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((run, o['name'], o['type'], o['state'], int(o['changed']),
+                        o.get('prepare'), o.get('run')) for o in objects))
+                connection.executemany("INSERT INTO parameters VALUES (?, ?, ?, ?)",
+                    ((run, o['name'], name, value) for o in objects
+                        for name, value in sorted(o.get('parameters', {}).items())))
+        except DatabaseError as e:
+            raise cdist.Error("Cannot record run of %s in %s: %s" % (host, self.path, e))
+        return run
+
+    def query(self, sql, parameters=()):
+        """Return the rows of sql"""
+        try:
+            return self.connection.execute(sql, parameters).fetchall()
+        except DatabaseError as e:
+            raise cdist.Error("Query failed: %s" % e)
+
+    def _latest_runs(self, hosts):
+        """Return the SQL selecting the id of the latest run of the hosts"""
+        sql = "SELECT MAX(id) FROM runs"
+        if hosts:
+            sql += " WHERE host IN (%s)" % ", ".join("?" * len(hosts))
+        return sql + " GROUP BY host"
+
+    def runs(self, hosts=None, limit=None):
+        sql = ("SELECT runs.host, runs.started, runs.finished - runs.started, runs.status, "
+            "(SELECT COUNT(*) FROM objects WHERE objects.run = runs.id AND changed) "
+            "FROM runs")
+        parameters = list(hosts or [])
+        if hosts:
+            sql += " WHERE host IN (%s)" % ", ".join("?" * len(hosts))
+        sql += " ORDER BY runs.id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self.query(sql, parameters)
+
+    def explorer(self, name, hosts=None):
+        """Return (host, value) of the explorer in the latest run of the hosts"""
+        hosts = list(hosts or [])
+        return self.query(
+            "SELECT runs.host, explorers.value FROM explorers "
+            "JOIN runs ON runs.id = explorers.run "
+            "WHERE explorers.name = ? AND runs.id IN (%s) ORDER BY runs.host"
+            % self._latest_runs(hosts), [name] + hosts)
+
+    def objects(self, hosts=None, changed=False):
+        """Return (host, object, state, changed) of the latest run of the hosts"""
+        hosts = list(hosts or [])
+        sql = ("SELECT runs.host, objects.name, objects.state, objects.changed FROM objects "
+            "JOIN runs ON runs.id = objects.run WHERE runs.id IN (%s)" % self._latest_runs(hosts))
+        if changed:
+            sql += " AND objects.changed"
+        return self.query(sql + " ORDER BY runs.host, objects.name", hosts)
+
+
+def _print(rows, output=sys.stdout):
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row), file=output)
+
+
+def commandline(args):
+    """Query the run history or maintain the cache"""
+    if args.query == "compact":
+        result = compact(args.cache_path or default_cache_path(), args.dry_run)
+        print("Linked %(linked)s of %(files)s files, saved %(saved)s bytes" % result)
+        return
+    elif args.query == "prune":
+        _print([host] for host in prune(args.cache_path or default_cache_path(),
+            args.days * 86400, args.dry_run))
+        return
+
+    history = History(args.history or default_path())
+    if not os.path.exists(history.path):
+        raise cdist.Error("No history in %s, record runs with cdist config --history"
+            % history.path)
+    try:
+        # Without a query, list the runs of all hosts
+        if args.query in ("runs", None):
+            _print((host, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+                "%.1f" % duration, status, changed)
+                for host, started, duration, status, changed in
+                history.runs(getattr(args, 'hosts', None), getattr(args, 'limit', None)))
+        elif args.query == "explorer":
+            for host, value in history.explorer(args.name, args.hosts):
+                _print([(host, value.rstrip("\n").replace("\n", "\\n"))])
+        elif args.query == "objects":
+            _print(history.objects(args.hosts, args.changed))
+        elif args.query == "sql":
+            _print(history.query(args.sql))
+    finally:
+        history.close()
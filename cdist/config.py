@@ -20,7 +20,9 @@
 #
 #
 
+import contextlib
 import logging
+import multiprocessing.connection
 import os
 import shutil
 import sys
@@ -29,24 +31,77 @@ import pprint
 
 import cdist
 
+import cdist.cache
+import cdist.events
 import cdist.exec.local
 import cdist.exec.remote
+import cdist.exec.stats
+import cdist.profile
+import cdist.rollout
+import cdist.trace
 
 from cdist import core
 
+# Hosts configured at the same time in parallel mode by default
+MAX_PARALLEL = 64
+
 class Config(object):
     """Cdist main class to hold arbitrary data"""
 
-    def __init__(self, local, remote, dry_run=False):
+    # Seconds between logging the estimated time remaining
+    estimate_interval = 10
+
+    def __init__(self, local, remote, dry_run=False, trace=None, memo=None,
+            explorer_jobs=1, events=None, history=None, batch_code_remote=False):
 
         self.local      = local
         self.remote     = remote
         self.log        = logging.getLogger(self.local.target_host)
         self.dry_run    = dry_run
 
-        self.explorer = core.Explorer(self.local.target_host, self.local, self.remote)
-        self.manifest = core.Manifest(self.local.target_host, self.local)
-        self.code     = core.Code(self.local.target_host, self.local, self.remote)
+        # Run the code-remote of the objects ready in a round at once
+        self.batch_code_remote = batch_code_remote
+
+        # cdist.cache.History to record the run in
+        self.history    = history
+
+        if trace is None:
+            trace = cdist.trace.Trace(None, self.local.target_host)
+        self.trace      = trace
+
+        if events is None:
+            events = cdist.events.Events(None, self.local.target_host)
+        self.events     = events
+
+        # Account local and remote commands of this host together
+        self.stats      = self.local.stats
+        self.remote.stats = self.stats
+
+        self.explorer = core.Explorer(self.local.target_host, self.local, self.remote,
+            jobs=explorer_jobs, events=events)
+        self.manifest = core.Manifest(self.local.target_host, self.local, events=events)
+        self.code     = core.Code(self.local.target_host, self.local, self.remote, memo=memo,
+            events=events)
+        self.dependencies = core.DependencyGraph(self.local.base_path,
+            self.local.object_path, self.local.type_path)
+        self.timings = core.Timings(self.local.base_path, self.local.host_cache_path)
+
+        # ((graph changes, number of objects), critical paths), see schedule
+        self._critical_paths = None
+        # When the estimated time remaining was last logged
+        self._estimate_logged = 0.0
+
+    @contextlib.contextmanager
+    def _stage(self, name, cdist_object=None, **args):
+        """Trace and account the with block as the given stage"""
+        category = "stage"
+        if cdist_object:
+            category = "object"
+            args['object'] = cdist_object.name
+
+        with self.trace.span(name, category, **args), self.stats.stage(name):
+            with self.events.span("stage", stage=name, **args):
+                yield
 
     def _init_files_dirs(self):
         """Prepare files and directories for the run"""
@@ -56,11 +111,14 @@ class Config(object):
     @classmethod
     def commandline(cls, args):
         """Configure remote system"""
-        import multiprocessing
-
         # FIXME: Refactor relict - remove later
         log = logging.getLogger("cdist")
     
+        if not args.host and not args.hosts_file:
+            raise cdist.Error("No hosts given, use host arguments or --hosts-file")
+        if args.manifest == '-' and args.hosts_file == '-':
+            raise cdist.Error("Cannot read both the initial manifest and the hosts from stdin")
+
         initial_manifest_tempfile = None
         if args.manifest == '-':
             # read initial manifest from stdin
@@ -76,38 +134,165 @@ class Config(object):
             import atexit
             atexit.register(lambda: os.remove(initial_manifest_temp_path))
     
-        process = {}
-        failed_hosts = []
-        time_start = time.time()
+        cdist.events.Events.start(args.events)
+        events = cdist.events.Events(args.events)
+
+        if args.profile:
+            # Absolute path: the emulator runs in the object directories
+            args.profile = os.path.abspath(args.profile)
+            os.environ[cdist.profile.ENV_NAME] = args.profile
+
+        # Hosts share the output of identical gencode runs
+        args.gencode_memo_path = None
+        if args.share_gencode and (len(args.host) > 1 or args.hosts_file):
+            import tempfile
+            import atexit
+            args.gencode_memo_path = tempfile.mkdtemp(prefix='cdist.gencode.')
+            atexit.register(lambda: shutil.rmtree(args.gencode_memo_path, ignore_errors=True))
+
+        # Host processes started by the forkserver have a different argv
+        args.exec_path = sys.argv[0]
+
+        # Computed once instead of by every host
+        args.conf_link_plan = cdist.exec.local.Local.plan_conf_links(
+            cdist.exec.local.Local.find_conf_dirs(args.conf_dir))
+
+        if args.parallel:
+            from cdist import worker
+            process_context = worker.context()
+
+        if args.trace:
+            cdist.trace.Trace.start(args.trace)
+
+        # The trace file is written even if the run is aborted
+        try:
+            with cdist.profile.Profile(args.profile, "main"):
+                rollout = cdist.rollout.Rollout(cls.hosts(args), args.wave_size,
+                    args.wave_ramp, args.max_failures)
+                failed_hosts = rollout.failed_hosts
+                host_count = 0
+                time_start = time.time()
+                events.emit("run_started")
+
+                # run_finished is emitted for aborted runs too
+                error = None
+                try:
+                    # Hosts are read lazily: the first ones start right away
+                    for wave in rollout:
+                        if args.parallel:
+                            def start(host):
+                                log.debug("Creating child process for %s", host)
+                                child = process_context.Process(target=worker.onehost,
+                                    args=(host, args, logging.root.level))
+                                child.start()
+                                return child
+                            process, started = cls._start_parallel(wave, start,
+                                failed_hosts, args.max_parallel)
+                            host_count += started
+                        else:
+                            for host in wave:
+                                host_count += 1
+                                try:
+                                    cls.onehost(host, args, parallel=False)
+                                except cdist.Error as e:
+                                    failed_hosts.append(host)
+
+                        # Catch errors in parallel mode when joining
+                        if args.parallel:
+                            for host, child in process:
+                                log.debug("Joining process %s", host)
+                                child.join()
+
+                                if not child.exitcode == 0:
+                                    failed_hosts.append(host)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    time_end = time.time()
+                    log.info("Total processing time for %s host(s): %s", host_count,
+                                (time_end - time_start))
+                    fields = dict(hosts=host_count, failed=len(failed_hosts),
+                        skipped=rollout.skipped, duration=time_end - time_start)
+                    if error is not None:
+                        fields.update(aborted=True, error=str(error) or error.__class__.__name__)
+                    events.emit("run_finished", **fields)
+        finally:
+            if args.trace:
+                cdist.trace.Trace.finish(args.trace)
+
+        rollout.check()
     
+    @staticmethod
+    def hosts(args):
+        """Yield the hosts given as arguments, then the ones from the hosts file.
+
+        The hosts file contains one host per line, empty lines and
+        comments starting with # are ignored.
+
+        """
         for host in args.host:
-            if args.parallel:
-                log.debug("Creating child process for %s", host)
-                process[host] = multiprocessing.Process(target=cls.onehost, args=(host, args, True))
-                process[host].start()
+            yield host
+
+        if args.hosts_file:
+            if args.hosts_file == '-':
+                fd = sys.stdin
             else:
                 try:
-                    cls.onehost(host, args, parallel=False)
-                except cdist.Error as e:
-                    failed_hosts.append(host)
-    
-        # Catch errors in parallel mode when joining
-        if args.parallel:
-            for host in process.keys():
-                log.debug("Joining process %s", host)
-                process[host].join()
-    
-                if not process[host].exitcode == 0:
-                    failed_hosts.append(host)
-    
-        time_end = time.time()
-        log.info("Total processing time for %s host(s): %s", len(args.host),
-                    (time_end - time_start))
-    
-        if len(failed_hosts) > 0:
-            raise cdist.Error("Failed to configure the following hosts: " + 
-                " ".join(failed_hosts))
-    
+                    fd = open(args.hosts_file)
+                except EnvironmentError as e:
+                    raise cdist.Error("Cannot read hosts from %s: %s" % (args.hosts_file, e))
+            try:
+                for line in fd:
+                    host = line.split('#', 1)[0].strip()
+                    if host:
+                        yield host
+            finally:
+                if fd is not sys.stdin:
+                    fd.close()
+
+    @staticmethod
+    def _reap(process, failed_hosts, max_running=None):
+        """Join finished host processes, return the ones still running.
+
+        With max_running, wait until less than max_running are running.
+
+        """
+        while True:
+            running = []
+            for host, child in process:
+                if child.is_alive():
+                    running.append((host, child))
+                else:
+                    child.join()
+                    if not child.exitcode == 0:
+                        failed_hosts.append(host)
+            if not max_running or len(running) < max_running:
+                return running
+            multiprocessing.connection.wait([child.sentinel for host, child in running])
+            process = running
+
+    @classmethod
+    def _start_parallel(cls, hosts, start, failed_hosts, max_running=None):
+        """Start a process for every host, at most max_running at a time.
+
+        The next host is only taken from hosts once a process can be
+        started for it. Return the processes still running and the
+        number of hosts started.
+
+        """
+        process = []
+        started = 0
+        hosts = iter(hosts)
+        while True:
+            process = cls._reap(process, failed_hosts, max_running)
+            try:
+                host = next(hosts)
+            except StopIteration:
+                return process, started
+            process.append((host, start(host)))
+            started += 1
+
     @classmethod
     def onehost(cls, host, args, parallel):
         """Configure ONE system"""
@@ -115,19 +300,52 @@ class Config(object):
         log = logging.getLogger(host)
     
         try:
+            stats = cdist.exec.stats.Stats(host)
+
             local = cdist.exec.local.Local(
                 target_host=host,
+                exec_path=args.exec_path,
                 initial_manifest=args.manifest,
                 base_path=args.out_path,
-                add_conf_dirs=args.conf_dir)
+                add_conf_dirs=args.conf_dir,
+                stats=stats,
+                link_plan=args.conf_link_plan,
+                shell_pool=args.local_shell_pool)
 
             remote = cdist.exec.remote.Remote(
                 target_host=host,
                 remote_exec=args.remote_exec,
-                remote_copy=args.remote_copy)
+                remote_copy=args.remote_copy,
+                stats=stats,
+                keep_conf=args.keep_remote_conf)
     
-            c = cls(local, remote, dry_run=args.dry_run)
-            c.run()
+            trace = cdist.trace.Trace(args.trace, host)
+
+            profile = cdist.profile.Profile(args.profile, "config", host)
+
+            memo = None
+            if args.gencode_memo_path:
+                memo = core.GencodeMemo(args.gencode_memo_path)
+
+            history = None
+            if args.history:
+                history = cdist.cache.History(cdist.cache.default_path())
+
+            c = cls(local, remote, dry_run=args.dry_run, trace=trace, memo=memo,
+                explorer_jobs=args.explorer_jobs,
+                events=cdist.events.Events(args.events, host),
+                history=history,
+                batch_code_remote=args.batch_code_remote)
+            try:
+                with profile:
+                    c.run()
+            finally:
+                local.close()
+                if history:
+                    history.close()
+                if args.stats:
+                    stats.write(args.stats)
+                profile.summarise()
     
         except cdist.Error as e:
             log.error(e)
@@ -149,15 +367,64 @@ class Config(object):
         """Do what is most often done: deploy & cleanup"""
         start_time = time.time()
 
-        self._init_files_dirs()
+        # Objects are interned per object path, which may be reused
+        core.CdistObject.clear_instances(self.local.object_path)
+        try:
+            with self.events.span("host"), self._stage("run"):
+                with self._stage("conf setup"):
+                    self._init_files_dirs()
+
+                with self._stage("global explorers"):
+                    self.explorer.run_global_explorers(self.local.global_explorer_out_path)
+                with self._stage("initial manifest"):
+                    self.manifest.run_initial_manifest(self.local.initial_manifest)
+                self.dependencies.check()
+                self.iterate_until_finished()
+
+                with self._stage("cache save"):
+                    self.timings.save()
+                    self.record_history(start_time, "ok")
+                    self.local.save_cache()
+        except cdist.Error as e:
+            try:
+                self.record_history(start_time, "failed", str(e))
+            except cdist.Error as history_error:
+                self.log.warning(history_error)
+            raise
+        finally:
+            core.CdistObject.clear_instances(self.local.object_path)
+        self.log.info("Finished successful run in %s seconds", time.time() - start_time)
+        for line in self.stats.summary():
+            self.log.info(line)
 
-        self.explorer.run_global_explorers(self.local.global_explorer_out_path)
-        self.manifest.run_initial_manifest(self.local.initial_manifest)
-        self.iterate_until_finished()
 
-        self.local.save_cache()
-        self.log.info("Finished successful run in %s seconds", time.time() - start_time)
+    def record_history(self, start_time, status, error=None):
+        """Record the run in the history, if enabled"""
+        if not self.history:
+            return
 
+        explorers = {}
+        if os.path.isdir(self.local.global_explorer_out_path):
+            for name in os.listdir(self.local.global_explorer_out_path):
+                with open(os.path.join(self.local.global_explorer_out_path, name), encoding="utf-8") as fd:
+                    explorers[name] = fd.read()
+
+        objects = []
+        for cdist_object in core.CdistObject.list_objects(self.local.object_path,
+                self.local.type_path):
+            timing = self.timings.current.get(cdist_object.name, {})
+            objects.append({
+                'name': cdist_object.name,
+                'type': cdist_object.cdist_type.name,
+                'state': cdist_object.state,
+                'changed': cdist_object.changed,
+                'prepare': timing.get(core.timing.PREPARE),
+                'run': timing.get(core.timing.RUN),
+                'parameters': dict(cdist_object.parameters),
+            })
+
+        self.history.record(self.local.target_host, start_time, time.time(),
+            status, error, explorers, objects)
 
     def object_list(self):
         """Short name for object list retrieval"""
@@ -169,6 +436,48 @@ class Config(object):
                 yield cdist_object
 
 
+    def schedule(self, objects):
+        """Return objects ordered by their estimated remaining critical path.
+
+        Objects that many long running objects wait for are started
+        first. Estimates are based on the timings of the last run.
+        The critical paths are only computed again when objects or
+        requirements changed, the estimated time remaining is logged at
+        most every estimate_interval seconds.
+
+        """
+        index = dict((cdist_object.name, cdist_object) for cdist_object in objects)
+        key = (self.dependencies.changes, len(index))
+
+        def remaining(name):
+            state = index[name].state
+            if state == core.CdistObject.STATE_DONE:
+                return 0.0
+            elif state == core.CdistObject.STATE_PREPARED:
+                return self.timings.estimate(name, (core.timing.RUN,))
+            else:
+                return self.timings.estimate(name)
+
+        costs = None
+        if not self._critical_paths or self._critical_paths[0] != key:
+            costs = dict((name, remaining(name)) for name in index)
+            self._critical_paths = (key, self.dependencies.critical_paths(list(index), costs.get))
+
+        now = time.time()
+        if now - self._estimate_logged >= self.estimate_interval:
+            if costs is None:
+                costs = dict((name, remaining(name)) for name in index)
+            # Objects are processed one after another: the sum is left
+            eta = sum(costs.values())
+            if eta:
+                unfinished = len([cost for cost in costs.values() if cost])
+                self.log.info("Estimated time remaining: %.1f seconds for %s object(s)", eta, unfinished)
+                self._estimate_logged = now
+
+        paths = self._critical_paths[1]
+        # Stable: without timings the order is unchanged
+        return sorted(objects, key=lambda cdist_object: paths[cdist_object.name], reverse=True)
+
     def iterate_once(self):
         """
             Iterate over the objects once - helper method for 
@@ -176,8 +485,25 @@ class Config(object):
         """
         objects_changed  = False
 
-        for cdist_object in self.object_list():
-            if cdist_object.requirements_unfinished(cdist_object.requirements):
+        objects = self.schedule(list(self.object_list()))
+
+        # Ship the parameters of all objects that are ready to run their
+        # explorers in this round at once
+        ready = [cdist_object for cdist_object in objects
+            if cdist_object.state == core.CdistObject.STATE_UNDEF and
+            not cdist_object.requirements_unfinished(
+                self.dependencies.resolve(cdist_object.name, cdist_object.requirements))]
+        if ready:
+            with self._stage("transfer parameters"):
+                self.explorer.transfer_objects_parameters(ready)
+
+        # Objects to run at once: as they are only done afterwards, no
+        # object that requires one of them can join
+        runnable = []
+
+        for cdist_object in objects:
+            requirements = self.dependencies.resolve(cdist_object.name, cdist_object.requirements)
+            if cdist_object.requirements_unfinished(requirements):
                 """We cannot do anything for this poor object"""
                 continue
         
@@ -192,9 +518,15 @@ class Config(object):
                 continue
         
             if cdist_object.state == core.CdistObject.STATE_PREPARED:
-                self.object_run(cdist_object)
+                if self.batch_code_remote and not self.dry_run:
+                    runnable.append(cdist_object)
+                else:
+                    self.object_run(cdist_object)
                 objects_changed = True
 
+        if runnable:
+            self.object_run_batch(runnable)
+
         return objects_changed
 
 
@@ -223,7 +555,8 @@ class Config(object):
                 requirement_names = []
                 autorequire_names = []
 
-                for requirement in cdist_object.requirements_unfinished(cdist_object.requirements):
+                requirements = self.dependencies.resolve(cdist_object.name, cdist_object.requirements)
+                for requirement in cdist_object.requirements_unfinished(requirements):
                     requirement_names.append(requirement.name)
 
                 for requirement in cdist_object.requirements_unfinished(cdist_object.autorequire):
@@ -239,8 +572,15 @@ class Config(object):
     def object_prepare(self, cdist_object):
         """Prepare object: Run type explorer + manifest"""
         self.log.info("Running manifest and explorers for " + cdist_object.name)
-        self.explorer.run_type_explorers(cdist_object)
-        self.manifest.run_type_manifest(cdist_object)
+        start = time.time()
+        with self._stage("type explorers", cdist_object):
+            self.explorer.run_type_explorers(cdist_object)
+        with self._stage("manifest", cdist_object):
+            self.manifest.run_type_manifest(cdist_object)
+        self.dependencies.check()
+        self.timings.record(cdist_object.name, core.timing.PREPARE, time.time() - start)
+        self.events.emit("object_prepared", object=cdist_object.name,
+            duration=time.time() - start)
         cdist_object.state = core.CdistObject.STATE_PREPARED
 
     def object_run(self, cdist_object):
@@ -251,27 +591,77 @@ class Config(object):
             raise cdist.Error("Attempting to run an already finished object: %s", cdist_object)
 
         cdist_type = cdist_object.cdist_type
+        start = time.time()
 
-        # Generate
-        self.log.info("Generating code for %s" % (cdist_object.name))
-        cdist_object.code_local = self.code.run_gencode_local(cdist_object)
-        cdist_object.code_remote = self.code.run_gencode_remote(cdist_object)
-        if cdist_object.code_local or cdist_object.code_remote:
-            cdist_object.changed = True
+        self.object_gencode(cdist_object)
 
         # Execute
         if not self.dry_run:
             if cdist_object.code_local or cdist_object.code_remote:
                 self.log.info("Executing code for %s" % (cdist_object.name))
             if cdist_object.code_local:
-                self.code.run_code_local(cdist_object)
+                with self._stage("code execution", cdist_object, code="local"):
+                    self.code.run_code_local(cdist_object)
             if cdist_object.code_remote:
-                self.code.transfer_code_remote(cdist_object)
-                self.code.run_code_remote(cdist_object)
+                with self._stage("transfer", cdist_object):
+                    self.code.transfer_code_remote(cdist_object)
+                with self._stage("code execution", cdist_object, code="remote"):
+                    self.code.run_code_remote(cdist_object)
         else:
             self.log.info("Skipping code execution due to DRY RUN")
 
+        self.object_done(cdist_object, start)
+
+    def object_gencode(self, cdist_object):
+        """Generate the code of an object"""
+        self.log.info("Generating code for %s" % (cdist_object.name))
+        with self._stage("gencode", cdist_object):
+            cdist_object.code_local = self.code.run_gencode_local(cdist_object)
+            cdist_object.code_remote = self.code.run_gencode_remote(cdist_object)
+        if cdist_object.code_local or cdist_object.code_remote:
+            cdist_object.changed = True
 
-        # Mark this object as done
+    def object_done(self, cdist_object, start):
+        """Mark an object as done"""
         self.log.debug("Finishing run of " + cdist_object.name)
+        self.timings.record(cdist_object.name, core.timing.RUN, time.time() - start)
+        self.events.emit("object_run", object=cdist_object.name,
+            duration=time.time() - start, changed=cdist_object.changed)
         cdist_object.state = core.CdistObject.STATE_DONE
+
+    def object_run_batch(self, cdist_objects):
+        """Run gencode and code of objects independent of each other.
+
+        The code-remote scripts of all objects are run in one remote
+        session after the code-local ones.
+
+        """
+        starts = {}
+        remote_objects = []
+        for cdist_object in cdist_objects:
+            self.log.debug("Trying to run object %s" % (cdist_object.name))
+            starts[cdist_object.name] = time.time()
+            self.object_gencode(cdist_object)
+            if cdist_object.code_local or cdist_object.code_remote:
+                self.log.info("Executing code for %s" % (cdist_object.name))
+            if cdist_object.code_local:
+                with self._stage("code execution", cdist_object, code="local"):
+                    self.code.run_code_local(cdist_object)
+            if cdist_object.code_remote:
+                remote_objects.append(cdist_object)
+            else:
+                self.object_done(cdist_object, starts[cdist_object.name])
+
+        if not remote_objects:
+            return
+        with self._stage("code execution", code="remote", objects=len(remote_objects)):
+            results = self.code.run_code_remote_batch(remote_objects)
+        for cdist_object, status, stdout, stderr in results:
+            sys.stdout.write(stdout)
+            sys.stdout.flush()
+            sys.stderr.write(stderr)
+            sys.stderr.flush()
+            if status:
+                raise cdist.CdistObjectError(cdist_object,
+                    "code-remote failed with exit status %d" % status)
+            self.object_done(cdist_object, starts[cdist_object.name])
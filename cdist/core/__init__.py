@@ -25,5 +25,11 @@ from cdist.core.cdist_object    import CdistObject
 from cdist.core.cdist_object    import IllegalObjectIdError
 from cdist.core.cdist_object    import OBJECT_MARKER
 from cdist.core.explorer        import Explorer
+from cdist.core.explorer        import GlobalExplorerError
 from cdist.core.manifest        import Manifest
+from cdist.core.manifest        import PythonManifest
 from cdist.core.code            import Code
+from cdist.core.dependency      import DependencyGraph
+from cdist.core.dependency      import CircularDependencyError
+from cdist.core.timing          import Timings
+from cdist.core.memo            import GencodeMemo
@@ -21,9 +21,9 @@
 #
 #
 
-import fnmatch
 import logging
 import os
+import re
 import collections
 
 import cdist
@@ -60,16 +60,26 @@ class CdistObject(object):
 
     """
 
+    # Objects are created in large numbers: no __dict__
+    __slots__ = ('cdist_type', 'base_path', 'object_id', 'name', 'path',
+        'absolute_path', 'code_local_path', 'code_remote_path',
+        'parameter_path', 'changed') + fsproperty.slot_names('requirements',
+        'autorequire', 'parameters', 'explorers', 'state', 'source')
+
     # Constants for use with Object.state
     STATE_UNDEF = ""
     STATE_PREPARED = "prepared"
     STATE_RUNNING = "running"
     STATE_DONE = "done"
 
+    # Identity map: object base path -> type name -> object id -> object
+    _instances = {}
+
     def __init__(self, cdist_type, base_path, object_id=''):
         self.cdist_type = cdist_type # instance of Type
         self.base_path = base_path
         self.object_id = object_id
+        self.changed = False
 
         self.validate_object_id()
         self.sanitise_object_id()
@@ -81,12 +91,36 @@ class CdistObject(object):
         self.code_remote_path = os.path.join(self.path, "code-remote")
         self.parameter_path = os.path.join(self.path, "parameter")
 
+    @classmethod
+    def lookup(cls, object_base_path, type_base_path, type_name, object_id=''):
+        """Return the instance of the given object.
+
+        There is only one instance per object below object_base_path,
+        it is created on first use.
+
+        """
+        objects = cls._instances.setdefault(object_base_path, {}).setdefault(type_name, {})
+        try:
+            return objects[object_id]
+        except KeyError:
+            cdist_object = cls(cdist.core.CdistType(type_base_path, type_name),
+                object_base_path, object_id=object_id)
+            # object_id may have been sanitised
+            cdist_object = objects.setdefault(cdist_object.object_id, cdist_object)
+            objects[object_id] = cdist_object
+            return cdist_object
+
+    @classmethod
+    def clear_instances(cls, object_base_path):
+        """Forget all instances below object_base_path"""
+        cls._instances.pop(object_base_path, None)
+
     @classmethod
     def list_objects(cls, object_base_path, type_base_path):
         """Return a list of object instances"""
         for object_name in cls.list_object_names(object_base_path):
             type_name, object_id = cls.split_name(object_name)
-            yield cls(cdist.core.CdistType(type_base_path, type_name), object_base_path, object_id=object_id)
+            yield cls.lookup(object_base_path, type_base_path, type_name, object_id)
 
     @classmethod
     def list_type_names(cls, object_base_path):
@@ -94,12 +128,32 @@ class CdistObject(object):
         return os.listdir(object_base_path)
 
     @classmethod
-    def list_object_names(cls, object_base_path):
-        """Return a list of object names"""
-        for path, dirs, files in os.walk(object_base_path):
+    def list_object_names(cls, object_base_path, type_name=None):
+        """Return a list of object names, only of the given type if type_name is set"""
+        top = object_base_path
+        if type_name:
+            top = os.path.join(object_base_path, type_name)
+        for path, dirs, files in os.walk(top):
             if OBJECT_MARKER in dirs:
                 yield os.path.relpath(path, object_base_path)
 
+    @staticmethod
+    def is_pattern(object_name):
+        """Return whether object_name is a pattern like __package/*"""
+        return '*' in object_name
+
+    @classmethod
+    def match_names(cls, pattern, object_names):
+        """Return the object names matching the given pattern.
+
+        * matches any string including /, all other characters
+        only match themselves.
+
+        """
+        regex = re.compile(".*".join(re.escape(part) for part in pattern.split('*')) + r"\Z",
+            re.DOTALL)
+        return [name for name in object_names if regex.match(name)]
+
     @staticmethod
     def split_name(object_name):
         """split_name('__type_name/the/object_id') -> ('__type_name', 'the/object_id')
@@ -153,14 +207,9 @@ class CdistObject(object):
 
         """
 
-        base_path = self.base_path
-        type_path = self.cdist_type.base_path
-
         type_name, object_id = self.split_name(object_name)
 
-        cdist_type = self.cdist_type.__class__(type_path, type_name)
-
-        return self.__class__(cdist_type, base_path, object_id=object_id)
+        return self.lookup(self.base_path, self.cdist_type.base_path, type_name, object_id)
 
     def __repr__(self):
         return '<CdistObject %s>' % self.name
@@ -205,7 +254,9 @@ class CdistObject(object):
     autorequire = fsproperty.FileListProperty(lambda obj: os.path.join(obj.absolute_path, 'autorequire'))
     parameters = fsproperty.DirectoryDictProperty(lambda obj: os.path.join(obj.base_path, obj.parameter_path))
     explorers = fsproperty.DirectoryDictProperty(lambda obj: os.path.join(obj.base_path, obj.explorer_path))
-    state = fsproperty.FileStringProperty(lambda obj: os.path.join(obj.absolute_path, "state"))
+    # Read on every scheduling pass: cached, but revalidated by stat as
+    # other instances and processes (like the emulator) write it too
+    state = fsproperty.FileStringProperty(lambda obj: os.path.join(obj.absolute_path, "state"), cache=True)
     source = fsproperty.FileListProperty(lambda obj: os.path.join(obj.absolute_path, "source"))
     code_local = fsproperty.FileStringProperty(lambda obj: os.path.join(obj.base_path, obj.code_local_path))
     code_remote = fsproperty.FileStringProperty(lambda obj: os.path.join(obj.base_path, obj.code_remote_path))
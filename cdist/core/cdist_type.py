@@ -55,6 +55,7 @@ class CdistType(object):
         self.gencode_local_path = os.path.join(self.name, "gencode-local")
         self.gencode_remote_path = os.path.join(self.name, "gencode-remote")
         self.manifest_path = os.path.join(self.name, "manifest")
+        self.python_manifest_path = os.path.join(self.name, "manifest.py")
 
         self.__explorers = None
         self.__required_parameters = None
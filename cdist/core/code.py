@@ -21,10 +21,18 @@
 #
 #
 
+import io
 import logging
 import os
+import re
+import shlex
+import tarfile
+import tempfile
+import uuid
 
 import cdist
+import cdist.events
+import cdist.exec.remote
 
 log = logging.getLogger(__name__)
 
@@ -77,6 +85,13 @@ code-remote
     - copy script to remote
     - run script remotely
     returns: string containing the output
+
+code-remote of a batch of objects
+    - copy the scripts and a driver script in one archive to remote
+    - run the driver, which runs every script in a subshell and
+      delimits its output and exit status by markers
+    - stop at the first failing script
+    returns: list of (object, exit status, output)
 '''
 
 
@@ -84,10 +99,15 @@ class Code(object):
     """Generates and executes cdist code scripts.
 
     """
-    def __init__(self, target_host, local, remote):
+    def __init__(self, target_host, local, remote, memo=None, events=None):
         self.target_host = target_host
         self.local = local
         self.remote = remote
+        if events is None:
+            events = cdist.events.Events(None, target_host)
+        self.events = events
+        # GencodeMemo shared with the other hosts of the run
+        self.memo = memo
         self.env = {
             '__target_host': self.target_host,
             '__global': self.local.base_path,
@@ -106,7 +126,15 @@ class Code(object):
                 '__object_name': cdist_object.name,
             })
             message_prefix=cdist_object.name
-            return self.local.run_script(script, env=env, return_output=True, message_prefix=message_prefix)
+            def gencode():
+                with self.events.span("code", object=cdist_object.name, script="gencode-" + which):
+                    return self.local.run_script(script, env=env, return_output=True, message_prefix=message_prefix)
+
+            if self.memo:
+                key = self.memo.key(script, which, cdist_object, self.local.global_explorer_out_path)
+                if key:
+                    return self.memo.get(key, gencode)
+            return gencode()
 
     def run_gencode_local(self, cdist_object):
         """Run the gencode-local script for the given cdist object."""
@@ -124,10 +152,77 @@ class Code(object):
         self.remote.mkdir(destination)
         self.remote.transfer(source, destination)
 
-    def _run_code(self, cdist_object, which, env=None):
+    def _batch_driver(self, cdist_objects, marker):
+        shell = os.environ.get('CDIST_REMOTE_SHELL', "/bin/sh")
+        stderr = shlex.quote(os.path.join(self.remote.object_path, "code-remote.%s.stderr" % marker))
+        lines = []
+        for index, cdist_object in enumerate(cdist_objects):
+            env = (
+                ('__object', os.path.join(self.remote.object_path, cdist_object.path)),
+                ('__object_id', cdist_object.object_id),
+            )
+            script = os.path.join(self.remote.object_path, cdist_object.code_remote_path)
+            lines.extend((
+                "echo '%s begin %d'" % (marker, index),
+                "( %s %s -e %s ) 2>%s" % (
+                    " ".join("%s=%s" % (name, shlex.quote(value)) for name, value in env),
+                    shlex.quote(shell), shlex.quote(script), stderr),
+                "status=$?",
+                "printf '\\n%s stderr\\n'" % marker,
+                "cat %s && rm -f %s" % (stderr, stderr),
+                "printf '\\n%s end %%s\\n' \"$status\"" % marker,
+                '[ "$status" -eq 0 ] || exit 0',
+            ))
+        return "\n".join(lines) + "\n"
+
+    def run_code_remote_batch(self, cdist_objects):
+        """Run the code-remote scripts of the given independent objects in
+        one remote session.
+
+        Return a list of (cdist_object, exit status, stdout, stderr) in
+        order of the objects, up to and including the first failing one.
+
+        """
+        marker = "cdist-%s" % uuid.uuid4().hex
+        driver = "code-remote.%s" % marker
+        handle, archive = tempfile.mkstemp(prefix='cdist.code-remote.', suffix='.tar')
+        try:
+            with os.fdopen(handle, "wb") as fd, tarfile.open(fileobj=fd, mode="w") as tar:
+                for cdist_object in cdist_objects:
+                    tar.add(os.path.join(self.local.object_path, cdist_object.code_remote_path),
+                        arcname=cdist_object.code_remote_path,
+                        filter=cdist.exec.remote.archive_filter)
+                content = self._batch_driver(cdist_objects, marker).encode('utf-8')
+                tarinfo = tarfile.TarInfo(driver)
+                tarinfo.size = len(content)
+                tarinfo.mode = 0o600
+                tar.addfile(cdist.exec.remote.archive_filter(tarinfo), io.BytesIO(content))
+            self.remote.transfer_archive(archive, self.remote.object_path)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot archive code-remote: %s" % e)
+        finally:
+            os.remove(archive)
+
+        names = [cdist_object.name for cdist_object in cdist_objects]
+        with self.events.span("code", objects=names, script="code-remote"):
+            output = self.remote.run(["/bin/sh", os.path.join(self.remote.object_path, driver)],
+                return_output=True)
+
+        results = []
+        pattern = re.compile(r'^%s begin (\d+)\n(.*?)\n%s stderr\n(.*?)\n%s end (\d+)$'
+            % (marker, marker, marker), re.DOTALL | re.MULTILINE)
+        for match in pattern.finditer(output):
+            results.append((cdist_objects[int(match.group(1))], int(match.group(4)),
+                match.group(2), match.group(3)))
+        if len(results) < len(cdist_objects) and (not results or results[-1][1] == 0):
+            raise cdist.Error("Incomplete output of code-remote of %s" % ", ".join(names))
+        return results
+
+    def _run_code(self, cdist_object, which, env=None, **kwargs):
         which_exec = getattr(self, which)
         script = os.path.join(which_exec.object_path, getattr(cdist_object, 'code_%s_path' % which))
-        return which_exec.run_script(script, env=env)
+        with self.events.span("code", object=cdist_object.name, script="code-" + which):
+            return which_exec.run_script(script, env=env, **kwargs)
 
     def run_code_local(self, cdist_object):
         """Run the code-local script for the given cdist object."""
@@ -138,7 +233,8 @@ class Code(object):
             '__object': cdist_object.absolute_path,
             '__object_id': cdist_object.object_id,
         })
-        return self._run_code(cdist_object, 'local', env=env)
+        # Like code-remote, the output is not buffered
+        return self._run_code(cdist_object, 'local', env=env, stream=True)
 
     def run_code_remote(self, cdist_object):
         """Run the code-remote script for the given cdist object on the remote side."""
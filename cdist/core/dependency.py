@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import collections
+import logging
+import os
+
+import cdist
+import cdist.core
+
+log = logging.getLogger(__name__)
+
+# Names of the objects whose requirements changed, one per line,
+# appended by the emulator
+JOURNAL_NAME = "requirement_journal"
+
+
+class CircularDependencyError(cdist.UnresolvableRequirementsError):
+    """Objects require each other"""
+
+    def __init__(self, cycle):
+        # First and last element are the same object
+        self.cycle = cycle
+
+    def __str__(self):
+        return "Circular dependency: %s" % " -> ".join(self.cycle)
+
+
+def journal_path(base_path):
+    return os.path.join(base_path, JOURNAL_NAME)
+
+
+def journal(base_path, names):
+    """Record that the requirements of the given objects changed"""
+    data = "".join(name + "\n" for name in names).encode('utf-8')
+    try:
+        # O_APPEND: a type manifest may run several emulators at once
+        fd = os.open(journal_path(base_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except EnvironmentError as e:
+        raise cdist.Error("Cannot write requirement journal: %s" % e)
+
+
+class DependencyGraph(object):
+    """Requirement graph of the objects of a run.
+
+    After every manifest the objects recorded in the journal are
+    (re)loaded and only the part of the graph reachable from them is
+    searched for cycles: a new cycle has to pass through an object
+    whose requirements changed.
+
+    The journal also lists every newly defined object, which keeps the
+    index of object names by type used for pattern requirements
+    (require="__package/*") up to date without scanning the object tree.
+
+    """
+    def __init__(self, base_path, object_base_path, type_base_path):
+        self.journal_path = journal_path(base_path)
+        self.object_base_path = object_base_path
+        self.type_base_path = type_base_path
+        self._offset = 0
+
+        # object name -> names of the objects it requires or autorequires,
+        # requirements may be patterns
+        self.edges = {}
+
+        # type name -> names of the objects of the type, for patterns
+        self.index = {}
+
+        # Number of checks that found changed objects
+        self.changes = 0
+
+    def _load(self, name):
+        path = os.path.join(self.object_base_path, name, cdist.core.OBJECT_MARKER)
+        if not os.path.isdir(path):
+            # Not (yet) defined, unresolvable requirements are reported later
+            return []
+        type_name, object_id = cdist.core.CdistObject.split_name(name)
+        cdist_object = cdist.core.CdistObject.lookup(self.object_base_path,
+            self.type_base_path, type_name, object_id)
+        return list(cdist_object.requirements) + list(cdist_object.autorequire)
+
+    def object_names(self, type_name):
+        """Return the names of all objects of the given type"""
+        if not type_name in self.index:
+            # Only scanned once, the journal tells about new objects
+            self.index[type_name] = set(cdist.core.CdistObject.list_object_names(
+                self.object_base_path, type_name))
+        return self.index[type_name]
+
+    def resolve(self, name, requirements):
+        """Return requirements with patterns replaced by the matching objects.
+
+        Patterns are resolved against the objects defined so far, an
+        object never matches its own pattern requirements. Patterns
+        matching no object are kept: like a requirement on an undefined
+        object they are never finished and are reported as unresolvable.
+
+        """
+        resolved = []
+        for requirement in requirements:
+            if cdist.core.CdistObject.is_pattern(requirement):
+                type_name, object_id = cdist.core.CdistObject.split_name(requirement)
+                matches = cdist.core.CdistObject.match_names(requirement,
+                    self.object_names(type_name))
+                if not matches:
+                    resolved.append(requirement)
+                for match in sorted(matches):
+                    if match != name:
+                        resolved.append(match)
+            else:
+                resolved.append(requirement)
+        return resolved
+
+    def successors(self, name):
+        if not name in self.edges:
+            self.edges[name] = self._load(name)
+        # Patterns match objects defined later, resolve them every time
+        return self.resolve(name, self.edges[name])
+
+    def critical_paths(self, names, cost):
+        """Return object name -> remaining critical path of the object.
+
+        The critical path of an object is its own cost plus the longest
+        critical path of the objects requiring or autorequiring it: the
+        work that can not start before the object is done.
+
+        """
+        dependents = dict((name, []) for name in names)
+        for name in names:
+            for successor in self.successors(name):
+                if successor in dependents and successor != name:
+                    dependents[successor].append(name)
+
+        paths = {}
+        for root in names:
+            if root in paths:
+                continue
+            work = [(root, iter(dependents[root]))]
+            visiting = set([root])
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    # Cycles are reported by check, just do not loop
+                    if not child in paths and not child in visiting:
+                        visiting.add(child)
+                        work.append((child, iter(dependents[child])))
+                        break
+                else:
+                    work.pop()
+                    visiting.discard(node)
+                    longest = max([paths.get(child, 0.0) for child in dependents[node]] or [0.0])
+                    paths[node] = cost(node) + longest
+        return paths
+
+    def read_journal(self):
+        """Return the names recorded in the journal since the last call"""
+        try:
+            with open(self.journal_path, "rb") as fd:
+                fd.seek(self._offset)
+                data = fd.read()
+        except EnvironmentError:
+            return set()
+        # Only consume complete lines
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        return set(data.decode('utf-8').splitlines())
+
+    def check(self):
+        """Update the graph from the journal, raise CircularDependencyError on cycles"""
+        touched = self.read_journal()
+        for name in touched:
+            self.edges.pop(name, None)
+            type_name, object_id = cdist.core.CdistObject.split_name(name)
+            if type_name in self.index:
+                self.index[type_name].add(name)
+        if touched:
+            self.changes += 1
+            log.debug("Checking %s changed object(s) for circular dependencies", len(touched))
+            self.check_from(sorted(touched))
+
+    def check_from(self, roots):
+        """Tarjan's algorithm on the part of the graph reachable from roots"""
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        counter = 0
+
+        for root in roots:
+            if root in index:
+                continue
+            # Iterative to cope with deep requirement chains
+            work = [(root, iter(self.successors(root)))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if not successor in index:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(self.successors(successor))))
+                        break
+                    elif successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = set()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.add(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self.successors(node):
+                            raise CircularDependencyError(self.cycle(node, component))
+
+    def cycle(self, start, component):
+        """Return the shortest cycle from start through component"""
+        previous = { start: None }
+        queue = collections.deque([start])
+        while queue:
+            node = queue.popleft()
+            for successor in self.successors(node):
+                if successor == start:
+                    path = [start]
+                    while node is not None:
+                        path.append(node)
+                        node = previous[node]
+                    path.reverse()
+                    return path
+                if successor in component and not successor in previous:
+                    previous[successor] = node
+                    queue.append(successor)
@@ -20,11 +20,16 @@
 #
 #
 
+import concurrent.futures
 import logging
 import os
 import glob
+import tarfile
+import tempfile
 
 import cdist
+import cdist.events
+import cdist.exec.remote
 
 '''
 common:
@@ -59,12 +64,40 @@ type explorer is:
 '''
 
 
+def ensure_newline(path):
+    """Make a non empty file end with a newline"""
+    try:
+        with open(path, "rb+") as fd:
+            fd.seek(0, os.SEEK_END)
+            if fd.tell() == 0:
+                return
+            fd.seek(-1, os.SEEK_END)
+            if fd.read(1) != b'\n':
+                fd.write(b'\n')
+    except EnvironmentError as e:
+        raise cdist.Error(str(e))
+
+
+class GlobalExplorerError(cdist.Error):
+    """One or more global explorers failed"""
+
+    def __init__(self, errors):
+        # explorer name -> error
+        self.errors = errors
+
+    def __str__(self):
+        return "Global explorer(s) failed: " + "; ".join(
+            "%s: %s" % (name, self.errors[name]) for name in sorted(self.errors))
+
+
 class Explorer(object):
     """Executes cdist explorers.
 
     """
-    def __init__(self, target_host, local, remote):
+    def __init__(self, target_host, local, remote, jobs=1, events=None):
         self.target_host = target_host
+        # Number of global explorers run at the same time
+        self.jobs = jobs
 
         self.log = logging.getLogger(target_host)
 
@@ -75,6 +108,11 @@ class Explorer(object):
             '__explorer': self.remote.global_explorer_path,
         }
         self._type_explorers_transferred = []
+        # object name -> parameters on the remote side
+        self._parameters_transferred = {}
+        if events is None:
+            events = cdist.events.Events(None, target_host)
+        self.events = events
 
     ### global
 
@@ -89,22 +127,49 @@ class Explorer(object):
         """
         self.log.info("Running global explorers")
         self.transfer_global_explorers()
-        for explorer in self.list_global_explorer_names():
-            output = self.run_global_explorer(explorer)
-            path = os.path.join(out_path, explorer)
-            with open(path, 'w') as fd:
-                fd.write(output)
+        names = self.list_global_explorer_names()
+        if self.jobs > 1 and len(names) > 1:
+            self._run_global_explorers_concurrently(names, out_path)
+        else:
+            for explorer in names:
+                self.run_global_explorer(explorer, os.path.join(out_path, explorer))
+
+    def _run_global_explorers_concurrently(self, names, out_path):
+        """Run the explorers in up to jobs remote calls at a time.
+
+        Raise GlobalExplorerError listing every failed explorer once all
+        explorers finished.
+
+        """
+        self.log.debug("Running %s global explorers, %s at a time", len(names), self.jobs)
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = dict((executor.submit(self.run_global_explorer, explorer,
+                os.path.join(out_path, explorer)), explorer) for explorer in names)
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except cdist.Error as e:
+                    errors[futures[future]] = e
+        if errors:
+            raise GlobalExplorerError(errors)
 
     def transfer_global_explorers(self):
         """Transfer the global explorers to the remote side."""
         self.remote.mkdir(self.remote.global_explorer_path)
-        self.remote.transfer(self.local.global_explorer_path, self.remote.global_explorer_path)
-        self.remote.run(["chmod", "0700", "%s/*" % (self.remote.global_explorer_path)])
+        self.remote.transfer(self.local.global_explorer_path,
+            self.remote.global_explorer_path, mode=0o700)
+
+    def run_global_explorer(self, explorer, output_path=None):
+        """Run the given global explorer and return it's output.
+
+        If output_path is given, the output is streamed into that file.
 
-    def run_global_explorer(self, explorer):
-        """Run the given global explorer and return it's output."""
+        """
         script = os.path.join(self.remote.global_explorer_path, explorer)
-        return self.remote.run_script(script, env=self.env, return_output=True)
+        with self.events.span("explorer", explorer=explorer):
+            return self.remote.run_script(script, env=self.env,
+                return_output=not output_path, output_path=output_path)
 
     ### type
 
@@ -125,13 +190,20 @@ class Explorer(object):
         self.transfer_type_explorers(cdist_object.cdist_type)
         self.log.debug("Transfering object parameters for object: %s", cdist_object.name)
         self.transfer_object_parameters(cdist_object)
+        explorer_path = cdist_object.explorers.path
         for explorer in self.list_type_explorer_names(cdist_object.cdist_type):
-            output = self.run_type_explorer(explorer, cdist_object)
             self.log.debug("Running type explorer '%s' for object '%s'", explorer, cdist_object.name)
-            cdist_object.explorers[explorer] = output
+            path = os.path.join(explorer_path, explorer)
+            self.run_type_explorer(explorer, cdist_object, path)
+            # Like cdist_object.explorers[explorer] = output
+            ensure_newline(path)
+
+    def run_type_explorer(self, explorer, cdist_object, output_path=None):
+        """Run the given type explorer for the given object and return it's output.
+
+        If output_path is given, the output is streamed into that file.
 
-    def run_type_explorer(self, explorer, cdist_object):
-        """Run the given type explorer for the given object and return it's output."""
+        """
         cdist_type = cdist_object.cdist_type
         env = self.env.copy()
         env.update({
@@ -142,7 +214,9 @@ class Explorer(object):
             '__type_explorer': os.path.join(self.remote.type_path, cdist_type.explorer_path)
         })
         script = os.path.join(self.remote.type_path, cdist_type.explorer_path, explorer)
-        return self.remote.run_script(script, env=env, return_output=True)
+        with self.events.span("explorer", explorer=explorer, object=cdist_object.name):
+            return self.remote.run_script(script, env=env,
+                return_output=not output_path, output_path=output_path)
 
     def transfer_type_explorers(self, cdist_type):
         """Transfer the type explorers for the given type to the remote side."""
@@ -153,14 +227,52 @@ class Explorer(object):
                 source = os.path.join(self.local.type_path, cdist_type.explorer_path)
                 destination = os.path.join(self.remote.type_path, cdist_type.explorer_path)
                 self.remote.mkdir(destination)
-                self.remote.transfer(source, destination)
-                self.remote.run(["chmod", "0700", "%s/*" % (destination)])
+                self.remote.transfer(source, destination, mode=0o700)
                 self._type_explorers_transferred.append(cdist_type.name)
 
+    def _parameters_to_transfer(self, cdist_object):
+        """Return the parameters of the object, if the remote side lacks them"""
+        parameters = dict(cdist_object.parameters)
+        if parameters and self._parameters_transferred.get(cdist_object.name) != parameters:
+            return parameters
+
     def transfer_object_parameters(self, cdist_object):
         """Transfer the parameters for the given object to the remote side."""
-        if cdist_object.parameters:
+        parameters = self._parameters_to_transfer(cdist_object)
+        if parameters:
             source = os.path.join(self.local.object_path, cdist_object.parameter_path)
             destination = os.path.join(self.remote.object_path, cdist_object.parameter_path)
             self.remote.mkdir(destination)
             self.remote.transfer(source, destination)
+            self._parameters_transferred[cdist_object.name] = parameters
+
+    def transfer_objects_parameters(self, cdist_objects):
+        """Transfer the parameters of the given objects to the remote side
+        in one archive.
+
+        Objects whose parameters are transferred already are skipped,
+        transfer_object_parameters only transfers parameters changed since.
+
+        """
+        pending = []
+        for cdist_object in cdist_objects:
+            parameters = self._parameters_to_transfer(cdist_object)
+            if parameters:
+                pending.append((cdist_object, parameters))
+        if not pending:
+            return
+
+        self.log.debug("Transfering parameters of %s object(s) at once", len(pending))
+        handle, archive = tempfile.mkstemp(prefix='cdist.parameters.', suffix='.tar')
+        try:
+            with os.fdopen(handle, "wb") as fd, tarfile.open(fileobj=fd, mode="w") as tar:
+                for cdist_object, parameters in pending:
+                    tar.add(os.path.join(self.local.object_path, cdist_object.parameter_path),
+                        arcname=cdist_object.parameter_path, filter=cdist.exec.remote.archive_filter)
+            self.remote.transfer_archive(archive, self.remote.object_path)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot archive object parameters: %s" % e)
+        finally:
+            os.remove(archive)
+        for cdist_object, parameters in pending:
+            self._parameters_transferred[cdist_object.name] = parameters
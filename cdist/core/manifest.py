@@ -20,10 +20,14 @@
 #
 #
 
+import io
 import logging
 import os
+import traceback
 
 import cdist
+import cdist.events
+import cdist.message
 
 '''
 common:
@@ -47,6 +51,7 @@ initial manifest is:
 
 type manifeste is:
     script: full qualified path to the type manifest
+        (manifest.py is run as python manifest instead, if it exists)
 
     env:
         __object: full qualified path to the object's dir
@@ -55,6 +60,13 @@ type manifeste is:
         __type: full qualified path to the type's dir
 
     creates: new objects through type emulator
+
+python manifest is:
+    an initial manifest ending in .py or a type's manifest.py
+
+    runs inside cdist, see PythonManifest
+
+    creates: new objects through the emulator code, without a process per object
 '''
 
 class NoInitialManifestError(cdist.Error):
@@ -81,13 +93,117 @@ class NoInitialManifestError(cdist.Error):
         return repr(self.message)
 
 
+class PythonManifest(object):
+    """A manifest written in python, run inside the cdist process.
+
+    The manifest is executed with these names defined:
+
+        define(type_name, object_id=None, require=None, stdin=None, **parameters)
+            Define an object like the type command of the same name and
+            return its name. Underscores in parameter names are dashes,
+            True sets a boolean parameter, lists give multiple values.
+        env
+            The environment a shell manifest gets, changes (like
+            CDIST_ORDER_DEPENDENCY) apply to the following objects
+        explorer(name)
+            Output of the global explorer name
+        target_host
+            The host we are working on
+
+    Like in shell manifests, env contains __messages_in and
+    __messages_out for messaging between types.
+
+    """
+    def __init__(self, path, env, log):
+        self.path = path
+        self.env = env
+        self.log = log
+        self.changed_objects = []
+
+    def explorer(self, name):
+        try:
+            with open(os.path.join(self.env['__explorer'], name), "r", encoding="utf-8") as fd:
+                return fd.read()
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot read global explorer %s: %s" % (name, e))
+
+    def define(self, type_name, object_id=None, require=None, stdin=None, **parameters):
+        import cdist.emulator
+
+        argv = [type_name]
+        if object_id is not None:
+            argv.append(object_id)
+        cdist_type = cdist.core.CdistType(self.env['__cdist_type_base_path'], type_name)
+        known = set(cdist_type.required_parameters + cdist_type.required_multiple_parameters +
+            cdist_type.optional_parameters + cdist_type.optional_multiple_parameters +
+            cdist_type.boolean_parameters)
+        for key, value in sorted(parameters.items()):
+            name = key if key in known else key.replace('_', '-')
+            if value is True:
+                argv.append("--" + name)
+            elif isinstance(value, (list, tuple)):
+                for item in value:
+                    argv.extend(("--" + name, str(item)))
+            elif value is not None and value is not False:
+                argv.extend(("--" + name, str(value)))
+
+        env = dict(self.env)
+        if require:
+            env['require'] = require if isinstance(require, str) else " ".join(require)
+        if isinstance(stdin, str):
+            stdin = stdin.encode('utf-8')
+        if stdin is not None:
+            stdin = io.BytesIO(stdin)
+
+        emulator = cdist.emulator.Emulator(argv, stdin=stdin, env=env, log=self.log)
+        try:
+            emulator.define()
+        except SystemExit:
+            # argparse already printed the usage
+            raise cdist.Error("%s: invalid arguments for %s: %s"
+                % (self.path, type_name, " ".join(argv[1:])))
+        self.changed_objects.extend(emulator.changed_objects)
+        return emulator.cdist_object.name
+
+    def run(self):
+        try:
+            with open(self.path, "r") as fd:
+                code = compile(fd.read(), self.path, 'exec')
+        except (EnvironmentError, SyntaxError) as e:
+            raise cdist.Error("Cannot load python manifest %s: %s" % (self.path, e))
+
+        namespace = {
+            '__file__': self.path,
+            '__name__': '__cdist_manifest__',
+            'define': self.define,
+            'env': self.env,
+            'explorer': self.explorer,
+            'target_host': self.env['__target_host'],
+        }
+        try:
+            exec(code, namespace)
+        except cdist.Error:
+            raise
+        except Exception as e:
+            self.log.debug(traceback.format_exc())
+            lines = [frame.lineno for frame in traceback.extract_tb(e.__traceback__)
+                if frame.filename == self.path]
+            raise cdist.Error("%s:%s: %s: %s" % (self.path, lines[-1] if lines else '?',
+                e.__class__.__name__, e))
+        finally:
+            cdist.core.dependency.journal(self.env['__global'], self.changed_objects)
+
+
 class Manifest(object):
     """Executes cdist manifests.
 
     """
-    def __init__(self, target_host, local):
+    def __init__(self, target_host, local, events=None):
         self.target_host = target_host
         self.local = local
+        if events is None:
+            events = cdist.events.Events(None, target_host)
+        self.events = events
 
         self.log = logging.getLogger(self.target_host)
 
@@ -101,6 +217,15 @@ class Manifest(object):
             self.env.update({'__cdist_debug': "yes" })
 
 
+    def run_python_manifest(self, path, env, message_prefix):
+        """Run a python manifest with messaging like run_script"""
+        message = cdist.message.Message(message_prefix, self.local.messages_path)
+        env.update(message.env)
+        try:
+            PythonManifest(path, env, self.log).run()
+        finally:
+            message.merge_messages()
+
     def env_initial_manifest(self, initial_manifest):
         env = os.environ.copy()
         env.update(self.env)
@@ -117,13 +242,22 @@ class Manifest(object):
         else:
             user_supplied = True
 
+        if (not user_supplied and not os.path.isfile(initial_manifest) and
+            os.path.isfile(initial_manifest + ".py")):
+            initial_manifest += ".py"
+
         self.log.info("Running initial manifest " + initial_manifest)
 
         if not os.path.isfile(initial_manifest):
             raise NoInitialManifestError(initial_manifest, user_supplied)
 
         message_prefix="initialmanifest"
-        self.local.run_script(initial_manifest, env=self.env_initial_manifest(initial_manifest), message_prefix=message_prefix)
+        with self.events.span("manifest", manifest=initial_manifest):
+            env = self.env_initial_manifest(initial_manifest)
+            if initial_manifest.endswith(".py"):
+                self.run_python_manifest(initial_manifest, env, message_prefix)
+            else:
+                self.local.run_script(initial_manifest, env=env, message_prefix=message_prefix)
 
     def env_type_manifest(self, cdist_object):
         type_manifest = os.path.join(self.local.type_path, cdist_object.cdist_type.manifest_path)
@@ -136,12 +270,20 @@ class Manifest(object):
             '__object_id': cdist_object.object_id,
             '__object_name': cdist_object.name,
             '__type': cdist_object.cdist_type.absolute_path,
+            '__explorer': self.local.global_explorer_out_path,
         })
 
         return env
 
     def run_type_manifest(self, cdist_object):
         type_manifest = os.path.join(self.local.type_path, cdist_object.cdist_type.manifest_path)
+        python_manifest = os.path.join(self.local.type_path, cdist_object.cdist_type.python_manifest_path)
         message_prefix = cdist_object.name
-        if os.path.isfile(type_manifest):
-            self.local.run_script(type_manifest, env=self.env_type_manifest(cdist_object), message_prefix=message_prefix)
+        if os.path.isfile(python_manifest):
+            with self.events.span("manifest", manifest=python_manifest, object=cdist_object.name):
+                env = self.env_type_manifest(cdist_object)
+                env['__cdist_manifest'] = python_manifest
+                self.run_python_manifest(python_manifest, env, message_prefix)
+        elif os.path.isfile(type_manifest):
+            with self.events.span("manifest", manifest=type_manifest, object=cdist_object.name):
+                self.local.run_script(type_manifest, env=self.env_type_manifest(cdist_object), message_prefix=message_prefix)
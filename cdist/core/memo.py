@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+'''
+Share the output of gencode scripts between the hosts of a run.
+
+The output of a gencode script is reused if the script, the type, the
+object id, the files of the object (parameters, explorer results, stdin)
+and the global explorers the script reads are the same. Scripts that
+use anything else that may differ between hosts are never shared:
+
+    __target_host                   the name of the host
+    __global, except __global/explorer/NAME
+                                    other objects, the host's output dir
+    __messages_in, __messages_out   messaging between objects
+
+Scripts that (may) write to the object directory are not shared
+either, as other hosts would miss these files.
+
+As this is decided from the text of the scripts, scripts that get
+host specific data in another way (hostname, files of other objects,
+sourced helpers) would be shared wrongly. Sharing is therefore only
+enabled with cdist config --share-gencode.
+
+'''
+
+GLOBAL_EXPLORER_RE = re.compile(r'\$\{?__global\}?"?/explorer/([A-Za-z0-9_.-]+)')
+GLOBAL_RE = re.compile(r'__global')
+UNSHARED_RE = re.compile(r'__target_host|__messages_in|__messages_out')
+OBJECT_WRITE_RE = re.compile(r'>>?\s*"?\$\{?__object\b|'
+    r'\b(mkdir|touch|cp|mv|rm|ln|tee|install)\b[^\n]*\$\{?__object\b')
+
+# Files of an object that do not influence gencode
+OBJECT_FILES_IGNORED = ('state', 'source', 'code-local', 'code-remote')
+
+
+class GencodeMemo(object):
+    """A directory shared by the host processes of a run"""
+
+    # Seconds to wait for another host computing the same output
+    wait_max = 300
+    wait_interval = 0.05
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+
+        # script path -> (digest, global explorers) or None if not sharable
+        self._scripts = {}
+
+    def _script_info(self, script):
+        if not script in self._scripts:
+            try:
+                with open(script, "rb") as fd:
+                    content = fd.read()
+            except EnvironmentError:
+                content = None
+            info = None
+            if content is not None:
+                text = content.decode('utf-8', 'replace')
+                explorers = set(GLOBAL_EXPLORER_RE.findall(text))
+                if (not UNSHARED_RE.search(text) and
+                    not OBJECT_WRITE_RE.search(text) and
+                    len(GLOBAL_RE.findall(text)) == len(GLOBAL_EXPLORER_RE.findall(text))):
+                    info = (hashlib.sha256(content).hexdigest(), sorted(explorers))
+                else:
+                    log.debug("Not sharing output of %s between hosts", script)
+            self._scripts[script] = info
+        return self._scripts[script]
+
+    @staticmethod
+    def _hash_tree(digest, path):
+        for directory, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(directory, name)
+                relative = os.path.relpath(file_path, path)
+                if relative in OBJECT_FILES_IGNORED:
+                    continue
+                digest.update(relative.encode('utf-8') + b'\0')
+                with open(file_path, "rb") as fd:
+                    digest.update(hashlib.sha256(fd.read()).digest())
+
+    def key(self, script, which, cdist_object, global_explorer_path):
+        """Return the key of the output of the script or None if it may not be shared"""
+        info = self._script_info(script)
+        if not info:
+            return None
+        script_digest, explorers = info
+
+        digest = hashlib.sha256()
+        for part in (which, script_digest, cdist_object.cdist_type.name, cdist_object.object_id):
+            digest.update(part.encode('utf-8') + b'\0')
+        try:
+            self._hash_tree(digest, cdist_object.absolute_path)
+            for explorer in explorers:
+                digest.update(explorer.encode('utf-8') + b'\0')
+                explorer_path = os.path.join(global_explorer_path, explorer)
+                if os.path.isfile(explorer_path):
+                    with open(explorer_path, "rb") as fd:
+                        digest.update(hashlib.sha256(fd.read()).digest())
+        except EnvironmentError as e:
+            log.debug("Not sharing output of %s for %s: %s", script, cdist_object.name, e)
+            return None
+        return digest.hexdigest()
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self.path, key), "r") as fd:
+                return fd.read()
+        except EnvironmentError:
+            return None
+
+    def _publish(self, key, output):
+        temp_path = os.path.join(self.path, "%s.%d.tmp" % (key, os.getpid()))
+        try:
+            with open(temp_path, "w") as fd:
+                fd.write(output)
+            # Atomic: readers see the complete output or nothing
+            os.rename(temp_path, os.path.join(self.path, key))
+        except EnvironmentError as e:
+            log.debug("Cannot share gencode output %s: %s", key, e)
+
+    def get(self, key, compute):
+        """Return the output stored under key, call compute() to create it.
+
+        Only one host computes an output, the others wait for it. If that
+        host fails or dies, the next waiting one computes the output.
+
+        """
+        output = self._read(key)
+        if output is not None:
+            self.hits += 1
+            return output
+
+        # The kernel releases the lock if the host holding it dies
+        lock_path = os.path.join(self.path, key + ".lock")
+        try:
+            lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        except EnvironmentError as e:
+            log.debug("Cannot lock gencode output %s: %s", key, e)
+            return compute()
+
+        try:
+            waited = 0
+            while True:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if waited >= self.wait_max:
+                        log.debug("Gave up waiting for gencode output %s", key)
+                        return compute()
+                    time.sleep(self.wait_interval)
+                    waited += self.wait_interval
+
+            # Computed by another host while we waited
+            output = self._read(key)
+            if output is not None:
+                self.hits += 1
+                return output
+
+            output = compute()
+            if output is not None:
+                self._publish(key, output)
+            return output
+        finally:
+            os.close(lock_fd)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+import logging
+import os
+
+import cdist
+import cdist.core
+
+log = logging.getLogger(__name__)
+
+# Saved in the run directory and thereby in the cache of the host
+TIMINGS_NAME = "timings"
+
+# Phases of an object: object_prepare and object_run of Config
+PREPARE = "prepare"
+RUN = "run"
+PHASES = (PREPARE, RUN)
+
+
+class Timings(object):
+    """Time spent preparing and running the objects of a host.
+
+    The timings of the last run, taken from the cache of the host,
+    are used to estimate how long objects take in this run.
+
+    """
+    def __init__(self, base_path, cache_path=None):
+        self.path = os.path.join(base_path, TIMINGS_NAME)
+
+        # object name -> phase (PREPARE, RUN) -> seconds
+        self.current = {}
+        self.previous = {}
+        if cache_path:
+            self.previous = self.load(os.path.join(cache_path, TIMINGS_NAME))
+
+        # Objects that did not exist in the last run are estimated by
+        # the average of their type or of all objects
+        by_type = {}
+        overall = {}
+        for name, phases in self.previous.items():
+            type_name, object_id = cdist.core.CdistObject.split_name(name)
+            for phase, duration in phases.items():
+                by_type.setdefault(type_name, {}).setdefault(phase, []).append(duration)
+                overall.setdefault(phase, []).append(duration)
+        self.type_average = dict((type_name, self._average(phases))
+            for type_name, phases in by_type.items())
+        self.average = self._average(overall)
+
+    @staticmethod
+    def _average(phases):
+        return dict((phase, sum(durations) / len(durations))
+            for phase, durations in phases.items())
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as fd:
+                return json.load(fd)
+        except (EnvironmentError, ValueError) as e:
+            log.debug("No timings from %s: %s", path, e)
+            return {}
+
+    def save(self):
+        try:
+            with open(self.path, "w") as fd:
+                json.dump(self.current, fd, indent=1, sort_keys=True)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot save timings to %s: %s" % (self.path, e))
+
+    def record(self, name, phase, duration):
+        phases = self.current.setdefault(name, {})
+        phases[phase] = phases.get(phase, 0.0) + duration
+
+    def estimate(self, name, phases=PHASES):
+        """Return the expected duration of the given phases of an object in seconds"""
+        if name in self.previous:
+            known = self.previous[name]
+        else:
+            type_name, object_id = cdist.core.CdistObject.split_name(name)
+            known = self.type_average.get(type_name, self.average)
+        return sum(known.get(phase, 0.0) for phase in phases)
@@ -22,11 +22,16 @@
 #
 
 import argparse
+import fcntl
+import hashlib
 import logging
 import os
+import re
+import shlex
 import sys
 
 import cdist
+import cdist.profile
 from cdist import core
 
 class MissingRequiredEnvironmentVariableError(cdist.Error):
@@ -53,13 +58,16 @@ class DefaultList(list):
 
 
 class Emulator(object):
-    def __init__(self, argv, stdin=sys.stdin.buffer, env=os.environ):
+    def __init__(self, argv, stdin=sys.stdin.buffer, env=os.environ, log=None):
         self.argv           = argv
         self.stdin          = stdin
         self.env            = env
 
         self.object_id      = ''
 
+        # Objects whose requirements are changed by this run
+        self.changed_objects = []
+
         try:
             self.global_path    = self.env['__global']
             self.target_host    = self.env['__target_host']
@@ -73,15 +81,28 @@ class Emulator(object):
 
         self.object_base_path = os.path.join(self.global_path, "object")
         self.typeorder_path = os.path.join(self.global_path, "typeorder")
+        self.order_path = os.path.join(self.global_path, "order")
+        # Name of the object defined before this one in the same manifest
+        self.previous_object = None
 
         self.type_name      = os.path.basename(argv[0])
         self.cdist_type     = core.CdistType(self.type_base_path, self.type_name)
 
-        self.__init_log()
+        if log:
+            # Running inside cdist, which has set up logging already
+            self.log = log
+        else:
+            self.__init_log()
 
     def run(self):
         """Emulate type commands (i.e. __file and co)"""
 
+        with cdist.profile.Profile.from_env(self.env, "emulator", self.target_host):
+            self.define()
+            self.record_journal()
+
+    def define(self):
+        """Create the object without recording it in the journal"""
         self.commandline()
         self.setup_object()
         self.save_stdin()
@@ -102,7 +123,8 @@ class Emulator(object):
     def commandline(self):
         """Parse command line"""
 
-        parser = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+        parser = argparse.ArgumentParser(prog=self.type_name, add_help=False,
+            argument_default=argparse.SUPPRESS)
 
         for parameter in self.cdist_type.required_parameters:
             argument = "--" + parameter
@@ -150,6 +172,8 @@ class Emulator(object):
                 raise cdist.Error("Object %s already exists with conflicting parameters:\n%s: %s\n%s: %s"
                     % (self.cdist_object.name, " ".join(self.cdist_object.source), self.cdist_object.parameters, self.object_source, self.parameters)
             )
+            if "CDIST_ORDER_DEPENDENCY" in self.env:
+                self.record_order(created=False)
         else:
             if self.cdist_object.exists:
                 self.log.debug('Object %s override forced with CDIST_OVERRIDE',self.cdist_object.name)
@@ -160,10 +184,40 @@ class Emulator(object):
             # record the created object in typeorder file
             with open(self.typeorder_path, 'a') as typeorderfile:
                 print(self.cdist_object.name, file=typeorderfile)
+            if "CDIST_ORDER_DEPENDENCY" in self.env:
+                self.record_order()
 
         # Record / Append source
         self.cdist_object.source.append(self.object_source)
 
+    def _order_record_path(self):
+        """One record per manifest: the initial manifest or the type
+        manifest of one object"""
+        scope = "%s\0%s" % (self.object_source, self.env.get('__object_name', ''))
+        return os.path.join(self.order_path,
+            hashlib.sha1(scope.encode('utf-8')).hexdigest())
+
+    def record_order(self, created=True):
+        """Remember the object created before this one in the same manifest
+        for CDIST_ORDER_DEPENDENCY and, if created, this one as the last
+        """
+        try:
+            os.makedirs(self.order_path, exist_ok=True)
+            fd = os.open(self._order_record_path(), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                # Emulators of one manifest may run at the same time
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                previous = os.read(fd, 4096).decode('utf-8')
+                if created:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.ftruncate(fd, 0)
+                    os.write(fd, self.cdist_object.name.encode('utf-8'))
+            finally:
+                os.close(fd)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot record creation order: %s" % e)
+        self.previous_object = previous or None
+
     chunk_size = 65536
     def _read_stdin(self):
         return self.stdin.read(self.chunk_size)
@@ -173,7 +227,7 @@ class Emulator(object):
         $__object/stdin so it can be accessed in manifest and gencode-*
         scripts.
         """
-        if not self.stdin.isatty():
+        if self.stdin is not None and not self.stdin.isatty():
             try:
                 # go directly to file instead of using CdistObject's api
                 # as that does not support streaming
@@ -189,22 +243,18 @@ class Emulator(object):
     def record_requirements(self):
         """record requirements"""
 
+        self.changed_objects.append(self.cdist_object.name)
+
         # Inject the predecessor, but not if its an override (this would leed to an circular dependency)
         if "CDIST_ORDER_DEPENDENCY" in self.env and not 'CDIST_OVERRIDE' in self.env:
-            # load object name created bevor this one from typeorder file ...
-            with open(self.typeorder_path, 'r') as typecreationfile:
-                typecreationorder = typecreationfile.readlines()
-                # get the type created bevore this one ...
-                try:
-                    lastcreatedtype = typecreationorder[-2].strip()
-                    if 'require' in self.env:
-                        self.env['require'] += " " + lastcreatedtype
-                    else:
-                        self.env['require'] = lastcreatedtype
-                    self.log.debug("Injecting require for CDIST_ORDER_DEPENDENCY: %s for %s", lastcreatedtype, self.cdist_object.name)
-                except IndexError:
-                    # if no second last line, we are on the first type, so do not set a requirement
-                    pass
+            # The object created before this one, if this is not the first
+            lastcreatedtype = self.previous_object
+            if lastcreatedtype and lastcreatedtype != self.cdist_object.name:
+                if 'require' in self.env:
+                    self.env['require'] += " " + lastcreatedtype
+                else:
+                    self.env['require'] = lastcreatedtype
+                self.log.debug("Injecting require for CDIST_ORDER_DEPENDENCY: %s for %s", lastcreatedtype, self.cdist_object.name)
 
 
         if "require" in self.env:
@@ -214,6 +264,10 @@ class Emulator(object):
                 # Ignore empty fields - probably the only field anyway
                 if len(requirement) == 0: continue
 
+                if core.CdistObject.is_pattern(requirement):
+                    self.record_pattern_requirement(requirement)
+                    continue
+
                 # Raises an error, if object cannot be created
                 try:
                     cdist_object = self.cdist_object.object_from_name(requirement)
@@ -231,6 +285,31 @@ class Emulator(object):
                 # This ensures pattern matching is done against sanitised list
                 self.cdist_object.requirements.append(cdist_object.name)
 
+    def record_pattern_requirement(self, pattern):
+        """Record a requirement like __package/*, which is resolved by cdist config"""
+        type_name, object_id = core.CdistObject.split_name(pattern)
+        if core.CdistObject.is_pattern(type_name):
+            raise cdist.Error("%s requires %s, but only object ids can be patterns. Defined at %s"
+                % (self.cdist_object.name, pattern, self.object_source))
+        try:
+            cdist_type = core.CdistType(self.type_base_path, type_name)
+        except core.cdist_type.NoSuchTypeError as e:
+            self.log.error("%s requires objects %s, but type %s does not exist. Defined at %s"  % (self.cdist_object.name, pattern, e.name, self.object_source))
+            raise
+        if cdist_type.is_singleton:
+            raise cdist.Error("%s requires %s, but %s is a singleton type without object ids. Defined at %s"
+                % (self.cdist_object.name, pattern, type_name, self.object_source))
+
+        # Sanitise like object ids (__file//etc/* => __file/etc/*)
+        if object_id.startswith('/'):
+            object_id = object_id[1:]
+        if object_id.endswith('/'):
+            object_id = object_id[:-1]
+        pattern = core.CdistObject.join_name(type_name, object_id)
+
+        self.log.debug("Recording pattern requirement: %s", pattern)
+        self.cdist_object.requirements.append(pattern)
+
     def record_auto_requirements(self):
         """An object shall automatically depend on all objects that it defined in it's type manifest.
         """
@@ -246,3 +325,76 @@ class Emulator(object):
             # Must prevent circular dependencies.
             if not parent.name in current_object.requirements:
                 parent.autorequire.append(current_object.name)
+                self.changed_objects.append(parent.name)
+
+    def record_journal(self):
+        """Tell cdist config which objects to check for circular dependencies"""
+        core.dependency.journal(self.global_path, self.changed_objects)
+
+
+class BulkEmulator(object):
+    """Define many objects in one process, one per line of stdin.
+
+    Every line is a type command in shell syntax, optionally preceded by
+    variables for this object only:
+
+        __file /etc/motd --source /srv/motd
+        require="__package/ntp" __file /etc/ntp.conf --source /srv/ntp.conf
+
+    Objects are validated and created like by the type emulator, but
+    they cannot read stdin.
+
+    """
+    assignment_re = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)=(.*)$', re.DOTALL)
+
+    def __init__(self, argv, stdin=sys.stdin, env=os.environ):
+        self.argv = argv
+        self.stdin = stdin
+        self.env = env
+
+        try:
+            self.global_path = self.env['__global']
+            self.target_host = self.env['__target_host']
+            self.object_source = self.env['__cdist_manifest']
+        except KeyError as e:
+            raise MissingRequiredEnvironmentVariableError(e.args[0])
+
+        self.log = logging.getLogger(self.target_host)
+
+    def definitions(self):
+        """Yield the line number, environment and argv of every object"""
+        for lineno, line in enumerate(self.stdin, 1):
+            try:
+                words = shlex.split(line, comments=True)
+            except ValueError as e:
+                raise cdist.Error("%s:%d: %s" % (cdist.DEFINE_COMMAND, lineno, e))
+            env = dict(self.env)
+            while words:
+                match = self.assignment_re.match(words[0])
+                if not match:
+                    break
+                env[match.group(1)] = match.group(2)
+                words.pop(0)
+            if not words:
+                continue
+            if not words[0].startswith("__"):
+                raise cdist.Error("%s:%d: %s is not a type" % (cdist.DEFINE_COMMAND, lineno, words[0]))
+            yield lineno, env, words
+
+    def run(self):
+        """Create the objects and record them in the journal at once"""
+        changed_objects = []
+        defined = 0
+        with cdist.profile.Profile.from_env(self.env, "emulator", self.target_host):
+            for lineno, env, argv in self.definitions():
+                emulator = Emulator(argv, stdin=None, env=env)
+                try:
+                    emulator.define()
+                except SystemExit:
+                    # argparse already printed the usage
+                    raise cdist.Error("%s:%d: invalid arguments for %s"
+                        % (cdist.DEFINE_COMMAND, lineno, argv[0]))
+                changed_objects.extend(emulator.changed_objects)
+                defined += 1
+            core.dependency.journal(self.global_path, changed_objects)
+        self.log.debug("Defined %d objects", defined)
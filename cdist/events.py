@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+import cdist
+
+'''
+Events are written as one json object per line (NDJSON) while cdist is
+running, for dashboards and other tools following the progress of a run.
+
+Every event has the fields time (seconds since the epoch), event and,
+except for the run events of the main process, host. Spans emit NAME_started
+when they begin and NAME_finished with duration, status (ok or failed)
+and error (if failed) when they end:
+
+    run_started, run_finished       the main process: hosts, failed
+    host_started, host_finished     configuring one host
+    stage_started, stage_finished   stage and object (see --trace)
+    explorer_started, explorer_finished     explorer and object
+    manifest_started, manifest_finished     manifest and object
+    code_started, code_finished     object and script (gencode-local,
+                                    gencode-remote, code-local, code-remote)
+    object_prepared, object_run     object and duration, object_run
+                                    also tells if the object changed
+'''
+
+STDOUT = "-"
+
+
+class Events(object):
+    """Emit the events of one target host (or the run, without host).
+
+    Events without a path are disabled and emit nothing.
+
+    """
+    def __init__(self, path, target_host=None):
+        self.path = path
+        self.target_host = target_host
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @classmethod
+    def start(cls, path):
+        """Truncate the events file for a new run"""
+        if path and path != STDOUT:
+            try:
+                with open(path, "w"):
+                    pass
+            except EnvironmentError as e:
+                raise cdist.Error("Cannot create events file %s: %s" % (path, e))
+
+    def _write(self, line):
+        data = line.encode('utf-8')
+        try:
+            if self.path == STDOUT:
+                sys.stdout.flush()
+                os.write(sys.stdout.fileno(), data)
+            else:
+                # O_APPEND: parallel host processes share the file
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot write event: %s" % e)
+
+    def emit(self, event, **fields):
+        if not self.enabled:
+            return
+        fields['time'] = time.time()
+        fields['event'] = event
+        if self.target_host:
+            fields['host'] = self.target_host
+        self._write(json.dumps(fields, sort_keys=True) + "\n")
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        """Emit NAME_started and NAME_finished around the with block"""
+        if not self.enabled:
+            yield
+            return
+
+        self.emit(name + "_started", **fields)
+        start = time.time()
+        try:
+            yield
+        except BaseException as e:
+            fields['status'] = "failed"
+            fields['error'] = str(e)
+            raise
+        else:
+            fields['status'] = "ok"
+        finally:
+            fields['duration'] = time.time() - start
+            self.emit(name + "_finished", **fields)
@@ -20,6 +20,7 @@
 #
 #
 
+import collections
 import io
 import os
 import sys
@@ -28,11 +29,32 @@ import subprocess
 import shutil
 import logging
 import tempfile
+import time
 
 import cdist
 import cdist.message
+import cdist.exec.pool
+import cdist.exec.stats
 from cdist import core
 
+# Parts of a conf dir linked into the conf path
+CONF_SUB_DIRS = ("explorer", "manifest", "type")
+
+# Written by save_cache: when the cached run of a host finished
+RUN_STAMP = "run-stamp"
+
+
+def dist_conf_dir():
+    return os.path.abspath(os.path.join(os.path.dirname(cdist.__file__), "conf"))
+
+
+def home_dir():
+    if 'HOME' in os.environ:
+        return os.path.join(os.environ['HOME'], ".cdist")
+    else:
+        return None
+
+
 class Local(object):
     """Execute commands locally.
 
@@ -45,10 +67,17 @@ class Local(object):
                  exec_path=sys.argv[0],
                  initial_manifest=None,
                  base_path=None,
-                 add_conf_dirs=None):
+                 add_conf_dirs=None,
+                 stats=None,
+                 link_plan=None,
+                 shell_pool=False):
 
         self.target_host = target_host
 
+        if stats is None:
+            stats = cdist.exec.stats.Stats(target_host)
+        self.stats = stats
+
         # FIXME: stopped: create base that does not require moving later
         if base_path:
             self.base_path = base_path
@@ -63,6 +92,15 @@ class Local(object):
 
         self._add_conf_dirs = add_conf_dirs
 
+        # Links of the conf path, precomputed for all hosts of a run
+        self._link_plan = link_plan
+
+        # Warm shells for run_script
+        self.shell_pool = None
+        if shell_pool:
+            self.shell_pool = cdist.exec.pool.ShellPool(
+                os.environ.get('CDIST_LOCAL_SHELL', "/bin/sh"))
+
         self._init_log()
         self._init_permissions()
         self._init_paths()
@@ -71,14 +109,11 @@ class Local(object):
 
     @property
     def dist_conf_dir(self):
-        return os.path.abspath(os.path.join(os.path.dirname(cdist.__file__), "conf"))
+        return dist_conf_dir()
 
     @property
     def home_dir(self):
-        if 'HOME' in os.environ:
-            return os.path.join(os.environ['HOME'], ".cdist")
-        else:
-            return None
+        return home_dir()
 
     def _init_log(self):
         self.log = logging.getLogger(self.target_host)
@@ -104,23 +139,50 @@ class Local(object):
         self.type_path = os.path.join(self.conf_path, "type")
 
     def _init_conf_dirs(self):
-        self.conf_dirs = []
+        self.conf_dirs = self.find_conf_dirs(self._add_conf_dirs)
+
+    @staticmethod
+    def find_conf_dirs(add_conf_dirs=None):
+        """Return the conf dirs to use, the last one wins"""
+        conf_dirs = []
 
-        self.conf_dirs.append(self.dist_conf_dir)
+        conf_dirs.append(dist_conf_dir())
 
         # Is the default place for user created explorer, type and manifest
-        if self.home_dir:
-            self.conf_dirs.append(self.home_dir)
+        if home_dir():
+            conf_dirs.append(home_dir())
 
         # Add directories defined in the CDIST_PATH environment variable
         if 'CDIST_PATH' in os.environ:
             cdist_path_dirs = re.split(r'(?<!\\):', os.environ['CDIST_PATH'])
             cdist_path_dirs.reverse()
-            self.conf_dirs.extend(cdist_path_dirs)
+            conf_dirs.extend(cdist_path_dirs)
 
         # Add command line supplied directories
-        if self._add_conf_dirs:
-            self.conf_dirs.extend(self._add_conf_dirs)
+        if add_conf_dirs:
+            conf_dirs.extend(add_conf_dirs)
+
+        return conf_dirs
+
+    @staticmethod
+    def plan_conf_links(conf_dirs):
+        """Return the links of the conf path as [(sub_dir, entry, source)].
+
+        If several conf dirs contain the same entry, the last one wins.
+
+        """
+        links = collections.OrderedDict()
+        for conf_dir in conf_dirs:
+            for sub_dir in CONF_SUB_DIRS:
+                current_dir = os.path.join(conf_dir, sub_dir)
+
+                # Allow conf dirs to contain only partial content
+                if not os.path.exists(current_dir):
+                    continue
+
+                for entry in os.listdir(current_dir):
+                    links[(sub_dir, entry)] = os.path.abspath(os.path.join(current_dir, entry))
+        return [(sub_dir, entry, src) for (sub_dir, entry), src in links.items()]
 
     def _init_directories(self):
         self.mkdir(self.conf_path)
@@ -171,10 +233,11 @@ class Local(object):
             env.update(message.env)
 
         try:
-            if return_output:
-                return subprocess.check_output(command, env=env).decode()
-            else:
-                subprocess.check_call(command, env=env)
+            with self.stats.measure(cdist.exec.stats.LOCAL, command):
+                if return_output:
+                    return subprocess.check_output(command, env=env).decode()
+                else:
+                    subprocess.check_call(command, env=env)
         except subprocess.CalledProcessError:
             raise cdist.Error("Command failed: " + " ".join(command))
         except OSError as error:
@@ -183,23 +246,60 @@ class Local(object):
             if message_prefix:
                 message.merge_messages()
 
-    def run_script(self, script, env=None, return_output=False, message_prefix=None):
+    def run_script(self, script, env=None, return_output=False, message_prefix=None,
+            stream=False):
         """Run the given script with the given environment.
         Return the output as a string.
 
+        With stream, the output is written while the script runs and the
+        shell pool is not used, as it buffers the output.
+
         """
         command = [ os.environ.get('CDIST_LOCAL_SHELL',"/bin/sh") , "-e"]
         command.append(script)
 
-        return self.run(command=command, env=env, return_output=return_output, message_prefix=message_prefix)
+        if not self.shell_pool or stream:
+            return self.run(command=command, env=env, return_output=return_output, message_prefix=message_prefix)
 
-    def save_cache(self):
+        self.log.debug("Local run in shell pool: %s", command)
+        if env is None:
+            env = os.environ.copy()
+        env['__target_host'] = self.target_host
+
+        if message_prefix:
+            message = cdist.message.Message(message_prefix, self.messages_path)
+            env.update(message.env)
+
+        try:
+            with self.stats.measure(cdist.exec.stats.LOCAL_POOL, command):
+                status, output = self.shell_pool.run(script, env)
+            if status != 0:
+                raise cdist.Error("Command failed: " + " ".join(command))
+            if return_output:
+                return output.decode()
+            sys.stdout.flush()
+            sys.stdout.buffer.write(output)
+            sys.stdout.buffer.flush()
+        finally:
+            if message_prefix:
+                message.merge_messages()
+
+    def close(self):
+        """Stop the warm shells, if any"""
+        if self.shell_pool:
+            self.shell_pool.close()
+
+    @property
+    def host_cache_path(self):
+        """Where save_cache keeps base_path of the last run of the host"""
         if os.path.isabs(self.target_host):
             hostdir = self.target_host[1:]
         else:
             hostdir = self.target_host
+        return os.path.join(self.cache_path, hostdir)
 
-        destination = os.path.join(self.cache_path, hostdir)
+    def save_cache(self):
+        destination = self.host_cache_path
         self.log.debug("Saving " + self.base_path + " to " + destination)
 
         try:
@@ -208,6 +308,9 @@ class Local(object):
         except PermissionError as e:
             raise cdist.Error("Cannot delete old cache %s: %s" % (destination, e))
 
+        with open(os.path.join(self.base_path, RUN_STAMP), "w") as fd:
+            fd.write("%f\n" % time.time())
+
         shutil.move(self.base_path, destination)
 
     def _create_messages(self):
@@ -217,33 +320,26 @@ class Local(object):
 
     def _create_conf_path_and_link_conf_dirs(self):
         # Link destination directories
-        for sub_dir in [ "explorer", "manifest", "type" ]:
+        for sub_dir in CONF_SUB_DIRS:
             self.mkdir(os.path.join(self.conf_path, sub_dir))
 
-        # Iterate over all directories and link the to the output dir
-        for conf_dir in self.conf_dirs:
-            self.log.debug("Checking conf_dir %s ..." % (conf_dir))
-            for sub_dir in [ "explorer", "manifest", "type" ]:
-                current_dir = os.path.join(conf_dir, sub_dir)
+        link_plan = self._link_plan
+        if link_plan is None:
+            link_plan = self.plan_conf_links(self.conf_dirs)
 
-                # Allow conf dirs to contain only partial content
-                if not os.path.exists(current_dir):
-                    continue
+        # Link all entries of the conf dirs to the output dir
+        for sub_dir, entry, src in link_plan:
+            dst = os.path.join(self.conf_path, sub_dir, entry)
 
-                for entry in os.listdir(current_dir):
-                    rel_entry_path = os.path.join(sub_dir, entry)
-                    src = os.path.abspath(os.path.join(conf_dir, sub_dir, entry))
-                    dst = os.path.join(self.conf_path, sub_dir, entry)
-
-                    # Already exists? remove and link
-                    if os.path.exists(dst):
-                        os.unlink(dst)
-                    
-                    self.log.debug("Linking %s to %s ..." % (src, dst))
-                    try:
-                        os.symlink(src, dst)
-                    except OSError as e:
-                        raise cdist.Error("Linking %s %s to %s failed: %s" % (sub_dir, src, dst, e.__str__()))
+            # Already exists? remove and link
+            if os.path.lexists(dst):
+                os.unlink(dst)
+
+            self.log.debug("Linking %s to %s ..." % (src, dst))
+            try:
+                os.symlink(src, dst)
+            except OSError as e:
+                raise cdist.Error("Linking %s %s to %s failed: %s" % (sub_dir, src, dst, e.__str__()))
 
     def _link_types_for_emulator(self):
         """Link emulator to types"""
@@ -256,3 +352,9 @@ class Local(object):
                 os.symlink(src, dst)
             except OSError as e:
                 raise cdist.Error("Linking emulator from %s to %s failed: %s" % (src, dst, e.__str__()))
+
+        dst = os.path.join(self.bin_path, cdist.DEFINE_COMMAND)
+        try:
+            os.symlink(src, dst)
+        except OSError as e:
+            raise cdist.Error("Linking emulator from %s to %s failed: %s" % (src, dst, e.__str__()))
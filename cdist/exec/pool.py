@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import logging
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+
+import cdist
+
+log = logging.getLogger(__name__)
+
+'''
+Run local scripts in warm shells instead of starting a shell per script.
+
+A shell of the pool reads commands from stdin. Every script is sourced
+in a subshell of it, with the environment of the script applied as
+difference to the environment the shell started with:
+
+    ( cd DIR; unset ...; export ...; set -e; . SCRIPT ) </dev/null >OUTPUT
+    echo $?
+
+The subshell is a fork of a small shell, so neither the cdist process
+nor its environment are copied. The output of the script goes to a file
+of the shell, its exit status to the pipe cdist reads.
+
+Unlike sh -e SCRIPT, $0 is the name of the shell in the script and
+stdin is /dev/null.
+
+'''
+
+NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class Shell(object):
+    """A shell waiting for scripts to source"""
+
+    def __init__(self, shell, env):
+        handle, self.output_path = tempfile.mkstemp(prefix='cdist.shell.')
+        os.close(handle)
+        try:
+            self.process = subprocess.Popen([shell], env=env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            os.remove(self.output_path)
+            raise cdist.Error("Cannot start %s: %s" % (shell, e))
+
+    def run(self, command):
+        """Run command in a subshell and return its exit status and output"""
+        script = "( %s ) </dev/null >%s\necho $?\n" % (command, shlex.quote(self.output_path))
+        try:
+            self.process.stdin.write(script.encode('utf-8'))
+            self.process.stdin.flush()
+            status = self.process.stdout.readline()
+        except EnvironmentError as e:
+            raise cdist.Error("Lost local shell: %s" % e)
+        if not status:
+            raise cdist.Error("Local shell exited unexpectedly")
+        with open(self.output_path, "rb") as fd:
+            output = fd.read()
+        return int(status), output
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except EnvironmentError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+        os.remove(self.output_path)
+
+
+class ShellPool(object):
+    """Warm shells of one host, one per script running at the same time"""
+
+    def __init__(self, shell="/bin/sh", env=None):
+        self.shell = shell
+        if env is None:
+            env = os.environ.copy()
+        self.env = env
+        self._idle = []
+        self._shells = []
+        self._lock = threading.Lock()
+
+    def _environment(self, env):
+        """Return the commands turning the shell's environment into env"""
+        commands = []
+        removed = [name for name in self.env
+            if not name in env and NAME_RE.match(name)]
+        if removed:
+            commands.append("unset " + " ".join(removed))
+        for name, value in sorted(env.items()):
+            if self.env.get(name) != value and NAME_RE.match(name):
+                commands.append("export %s=%s" % (name, shlex.quote(value)))
+        return commands
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        shell = Shell(self.shell, self.env)
+        with self._lock:
+            self._shells.append(shell)
+        return shell
+
+    def _release(self, shell):
+        with self._lock:
+            self._idle.append(shell)
+
+    def _discard(self, shell):
+        with self._lock:
+            self._shells.remove(shell)
+        shell.close()
+
+    def run(self, script, env):
+        """Source script with env in a subshell.
+
+        Return its exit status and output as bytes.
+
+        """
+        commands = ["cd " + shlex.quote(os.getcwd())]
+        commands.extend(self._environment(env))
+        commands.append("set -e")
+        commands.append(". " + shlex.quote(script))
+
+        shell = self._acquire()
+        try:
+            result = shell.run("; ".join(commands))
+        except cdist.Error:
+            self._discard(shell)
+            raise
+        self._release(shell)
+        return result
+
+    def close(self):
+        with self._lock:
+            shells = self._shells
+            self._shells = []
+            self._idle = []
+        for shell in shells:
+            shell.close()
+        log.debug("Closed %d local shells", len(shells))
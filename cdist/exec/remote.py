@@ -20,6 +20,7 @@
 #
 #
 
+import codecs
 import io
 import os
 import sys
@@ -28,6 +29,7 @@ import subprocess
 import logging
 
 import cdist
+import cdist.exec.stats
 
 class DecodeError(cdist.Error):
     def __init__(self, command):
@@ -37,6 +39,44 @@ class DecodeError(cdist.Error):
         return "Cannot decode output of " + " ".join(self.command)
 
 
+def parse_checksums(output):
+    """Parse the output of cksum into path -> (crc, size)"""
+    result = {}
+    for line in output.splitlines():
+        crc, size, path = line.split(None, 2)
+        if path.startswith("./"):
+            path = path[2:]
+        result[path] = (crc, size)
+    return result
+
+
+def checksums(paths):
+    """Return path -> (crc, size) of the given local files.
+
+    Uses cksum like the remote side to get comparable checksums.
+
+    """
+    if not paths:
+        return {}
+    try:
+        output = subprocess.check_output(["cksum"] + paths)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise cdist.Error("Cannot checksum %s: %s" % (" ".join(paths), e))
+    return parse_checksums(output.decode())
+
+
+def archive_filter(tarinfo):
+    """Filter for tar archives passed to Remote.transfer_archive.
+
+    The archive is extracted as root on the remote side: do not hand
+    the files to the uid of the local user.
+
+    """
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    return tarinfo
+
+
 class Remote(object):
     """Execute commands remotely.
 
@@ -44,15 +84,24 @@ class Remote(object):
     Directly accessing the remote side from python code is a bug.
 
     """
+    # Bytes of output read at once when streaming it into a file
+    chunk_size = 65536
+
     def __init__(self,
                  target_host,
                  remote_exec,
                  remote_copy,
-                 base_path=None):
+                 base_path=None,
+                 stats=None,
+                 keep_conf=False):
         self.target_host = target_host
         self._exec = remote_exec
         self._copy = remote_copy
 
+        if stats is None:
+            stats = cdist.exec.stats.Stats(target_host)
+        self.stats = stats
+
         if base_path:
             self.base_path = base_path
         else:
@@ -66,6 +115,12 @@ class Remote(object):
 
         self.log = logging.getLogger(self.target_host)
 
+        # Keep the conf tree between runs and only transfer changed files:
+        # relative path in conf -> checksum of the file on the remote side
+        self.keep_conf = keep_conf
+        self._conf_files = None
+        self._conf_dirs = set()
+
         self._init_env()
 
     def _init_env(self):
@@ -76,11 +131,40 @@ class Remote(object):
 
 
     def create_files_dirs(self):
+        if self.keep_conf:
+            self._prepare_kept_conf()
+            return
         self.rmdir(self.base_path)
         self.mkdir(self.base_path)
         self.run(["chmod", "0700", self.base_path])
         self.mkdir(self.conf_path)
 
+    def _prepare_kept_conf(self):
+        """Remove the objects of the last run and list the kept conf tree.
+
+        Done in one round trip: the checksums of all files in the conf
+        tree decide which files transfer has to copy.
+
+        """
+        self.log.debug("Remote keeping conf: %s", self.conf_path)
+        output = self.run(["mkdir -p", self.conf_path,
+            "&& chmod 0700", self.base_path,
+            "&& rm -rf", self.object_path,
+            "&& cd", self.conf_path,
+            "&& find . -type f -exec cksum {} +"], return_output=True)
+        self._conf_files = parse_checksums(output)
+        self._conf_dirs = set([self.conf_path])
+        for relative in self._conf_files:
+            directory = os.path.dirname(os.path.join(self.conf_path, relative))
+            while directory != self.conf_path and not directory in self._conf_dirs:
+                self._conf_dirs.add(directory)
+                directory = os.path.dirname(directory)
+        self.log.debug("Remote conf has %s file(s)", len(self._conf_files))
+
+    def _in_kept_conf(self, path):
+        return (self._conf_files is not None and
+            (path + os.sep).startswith(self.conf_path + os.sep))
+
     def rmdir(self, path):
         """Remove directory on the remote side."""
         self.log.debug("Remote rmdir: %s", path)
@@ -88,12 +172,23 @@ class Remote(object):
 
     def mkdir(self, path):
         """Create directory on the remote side."""
+        if self._in_kept_conf(path) and path in self._conf_dirs:
+            return
         self.log.debug("Remote mkdir: %s", path)
         self.run(["mkdir", "-p", path])
+        if self._in_kept_conf(path):
+            self._conf_dirs.add(path)
+
+    def transfer(self, source, destination, mode=None):
+        """Transfer a file or directory to the remote side.
+
+        If mode is given, the transferred files are chmod'ed to it.
 
-    def transfer(self, source, destination):
-        """Transfer a file or directory to the remote side."""
+        """
         self.log.debug("Remote transfer: %s -> %s", source, destination)
+        if os.path.isdir(source) and self._in_kept_conf(destination):
+            self._sync(source, destination, mode)
+            return
         self.rmdir(destination)
         if os.path.isdir(source):
             self.mkdir(destination)
@@ -101,13 +196,69 @@ class Remote(object):
                 command = self._copy.split()
                 path = os.path.join(source, f)
                 command.extend([path, '{0}:{1}'.format(self.target_host, destination)])
-                self._run_command(command)
+                self._copy_file(path, command)
+            if mode is not None:
+                self.run(["chmod", "%o" % mode, "%s/*" % destination])
         else:
             command = self._copy.split()
             command.extend([source, '{0}:{1}'.format(self.target_host, destination)])
-            self._run_command(command)
+            self._copy_file(source, command)
+            if mode is not None:
+                self.run(["chmod", "%o" % mode, destination])
+
+    def transfer_archive(self, source, destination):
+        """Transfer the tar archive source and extract it into destination"""
+        archive = os.path.join(self.base_path, os.path.basename(source))
+        self.log.debug("Remote transfer archive: %s -> %s", source, destination)
+        command = self._copy.split()
+        command.extend([source, '{0}:{1}'.format(self.target_host, archive)])
+        self._copy_file(source, command)
+        self.run(["mkdir -p", destination,
+            "&& tar -xf", archive, "-C", destination,
+            "&& rm -f", archive])
+
+    def _sync(self, source, destination, mode):
+        """Copy the files of source that differ from the kept destination"""
+        relative = os.path.relpath(destination, self.conf_path)
+        names = glob.glob1(source, '*')
+        local = checksums([os.path.join(source, name) for name in names])
+
+        kept = {}
+        for path, checksum in self._conf_files.items():
+            if os.path.dirname(path) == relative:
+                kept[os.path.basename(path)] = checksum
+
+        stale = sorted(set(kept) - set(names))
+        if stale:
+            self.run(["rm", "-f"] + [os.path.join(destination, name) for name in stale])
+            for name in stale:
+                del self._conf_files[os.path.join(relative, name)]
+
+        changed = [name for name in names
+            if kept.get(name) != local[os.path.join(source, name)]]
+        self.log.debug("Remote sync: %s of %s file(s) changed in %s",
+            len(changed), len(names), destination)
+        if not changed:
+            return
+        self.mkdir(destination)
+        for name in changed:
+            command = self._copy.split()
+            path = os.path.join(source, name)
+            command.extend([path, '{0}:{1}'.format(self.target_host, destination)])
+            self._copy_file(path, command)
+            self._conf_files[os.path.join(relative, name)] = local[path]
+        if mode is not None:
+            self.run(["chmod", "%o" % mode] +
+                [os.path.join(destination, name) for name in changed])
+
+    def _copy_file(self, source, command):
+        self._run_command(command, kind=cdist.exec.stats.REMOTE_COPY)
+        try:
+            self.stats.bytes_sent += os.path.getsize(source)
+        except EnvironmentError:
+            pass
 
-    def run_script(self, script, env=None, return_output=False):
+    def run_script(self, script, env=None, return_output=False, output_path=None):
         """Run the given script with the given environment on the remote side.
         Return the output as a string.
 
@@ -116,12 +267,15 @@ class Remote(object):
         command = [ os.environ.get('CDIST_REMOTE_SHELL',"/bin/sh") , "-e"]
         command.append(script)
 
-        return self.run(command, env, return_output)
+        return self.run(command, env, return_output, output_path=output_path)
 
-    def run(self, command, env=None, return_output=False):
+    def run(self, command, env=None, return_output=False, output_path=None):
         """Run the given command with the given environment on the remote side.
         Return the output as a string.
 
+        If output_path is given, the output is streamed into that file
+        instead of being returned.
+
         """
         # prefix given command with remote_exec
         cmd = self._exec.split()
@@ -136,9 +290,11 @@ class Remote(object):
 
         cmd.extend(command)
 
-        return self._run_command(cmd, env=env, return_output=return_output)
+        return self._run_command(cmd, env=env, return_output=return_output,
+            output_path=output_path)
 
-    def _run_command(self, command, env=None, return_output=False):
+    def _run_command(self, command, env=None, return_output=False,
+            kind=cdist.exec.stats.REMOTE_EXEC, output_path=None):
         """Run the given command with the given environment.
         Return the output as a string.
 
@@ -151,13 +307,41 @@ class Remote(object):
 
         self.log.debug("Remote run: %s", command)
         try:
-            if return_output:
-                return subprocess.check_output(command, env=os_environ).decode()
-            else:
-                subprocess.check_call(command, env=os_environ)
+            with self.stats.measure(kind, command):
+                if output_path:
+                    self._stream_output(command, os_environ, output_path)
+                elif return_output:
+                    output = subprocess.check_output(command, env=os_environ)
+                    self.stats.bytes_received += len(output)
+                    return output.decode()
+                else:
+                    subprocess.check_call(command, env=os_environ)
         except subprocess.CalledProcessError:
             raise cdist.Error("Command failed: " + " ".join(command))
         except OSError as error:
             raise cdist.Error(" ".join(command) + ": " + error.args[1])
         except UnicodeDecodeError:
             raise DecodeError(command)
+
+    def _stream_output(self, command, env, output_path):
+        """Write the output of command to output_path, chunk_size bytes at a time"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE)
+        try:
+            try:
+                with open(output_path, "w", encoding="utf-8") as fd:
+                    while True:
+                        chunk = process.stdout.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        self.stats.bytes_received += len(chunk)
+                        fd.write(decoder.decode(chunk))
+                    fd.write(decoder.decode(b'', final=True))
+            except EnvironmentError as e:
+                raise cdist.Error("Cannot write output of %s to %s: %s" %
+                    (" ".join(command), output_path, e))
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, command)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import contextlib
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+
+import cdist
+
+# Kinds of commands that are accounted for
+LOCAL = "local"
+LOCAL_POOL = "local pool"
+REMOTE_EXEC = "remote exec"
+REMOTE_COPY = "remote copy"
+
+KINDS = (LOCAL, LOCAL_POOL, REMOTE_EXEC, REMOTE_COPY)
+
+
+class Stats(object):
+    """Count and time the commands run for one target host.
+
+    Every local command is a fork, local pool scripts are run by a warm
+    shell without a fork (--local-shell-pool), every remote exec and
+    remote copy is a round trip to the target host.
+
+    """
+    # Number of slowest commands to remember
+    slowest_max = 5
+
+    def __init__(self, target_host):
+        self.target_host = target_host
+        self.calls = dict((kind, 0) for kind in KINDS)
+        self.time = dict((kind, 0.0) for kind in KINDS)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._slowest = []
+
+        # Global explorers may run commands from several threads
+        self._lock = threading.Lock()
+
+        # Breakdown by the stage of the run commands are issued in
+        self.current_stage = None
+        self.stages = {}
+
+    def _stage_entry(self, name):
+        if not name in self.stages:
+            self.stages[name] = { 'count': 0, 'time': 0.0 }
+            self.stages[name].update((kind, 0) for kind in KINDS)
+        return self.stages[name]
+
+    def record(self, kind, command, duration):
+        with self._lock:
+            self._record(kind, command, duration)
+
+    def _record(self, kind, command, duration):
+        self.calls[kind] += 1
+        self.time[kind] += duration
+        if self.current_stage:
+            self._stage_entry(self.current_stage)[kind] += 1
+
+        entry = (duration, kind, " ".join(command))
+        if len(self._slowest) < self.slowest_max:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @contextlib.contextmanager
+    def measure(self, kind, command):
+        """Account the command run in the with block"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(kind, command, time.time() - start)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Account commands run in the with block to the given stage"""
+        previous = self.current_stage
+        self.current_stage = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            entry = self._stage_entry(name)
+            entry['count'] += 1
+            entry['time'] += time.time() - start
+            self.current_stage = previous
+
+    @property
+    def slowest(self):
+        """Return the slowest commands, slowest first"""
+        return sorted(self._slowest, reverse=True)
+
+    @property
+    def round_trips(self):
+        return self.calls[REMOTE_EXEC] + self.calls[REMOTE_COPY]
+
+    def as_dict(self):
+        return {
+            'host': self.target_host,
+            'calls': dict(self.calls),
+            'time': dict(self.time),
+            'round_trips': self.round_trips,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'stages': self.stages,
+            'slowest': [ { 'time': duration, 'kind': kind, 'command': command }
+                for duration, kind, command in self.slowest ],
+        }
+
+    def summary(self):
+        """Return a list of human readable lines"""
+        lines = []
+        lines.append("%s local processes (%.3fs), %s remote exec (%.3fs), "
+            "%s remote copy (%.3fs)" % (
+                self.calls[LOCAL], self.time[LOCAL],
+                self.calls[REMOTE_EXEC], self.time[REMOTE_EXEC],
+                self.calls[REMOTE_COPY], self.time[REMOTE_COPY]))
+        if self.calls[LOCAL_POOL]:
+            lines.append("%s local scripts in the shell pool (%.3fs)" % (
+                self.calls[LOCAL_POOL], self.time[LOCAL_POOL]))
+        lines.append("%s round trips, %s bytes sent, %s bytes received" % (
+            self.round_trips, self.bytes_sent, self.bytes_received))
+        for duration, kind, command in self.slowest:
+            lines.append("slow %s (%.3fs): %s" % (kind, duration, command))
+        return lines
+
+    def write(self, path):
+        """Append the stats as one json line to path or stdout if path is -"""
+        line = json.dumps(self.as_dict()) + "\n"
+        if path == '-':
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            return
+        try:
+            # O_APPEND: parallel host processes share the file
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot write stats to %s: %s" % (path, e))
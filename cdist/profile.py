@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import cProfile
+import glob
+import logging
+import os
+import pstats
+
+import cdist
+
+log = logging.getLogger(__name__)
+
+# Passes the profile directory on to the emulator
+ENV_NAME = "__cdist_profile"
+
+SUMMARY_NAME = "summary.txt"
+
+
+class Profile(object):
+    """Profile the with block and save the stats to a file.
+
+    The main process writes DIR/main.PID.prof, everything done for a
+    host goes to DIR/HOST/NAME.PID.prof.
+
+    """
+    # Only one profiler can be active: nested profiles pause the outer one
+    _active = []
+
+    def __init__(self, path, name, target_host=None):
+        self.path = path
+        self.name = name
+        self.target_host = target_host
+        self._profiler = None
+
+    @classmethod
+    def from_env(cls, env, name, target_host):
+        return cls(env.get(ENV_NAME), name, target_host)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @property
+    def directory(self):
+        if self.target_host:
+            return os.path.join(self.path, self.target_host)
+        else:
+            return self.path
+
+    @property
+    def stats_path(self):
+        return os.path.join(self.directory, "%s.%d.prof" % (self.name, os.getpid()))
+
+    def __enter__(self):
+        if self.enabled:
+            if self._active:
+                self._active[-1]._profiler.disable()
+            self._profiler = cProfile.Profile()
+            self._active.append(self)
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.enabled:
+            return
+        self._profiler.disable()
+        self._active.pop()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._profiler.dump_stats(self.stats_path)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot write profile to %s: %s" % (self.stats_path, e))
+        finally:
+            if self._active:
+                self._active[-1]._profiler.enable()
+
+    def summarise(self, limit=40):
+        """Aggregate all stats files of the host into DIR/HOST/summary.txt"""
+        if not self.enabled:
+            return
+        files = sorted(glob.glob(os.path.join(self.directory, "*.prof")))
+        if not files:
+            return
+        summary_path = os.path.join(self.directory, SUMMARY_NAME)
+        with open(summary_path, "w") as fd:
+            fd.write("%s profile(s) of %s\n" % (len(files), self.target_host or "main"))
+            stats = pstats.Stats(*files, stream=fd)
+            stats.sort_stats("cumulative").print_stats(limit)
+        log.info("Wrote profile summary to %s", summary_path)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import argparse
+import itertools
+import logging
+
+import cdist
+
+log = logging.getLogger(__name__)
+
+
+def parse_amount(value):
+    """Parse a number of hosts or a percentage: '10' -> (10.0, False), '5%' -> (5.0, True)"""
+    percent = value.endswith('%')
+    try:
+        amount = float(value[:-1] if percent else value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is neither a number nor a percentage" % value)
+    if amount < 0:
+        raise argparse.ArgumentTypeError("%s must not be negative" % value)
+    return (amount, percent)
+
+
+class FailureBudgetExceeded(cdist.Error):
+    """Too many hosts failed, remaining hosts were not configured"""
+
+    def __init__(self, failed_hosts, skipped):
+        self.failed_hosts = failed_hosts
+        self.skipped = skipped
+
+    def __str__(self):
+        return ("Failure budget exceeded, skipped %s host(s). "
+            "Failed to configure the following hosts: %s" %
+            (self.skipped, " ".join(self.failed_hosts)))
+
+
+class Rollout(object):
+    """Split the hosts of a run into waves.
+
+    Every wave is configured completely before the next one starts. The
+    first wave has the given size, each following one is ramp times as
+    large as the one before. Once more hosts than the failure budget
+    allows have failed no further waves are started. Without a wave
+    size no further hosts are started.
+
+    Sizes and budgets are numbers of hosts or percentages of all hosts.
+    Percentages need to know all hosts in advance, otherwise the hosts
+    are consumed as the waves go.
+
+    """
+    def __init__(self, hosts, size=None, ramp=1.0, max_failures=None):
+        if ramp < 1:
+            raise cdist.Error("The wave ramp-up must be at least 1, not %s" % ramp)
+        self.hosts = hosts
+        self.ramp = ramp
+        self.total = None
+        if (size and size[1]) or (max_failures and max_failures[1]):
+            self.hosts = list(hosts)
+            self.total = len(self.hosts)
+        self.size = self._resolve(size)
+        self.max_failures = self._resolve(max_failures)
+
+        # Filled by the caller as hosts fail
+        self.failed_hosts = []
+
+        self.waves = 0
+        self.skipped = 0
+
+    def _resolve(self, amount):
+        if amount is None:
+            return None
+        number, percent = amount
+        if percent:
+            number = self.total * number / 100
+        return number
+
+    @property
+    def exceeded(self):
+        return (self.max_failures is not None and
+            len(self.failed_hosts) > self.max_failures)
+
+    def _skip(self, hosts):
+        self.skipped = sum(1 for host in hosts)
+        log.error("%s host(s) failed, exceeding the failure budget of %g: "
+            "not configuring the remaining %s host(s)",
+            len(self.failed_hosts), self.max_failures, self.skipped)
+
+    def _until_exceeded(self, hosts):
+        """Yield hosts while the failure budget is not exceeded"""
+        for host in hosts:
+            if self.exceeded:
+                self._skip(itertools.chain([host], hosts))
+                return
+            yield host
+
+    def __iter__(self):
+        """Yield the waves, each an iterator over its hosts.
+
+        Without a wave size all hosts are one wave, in which the failure
+        budget is checked before every host.
+
+        """
+        hosts = iter(self.hosts)
+        size = self.size
+        for first in hosts:
+            if self.exceeded:
+                self._skip(itertools.chain([first], hosts))
+                return
+            self.waves += 1
+            if size is None:
+                yield self._until_exceeded(itertools.chain([first], hosts))
+            else:
+                count = max(1, int(round(size)))
+                log.info("Starting wave %s with up to %s host(s)", self.waves, count)
+                yield itertools.chain([first], itertools.islice(hosts, count - 1))
+                size *= self.ramp
+
+    def check(self):
+        """Raise an error for the failed and skipped hosts"""
+        if self.skipped:
+            raise FailureBudgetExceeded(self.failed_hosts, self.skipped)
+        if self.failed_hosts:
+            raise cdist.Error("Failed to configure the following hosts: " +
+                " ".join(self.failed_hosts))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import os
+import shutil
+
+from cdist import test
+import cdist.cache
+import cdist.config
+import cdist.exec.local
+import cdist.exec.remote
+
+import os.path as op
+my_dir = op.abspath(op.dirname(__file__))
+config_fixtures = op.join(my_dir, op.pardir, 'config', 'fixtures')
+
+
+class HistoryTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.history = cdist.cache.History(os.path.join(self.temp_dir, "history.sqlite"))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _record(self, host, status="ok", changed=True, explorers=None):
+        return self.history.record(host, 100.0, 101.5, status,
+            explorers=explorers or {'os': 'debian\n'},
+            objects=[{
+                'name': '__file/etc/motd', 'type': '__file', 'state': 'done',
+                'changed': changed, 'prepare': 0.1, 'run': 0.2,
+                'parameters': {'source': '-', 'mode': '0644'},
+            }])
+
+    def test_runs(self):
+        self._record("a")
+        self._record("b", status="failed", changed=False)
+        runs = self.history.runs()
+        self.assertEqual([(host, status, changed) for host, started, duration, status, changed in runs],
+            [("b", "failed", 0), ("a", "ok", 1)])
+        self.assertEqual(self.history.runs(["a"], limit=1)[0][2], 1.5)
+
+    def test_explorer_of_latest_run(self):
+        self._record("a", explorers={'os': 'debian\n'})
+        self._record("a", explorers={'os': 'ubuntu\n'})
+        self._record("b", explorers={'os': 'centos\n'})
+        self.assertEqual(self.history.explorer("os"), [("a", "ubuntu\n"), ("b", "centos\n")])
+        self.assertEqual(self.history.explorer("os", ["b"]), [("b", "centos\n")])
+
+    def test_changed_objects(self):
+        self._record("a", changed=True)
+        self._record("b", changed=False)
+        self.assertEqual(self.history.objects(changed=True),
+            [("a", "__file/etc/motd", "done", 1)])
+        self.assertEqual(len(self.history.objects()), 2)
+
+    def test_parameters(self):
+        run = self._record("a")
+        self.assertEqual(self.history.query(
+            "SELECT name, value FROM parameters WHERE run = ? ORDER BY name", (run,)),
+            [("mode", "0644"), ("source", "-")])
+
+    def test_query_error(self):
+        with self.assertRaises(cdist.Error):
+            self.history.query("SELECT * FROM nothing")
+
+
+class ConfigHistoryTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.history = cdist.cache.History(os.path.join(self.temp_dir, "history.sqlite"))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_run_is_recorded(self):
+        local = cdist.exec.local.Local(
+            target_host=self.target_host,
+            base_path=os.path.join(self.temp_dir, "local"),
+            exec_path=test.cdist_exec_path,
+            initial_manifest=os.path.join(config_fixtures, 'manifest', 'dryrun_manifest'),
+            add_conf_dirs=[config_fixtures])
+        remote = cdist.exec.remote.Remote(
+            target_host=self.target_host,
+            remote_exec=self.remote_exec,
+            remote_copy=self.remote_copy,
+            base_path=os.path.join(self.temp_dir, "remote"))
+        config = cdist.config.Config(local, remote, dry_run=True, history=self.history)
+        config.run()
+
+        (host, started, duration, status, changed), = self.history.runs()
+        self.assertEqual(host, self.target_host)
+        self.assertEqual(status, "ok")
+        objects = self.history.objects()
+        self.assertTrue(objects)
+        self.assertTrue(all(state == "done" for host, name, state, changed in objects))
+
+
+class CompactTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, "cache")
+        for host in ("a", "b", "c"):
+            object_path = os.path.join(self.cache_path, host, "object", "__file", "motd", ".cdist")
+            os.makedirs(os.path.join(object_path, "parameter"))
+            with open(os.path.join(object_path, "parameter", "mode"), "w") as fd:
+                fd.write("0644\n")
+            with open(os.path.join(object_path, "parameter", "owner"), "w") as fd:
+                fd.write(host + "\n")
+            os.makedirs(os.path.join(self.cache_path, host, "conf", "type"))
+            os.symlink(my_dir, os.path.join(self.cache_path, host, "conf", "type", "__file"))
+            self._stamp(host, 1000000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _path(self, host, *parts):
+        return os.path.join(self.cache_path, host, *parts)
+
+    def _stamp(self, host, finished):
+        with open(self._path(host, cdist.exec.local.RUN_STAMP), "w") as fd:
+            fd.write("%f\n" % finished)
+
+    def _mode(self, host):
+        return self._path(host, "object", "__file", "motd", ".cdist", "parameter", "mode")
+
+    def _owner(self, host):
+        return self._path(host, "object", "__file", "motd", ".cdist", "parameter", "owner")
+
+    def test_compact(self):
+        result = cdist.cache.compact(self.cache_path)
+        self.assertEqual(result, { 'files': 9, 'linked': 4,
+            'saved': 2 * len('0644\n') + 2 * len(my_dir) })
+        self.assertTrue(os.path.samefile(self._mode("a"), self._mode("c")))
+        self.assertFalse(os.path.samefile(self._owner("a"), self._owner("b")))
+        with open(self._mode("b")) as fd:
+            self.assertEqual(fd.read(), "0644\n")
+        link = self._path("b", "conf", "type", "__file")
+        self.assertEqual(os.lstat(link).st_ino,
+            os.lstat(self._path("a", "conf", "type", "__file")).st_ino)
+        self.assertEqual(os.readlink(link), my_dir)
+
+    def test_compact_again(self):
+        cdist.cache.compact(self.cache_path)
+        self.assertEqual(cdist.cache.compact(self.cache_path)['linked'], 0)
+
+    def test_compact_dry_run(self):
+        self.assertEqual(cdist.cache.compact(self.cache_path, dry_run=True)['linked'], 4)
+        self.assertFalse(os.path.samefile(self._mode("a"), self._mode("b")))
+
+    def test_prune(self):
+        now = 1000000000 + 10 * 86400
+        self._stamp("b", now)
+        self.assertEqual(cdist.cache.prune(self.cache_path, 86400, dry_run=True, now=now), ["a", "c"])
+        self.assertTrue(os.path.isdir(self._path("a")))
+        self.assertEqual(cdist.cache.prune(self.cache_path, 86400, now=now), ["a", "c"])
+        self.assertEqual(os.listdir(self.cache_path), ["b"])
+
+    def test_prune_after_compact(self):
+        now = 1000000000 + 100 * 86400
+        cdist.cache.compact(self.cache_path)
+        self.assertEqual(cdist.cache.prune(self.cache_path, 86400, dry_run=True, now=now), ["a", "b", "c"])
+
+    def test_prune_without_stamp(self):
+        os.remove(self._path("a", cdist.exec.local.RUN_STAMP))
+        now = os.stat(self._path("a")).st_mtime + 10 * 86400
+        self.assertEqual(cdist.cache.prune(self.cache_path, 86400, dry_run=True, now=now), ["a", "b", "c"])
+        self.assertEqual(cdist.cache.prune(self.cache_path, 86400, dry_run=True, now=now - 9 * 86400), ["b", "c"])
@@ -114,8 +114,6 @@ class ObjectTestCase(test.CdistTestCase):
         self.cdist_object = core.CdistObject(self.cdist_type, object_base_path, 'moon') 
 
     def tearDown(self):
-        self.cdist_object.prepared = False
-        self.cdist_object.ran = False
         self.cdist_object.source = []
         self.cdist_object.code_local = ''
         self.cdist_object.code_remote = ''
@@ -226,3 +224,35 @@ class ObjectTestCase(test.CdistTestCase):
         self.assertTrue(isinstance(other_object, core.CdistObject))
         self.assertEqual(other_object.cdist_type.name, '__first')
         self.assertEqual(other_object.object_id, 'man')
+
+    def test_object_from_name_identity(self):
+        first = self.cdist_object.object_from_name('__first/man')
+        self.assertIs(self.cdist_object.object_from_name('__first/man'), first)
+        self.assertIs(self.cdist_object.object_from_name('__first/man/'), first)
+        self.assertIn(first, list(core.CdistObject.list_objects(object_base_path, type_base_path)))
+        for cdist_object in core.CdistObject.list_objects(object_base_path, type_base_path):
+            if cdist_object.name == '__first/man':
+                self.assertIs(cdist_object, first)
+
+    def test_clear_instances(self):
+        first = self.cdist_object.object_from_name('__first/man')
+        core.CdistObject.clear_instances(object_base_path)
+        self.assertIsNot(self.cdist_object.object_from_name('__first/man'), first)
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.cdist_object, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.cdist_object.no_such_attribute = True
+
+    def test_state_cached(self):
+        self.cdist_object.state = core.CdistObject.STATE_DONE
+        other = core.CdistObject(self.cdist_type, object_base_path, 'moon')
+        self.assertEqual(other.state, core.CdistObject.STATE_DONE)
+        self.cdist_object.state = ''
+        self.assertFalse(os.path.exists(os.path.join(self.cdist_object.absolute_path, "state")))
+        # Writes through other instances are seen
+        self.assertEqual(other.state, '')
+        with open(os.path.join(self.cdist_object.absolute_path, "state"), "w") as fd:
+            fd.write(core.CdistObject.STATE_PREPARED + "\n")
+        self.assertEqual(self.cdist_object.state, core.CdistObject.STATE_PREPARED)
+        self.assertEqual(other.state, core.CdistObject.STATE_PREPARED)
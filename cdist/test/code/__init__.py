@@ -112,3 +112,33 @@ class CodeTestCase(test.CdistTestCase):
         self.cdist_object.code_remote = self.code.run_gencode_remote(self.cdist_object)
         self.code.transfer_code_remote(self.cdist_object)
         self.code.run_code_remote(self.cdist_object)
+
+    def _objects(self, *codes):
+        cdist_objects = []
+        for index, code_remote in enumerate(codes):
+            cdist_object = core.CdistObject(self.cdist_type, self.local.object_path, 'batch%d' % index)
+            cdist_object.create()
+            cdist_object.code_remote = code_remote
+            cdist_objects.append(cdist_object)
+        return cdist_objects
+
+    def test_run_code_remote_batch(self):
+        cdist_objects = self._objects(
+            'echo "$__object_id"\necho "to stderr" >&2\n',
+            'printf "no newline"\n',
+            'true\n')
+        results = self.code.run_code_remote_batch(cdist_objects)
+        self.assertEqual(results, [
+            (cdist_objects[0], 0, 'batch0\n', 'to stderr\n'),
+            (cdist_objects[1], 0, 'no newline', ''),
+            (cdist_objects[2], 0, '', ''),
+        ])
+
+    def test_run_code_remote_batch_failure(self):
+        cdist_objects = self._objects('echo ok\n', 'echo failing >&2\nfalse\necho not reached\n',
+            'echo never\n')
+        results = self.code.run_code_remote_batch(cdist_objects)
+        self.assertEqual(results, [
+            (cdist_objects[0], 0, 'ok\n', ''),
+            (cdist_objects[1], 1, '', 'failing\n'),
+        ])
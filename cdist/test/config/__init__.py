@@ -21,6 +21,8 @@
 #
 #
 
+import argparse
+import json
 import os
 import shutil
 
@@ -31,6 +33,7 @@ import cdist
 import cdist.config
 import cdist.core.cdist_type
 import cdist.core.cdist_object
+import cdist.trace
 
 import os.path as op
 my_dir = op.abspath(op.dirname(__file__))
@@ -67,6 +70,8 @@ class ConfigRunTestCase(test.CdistTestCase):
 
         self.config = cdist.config.Config(self.local, self.remote)
 
+        # Every test is a new run
+        core.CdistObject.clear_instances(object_base_path)
         self.objects = list(core.CdistObject.list_objects(object_base_path, type_base_path))
         self.object_index = dict((o.name, o) for o in self.objects)
         self.object_names = [o.name for o in self.objects]
@@ -124,6 +129,38 @@ class ConfigRunTestCase(test.CdistTestCase):
         with self.assertRaises(cdist.UnresolvableRequirementsError):
             self.config.iterate_until_finished()
 
+    def test_unmatched_pattern_requirement(self):
+        """Throw an error if a pattern matches no object"""
+        first = self.object_index['__first/man']
+        first.requirements = ['__second/not-*']
+        with self.assertRaisesRegex(cdist.UnresolvableRequirementsError, r"__second/not-\*"):
+            self.config.iterate_until_finished()
+
+    def test_schedule_reuses_critical_paths(self):
+        calls = []
+        critical_paths = self.config.dependencies.critical_paths
+        def counting(names, cost):
+            calls.append(names)
+            return critical_paths(names, cost)
+        self.config.dependencies.critical_paths = counting
+        self.config.schedule(self.objects)
+        self.config.schedule(self.objects)
+        self.assertEqual(len(calls), 1)
+        # New requirements or objects invalidate them
+        self.config.dependencies.changes += 1
+        self.config.schedule(self.objects)
+        self.config.schedule(self.objects[1:])
+        self.assertEqual(len(calls), 3)
+
+    def test_estimate_logged_at_info_throttled(self):
+        self.config.timings.estimate = lambda name, phases=None: 1.0
+        with self.assertLogs(self.config.log, level='INFO') as cm:
+            self.config.schedule(self.objects)
+            self.config.schedule(self.objects)
+        estimates = [line for line in cm.output if "Estimated time remaining" in line]
+        self.assertEqual(len(estimates), 1)
+        self.assertIn("for %s object(s)" % len(self.objects), estimates[0])
+
     def test_requirement_broken_type(self):
         """Unknown type should be detected in the resolving process"""
         first = self.object_index['__first/man']
@@ -152,7 +189,156 @@ class ConfigRunTestCase(test.CdistTestCase):
         dryrun = cdist.config.Config(drylocal, self.remote, dry_run=True)
         dryrun.run()
         # if we are here, dryrun works like expected
-        
+
+
+class LinkPlanTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _conf_tree(self, local):
+        tree = {}
+        for sub_dir in ("explorer", "manifest", "type"):
+            path = os.path.join(local.conf_path, sub_dir)
+            for entry in os.listdir(path):
+                tree[(sub_dir, entry)] = os.readlink(os.path.join(path, entry))
+        return tree
+
+    def _local(self, name, link_plan=None):
+        return cdist.exec.local.Local(
+            target_host=self.target_host,
+            base_path=os.path.join(self.temp_dir, name),
+            exec_path=test.cdist_exec_path,
+            add_conf_dirs=[fixtures],
+            link_plan=link_plan)
+
+    def test_last_conf_dir_wins(self):
+        other = os.path.join(self.temp_dir, "other")
+        os.makedirs(os.path.join(other, "type", "__file"))
+        plan = cdist.exec.local.Local.plan_conf_links(
+            cdist.exec.local.Local.find_conf_dirs([other]))
+        sources = dict(((sub_dir, entry), src) for sub_dir, entry, src in plan)
+        self.assertEqual(sources[("type", "__file")], os.path.join(other, "type", "__file"))
+        self.assertEqual(len(sources), len(plan))
+
+    def test_planned_links(self):
+        planned = self._local("planned", cdist.exec.local.Local.plan_conf_links(
+            cdist.exec.local.Local.find_conf_dirs([fixtures])))
+        planned.create_files_dirs()
+        unplanned = self._local("unplanned")
+        unplanned.create_files_dirs()
+        self.assertEqual(self._conf_tree(planned), self._conf_tree(unplanned))
+        self.assertEqual(sorted(os.listdir(planned.bin_path)),
+            sorted(os.listdir(unplanned.bin_path)))
+
+    def test_worker_context(self):
+        import cdist.worker
+        self.assertTrue(hasattr(cdist.worker.context(), "Process"))
+
+
+class HostsTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_hosts_file(self):
+        hosts_file = os.path.join(self.temp_dir, "hosts")
+        with open(hosts_file, "w") as fd:
+            fd.write("# all web servers\nweb1\n\n  web2  # backup\nweb3\n")
+        args = argparse.Namespace(host=['db1'], hosts_file=hosts_file)
+        self.assertEqual(list(cdist.config.Config.hosts(args)),
+            ['db1', 'web1', 'web2', 'web3'])
+
+    def test_hosts_file_is_read_lazily(self):
+        hosts_file = os.path.join(self.temp_dir, "hosts")
+        with open(hosts_file, "w") as fd:
+            fd.write("web1\n")
+        args = argparse.Namespace(host=[], hosts_file=hosts_file)
+        hosts = cdist.config.Config.hosts(args)
+        self.assertEqual(next(hosts), 'web1')
+        with open(hosts_file, "a") as fd:
+            fd.write("web2\n")
+        self.assertEqual(list(hosts), ['web2'])
+
+    def test_parallel_hosts_are_bounded(self):
+        import multiprocessing
+        import time
+        context = multiprocessing.get_context("fork")
+        running = []
+        read = []
+
+        def hosts():
+            for host in range(6):
+                running[:] = [child for child in running if child.is_alive()]
+                self.assertLessEqual(len(running), 1)
+                read.append(host)
+                yield host
+
+        def start(host):
+            child = context.Process(target=time.sleep, args=(0.05,))
+            child.start()
+            running.append(child)
+            return child
+
+        failed_hosts = []
+        process, started = cdist.config.Config._start_parallel(hosts(), start,
+            failed_hosts, max_running=2)
+        self.assertEqual(started, 6)
+        self.assertEqual(read, list(range(6)))
+        for host, child in process:
+            child.join()
+        self.assertEqual(failed_hosts, [])
+
+    def _commandline_args(self, **args):
+        defaults = dict(host=[], hosts_file=None, manifest=None, conf_dir=None,
+            parallel=False, wave_size=None, wave_ramp=1.0, max_failures=None,
+            max_parallel=cdist.config.MAX_PARALLEL, trace=None, events=None,
+            profile=None, share_gencode=False)
+        defaults.update(args)
+        return argparse.Namespace(**defaults)
+
+    def test_trace_written_when_aborted(self):
+        trace = os.path.join(self.temp_dir, "trace.json")
+        args = self._commandline_args(trace=trace,
+            hosts_file=os.path.join(self.temp_dir, "missing"))
+        with self.assertRaises(cdist.Error):
+            cdist.config.Config.commandline(args)
+        with open(trace) as fd:
+            self.assertEqual(json.load(fd)['traceEvents'], [])
+        self.assertFalse(os.path.exists(cdist.trace.Trace.spool_path(trace)))
+
+    def test_run_finished_when_aborted(self):
+        events = os.path.join(self.temp_dir, "events")
+        args = self._commandline_args(events=events,
+            hosts_file=os.path.join(self.temp_dir, "missing"))
+        with self.assertRaises(cdist.Error):
+            cdist.config.Config.commandline(args)
+        with open(events) as fd:
+            lines = [json.loads(line) for line in fd]
+        self.assertEqual([line['event'] for line in lines], ["run_started", "run_finished"])
+        self.assertTrue(lines[-1]['aborted'])
+        self.assertIn("missing", lines[-1]['error'])
+
+    def test_gencode_sharing_is_opt_in(self):
+        for share_gencode in (False, True):
+            args = self._commandline_args(share_gencode=share_gencode,
+                hosts_file=os.path.join(self.temp_dir, "missing"))
+            with self.assertRaises(cdist.Error):
+                cdist.config.Config.commandline(args)
+            self.assertEqual(args.gencode_memo_path is not None, share_gencode)
+
+    def test_hosts_file_missing(self):
+        args = argparse.Namespace(host=[],
+            hosts_file=os.path.join(self.temp_dir, "missing"))
+        with self.assertRaises(cdist.Error):
+            list(cdist.config.Config.hosts(args))
+
 
 # Currently the resolving code will simply detect that this object does
 # not exist. It should probably check if the type is a singleton as well
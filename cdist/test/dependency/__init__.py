@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os
+import shutil
+
+from cdist import test
+from cdist import core
+from cdist import emulator
+from cdist.exec import local
+
+import cdist
+
+import os.path as op
+my_dir = op.abspath(op.dirname(__file__))
+conf_dir = op.join(my_dir, '..', 'emulator', 'fixtures', 'conf')
+
+
+class DependencyGraphTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        handle, self.script = self.mkstemp(dir=self.temp_dir)
+        os.close(handle)
+
+        self.local = local.Local(
+            target_host=self.target_host,
+            base_path=os.path.join(self.temp_dir, "out"),
+            exec_path=test.cdist_exec_path,
+            add_conf_dirs=[conf_dir])
+        self.local.create_files_dirs()
+
+        self.manifest = core.Manifest(self.target_host, self.local)
+        self.env = self.manifest.env_initial_manifest(self.script)
+        self.graph = core.DependencyGraph(self.local.base_path,
+            self.local.object_path, self.local.type_path)
+
+    def tearDown(self):
+        core.CdistObject.clear_instances(self.local.object_path)
+        shutil.rmtree(self.temp_dir)
+
+    def define(self, object_id, require=None):
+        env = dict(self.env)
+        if require:
+            env['require'] = require
+        emulator.Emulator(['__planet', object_id], env=env).run()
+
+    def test_no_cycle(self):
+        self.define('erde')
+        self.define('mars', require='__planet/erde')
+        self.define('venus', require='__planet/erde __planet/mars')
+        self.graph.check()
+        self.assertEqual(self.graph.successors('__planet/venus'),
+            ['__planet/erde', '__planet/mars'])
+
+    def test_cycle(self):
+        self.define('erde', require='__planet/venus')
+        self.define('mars', require='__planet/erde')
+        self.define('venus', require='__planet/mars')
+        with self.assertRaises(core.CircularDependencyError) as cm:
+            self.graph.check()
+        cycle = cm.exception.cycle
+        self.assertEqual(cycle[0], cycle[-1])
+        self.assertEqual(sorted(cycle[1:]), ['__planet/erde', '__planet/mars', '__planet/venus'])
+        self.assertIsInstance(cm.exception, cdist.UnresolvableRequirementsError)
+
+    def test_self_requirement(self):
+        self.define('erde', require='__planet/erde')
+        with self.assertRaises(core.CircularDependencyError) as cm:
+            self.graph.check()
+        self.assertEqual(cm.exception.cycle, ['__planet/erde', '__planet/erde'])
+
+    def test_incremental(self):
+        self.define('erde', require='__planet/mars')
+        self.graph.check()
+        self.assertEqual(self.graph.read_journal(), set())
+        # Closing the cycle later is detected as well
+        self.define('mars', require='__planet/erde')
+        with self.assertRaises(core.CircularDependencyError):
+            self.graph.check()
+
+    def test_undefined_requirement(self):
+        self.define('erde', require='__planet/pluto')
+        self.graph.check()
+        self.assertEqual(self.graph.successors('__planet/pluto'), [])
+
+    def test_resolve_pattern(self):
+        self.define('erde')
+        self.define('mars')
+        self.graph.check()
+        self.assertEqual(self.graph.resolve('__planet/venus', ['__planet/*', '__moon/foo']),
+            ['__planet/erde', '__planet/mars', '__moon/foo'])
+        # An object does not match its own pattern
+        self.assertEqual(self.graph.resolve('__planet/erde', ['__planet/*']), ['__planet/mars'])
+
+    def test_pattern_matches_later_objects(self):
+        self.define('erde', require='__planet/m*')
+        self.graph.check()
+        # Kept until it matches, so erde waits
+        self.assertEqual(self.graph.successors('__planet/erde'), ['__planet/m*'])
+        self.define('mars')
+        self.graph.check()
+        self.assertEqual(self.graph.successors('__planet/erde'), ['__planet/mars'])
+
+    def test_pattern_only_matches_star(self):
+        self.define('erde')
+        self.define('mars')
+        self.graph.check()
+        self.assertEqual(self.graph.resolve('__planet/venus', ['__planet/[em]*']),
+            ['__planet/[em]*'])
+        self.assertEqual(self.graph.resolve('__planet/venus', ['__planet/?rde']),
+            ['__planet/?rde'])
+        self.assertEqual(self.graph.resolve('__planet/venus', ['__planet/*r*']),
+            ['__planet/erde', '__planet/mars'])
+
+    def test_unmatched_pattern_is_unfinished(self):
+        self.define('erde', require='__planet/pluto*')
+        self.graph.check()
+        erde = core.CdistObject.lookup(self.local.object_path, self.local.type_path,
+            '__planet', 'erde')
+        requirements = self.graph.resolve(erde.name, erde.requirements)
+        self.assertEqual([o.name for o in erde.requirements_unfinished(requirements)],
+            ['__planet/pluto*'])
+
+    def test_literal_requirement_is_validated(self):
+        with self.assertRaises(core.cdist_type.NoSuchTypeError):
+            self.define('erde', require='__does-not-exist/bar[1]')
+
+    def test_pattern_cycle(self):
+        self.define('erde', require='__planet/m*')
+        self.define('mars', require='__planet/erde')
+        with self.assertRaises(core.CircularDependencyError):
+            self.graph.check()
+
+    def test_pattern_type_must_exist(self):
+        with self.assertRaises(core.cdist_type.NoSuchTypeError):
+            self.define('erde', require='__does-not-exist/*')
+
+    def test_pattern_type_name(self):
+        with self.assertRaises(cdist.Error):
+            self.define('erde', require='__pla*/erde')
+
+    def test_critical_paths(self):
+        self.define('erde')
+        self.define('mars', require='__planet/erde')
+        self.define('venus', require='__planet/mars')
+        self.define('pluto')
+        self.graph.check()
+        names = ['__planet/erde', '__planet/mars', '__planet/venus', '__planet/pluto']
+        cost = { '__planet/erde': 1.0, '__planet/mars': 2.0,
+            '__planet/venus': 3.0, '__planet/pluto': 5.0 }
+        paths = self.graph.critical_paths(names, cost.get)
+        self.assertEqual(paths['__planet/venus'], 3.0)
+        self.assertEqual(paths['__planet/mars'], 5.0)
+        self.assertEqual(paths['__planet/erde'], 6.0)
+        self.assertEqual(paths['__planet/pluto'], 5.0)
@@ -128,6 +128,40 @@ class EmulatorTestCase(test.CdistTestCase):
         self.assertEqual(list(file_object.requirements), ['__planet/mars'])
         # if we get here all is fine
 
+    def _run_ordered(self, argv, **env):
+        self.env.pop('require', None)
+        emu = emulator.Emulator(argv, env=dict(self.env, **env))
+        emu.run()
+        return emu.cdist_object
+
+    def test_order_dependency_per_manifest(self):
+        self.env['CDIST_ORDER_DEPENDENCY'] = 'on'
+        erde = self._run_ordered(['__planet', 'erde'])
+        # The type manifest of erde is another manifest with its own order
+        moon = self._run_ordered(['__planet', 'moon'],
+            __cdist_manifest='/type/__planet/manifest', __object_name=erde.name)
+        mars = self._run_ordered(['__planet', 'mars'])
+        self.assertEqual(list(moon.requirements), [])
+        self.assertEqual(list(mars.requirements), ['__planet/erde'])
+
+    def test_order_dependency_existing_object(self):
+        self.env['CDIST_ORDER_DEPENDENCY'] = 'on'
+        self._run_ordered(['__planet', 'erde'])
+        mars = self._run_ordered(['__planet', 'mars'])
+        # Defining mars again does not make it require itself
+        mars = self._run_ordered(['__planet', 'mars'])
+        self.assertEqual(list(mars.requirements), ['__planet/erde'])
+        venus = self._run_ordered(['__planet', 'venus'])
+        self.assertEqual(list(venus.requirements), ['__planet/mars'])
+
+    def test_order_not_recorded_without_order_dependency(self):
+        self._run_ordered(['__planet', 'erde'])
+        self.assertFalse(os.path.exists(os.path.join(self.local.base_path, "order")))
+        mars = self._run_ordered(['__planet', 'mars'], CDIST_ORDER_DEPENDENCY='on')
+        self.assertEqual(list(mars.requirements), [])
+        venus = self._run_ordered(['__planet', 'venus'], CDIST_ORDER_DEPENDENCY='on')
+        self.assertEqual(list(venus.requirements), ['__planet/mars'])
+
 
 class AutoRequireEmulatorTestCase(test.CdistTestCase):
 
@@ -194,6 +228,71 @@ class OverrideTestCase(test.CdistTestCase):
         emu.run()
 
 
+class BulkEmulatorTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        handle, self.script = self.mkstemp(dir=self.temp_dir)
+        os.close(handle)
+        base_path = self.temp_dir
+
+        self.local = local.Local(
+            target_host=self.target_host,
+            base_path=base_path,
+            exec_path=test.cdist_exec_path,
+            add_conf_dirs=[conf_dir])
+        self.local.create_files_dirs()
+
+        self.manifest = core.Manifest(self.target_host, self.local)
+        self.env = self.manifest.env_initial_manifest(self.script)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _define(self, text, env=None):
+        emu = emulator.BulkEmulator([cdist.DEFINE_COMMAND], stdin=io.StringIO(text),
+            env=env or self.env)
+        emu.run()
+
+    def _object(self, type_name, object_id):
+        cdist_type = core.CdistType(self.local.type_path, type_name)
+        return core.CdistObject(cdist_type, self.local.object_path, object_id)
+
+    def test_define(self):
+        self._define("""# planets
+__planet erde
+require="__planet/erde" __planet mars
+__arguments_required 'some id' --required1 'one value' --required2 two
+""")
+        self.assertTrue(self._object('__planet', 'erde').exists)
+        self.assertEqual(list(self._object('__planet', 'mars').requirements), ['__planet/erde'])
+        cdist_object = self._object('__arguments_required', 'some id')
+        self.assertEqual(cdist_object.parameters['required1'], 'one value')
+        self.assertEqual(cdist_object.parameters['required2'], 'two')
+        self.assertFalse(os.path.exists(os.path.join(cdist_object.absolute_path, 'stdin')))
+        journal = core.dependency.journal_path(self.local.base_path)
+        with open(journal) as fd:
+            self.assertEqual(fd.read().splitlines(), ['__planet/erde', '__planet/mars',
+                '__arguments_required/some id'])
+
+    def test_conflicting_parameters(self):
+        self._define("__arguments_required some-id --required1 1 --required2 2\n")
+        with self.assertRaises(cdist.Error):
+            self._define("__arguments_required some-id --required1 1 --required2 3\n")
+
+    def test_autorequire(self):
+        self._define("__planet erde\n")
+        env = self.manifest.env_type_manifest(self._object('__planet', 'erde'))
+        self._define("__moon luna --planet erde\n", env=env)
+        self.assertEqual(list(self._object('__planet', 'erde').autorequire), ['__moon/luna'])
+
+    def test_errors_name_line(self):
+        with self.assertRaisesRegex(cdist.Error, ":2:"):
+            self._define("__planet erde\nfoo bar\n")
+        with self.assertRaises(core.cdist_type.NoSuchTypeError):
+            self._define("__does-not-exist some-id\n")
+
+
 class ArgumentsTestCase(test.CdistTestCase):
 
     def setUp(self):
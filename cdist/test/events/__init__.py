@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import json
+import os
+import shutil
+
+from cdist import test
+import cdist.events
+
+
+class EventsTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "events")
+        cdist.events.Events.start(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _load(self):
+        with open(self.path) as fd:
+            return [json.loads(line) for line in fd]
+
+    def test_disabled(self):
+        events = cdist.events.Events(None, "localhost")
+        with events.span("host"):
+            events.emit("object_run", object="__file/foo")
+        self.assertEqual(self._load(), [])
+
+    def test_emit(self):
+        events = cdist.events.Events(self.path, "localhost")
+        events.emit("object_run", object="__file/foo", changed=True)
+        event, = self._load()
+        self.assertEqual(event['event'], "object_run")
+        self.assertEqual(event['host'], "localhost")
+        self.assertEqual(event['object'], "__file/foo")
+        self.assertTrue(event['changed'])
+        self.assertIn('time', event)
+
+    def test_run_events_have_no_host(self):
+        cdist.events.Events(self.path).emit("run_started")
+        self.assertNotIn('host', self._load()[0])
+
+    def test_span(self):
+        events = cdist.events.Events(self.path, "localhost")
+        with events.span("stage", stage="global explorers"):
+            pass
+        started, finished = self._load()
+        self.assertEqual(started['event'], "stage_started")
+        self.assertEqual(finished['event'], "stage_finished")
+        self.assertEqual(finished['stage'], "global explorers")
+        self.assertEqual(finished['status'], "ok")
+        self.assertGreaterEqual(finished['duration'], 0)
+
+    def test_span_failed(self):
+        events = cdist.events.Events(self.path, "localhost")
+        with self.assertRaises(cdist.Error):
+            with events.span("host"):
+                raise cdist.Error("broken")
+        started, finished = self._load()
+        self.assertEqual(finished['status'], "failed")
+        self.assertEqual(finished['error'], "broken")
+
+    def test_hosts_share_file(self):
+        for host in ("a", "b"):
+            cdist.events.Events(self.path, host).emit("host_started")
+        self.assertEqual([event['host'] for event in self._load()], ["a", "b"])
@@ -26,6 +26,7 @@ import getpass
 
 import cdist
 from cdist import core
+import cdist.exec.stats
 from cdist import test
 from cdist.exec import local
 from cdist.exec import remote
@@ -98,6 +99,34 @@ class ExplorerClassTestCase(test.CdistTestCase):
         self.assertEqual(names, output)
         shutil.rmtree(out_path)
 
+    def test_global_explorers_concurrently(self):
+        """Ensure concurrent global explorers create the same output"""
+        serial_path = self.mkdtemp(dir=self.temp_dir)
+        concurrent_path = self.mkdtemp(dir=self.temp_dir)
+
+        self.explorer.run_global_explorers(serial_path)
+        self.explorer.jobs = 4
+        self.explorer.run_global_explorers(concurrent_path)
+
+        names = sorted(os.listdir(serial_path))
+        self.assertEqual(names, sorted(os.listdir(concurrent_path)))
+        for name in names:
+            with open(os.path.join(serial_path, name)) as fd:
+                expected = fd.read()
+            with open(os.path.join(concurrent_path, name)) as fd:
+                self.assertEqual(fd.read(), expected)
+
+    def test_global_explorers_concurrently_report_errors(self):
+        """Ensure every failing global explorer is reported"""
+        for name in ("broken", "failing"):
+            with open(os.path.join(self.local.global_explorer_path, name), "w") as fd:
+                fd.write("exit 1\n")
+        self.explorer.jobs = 4
+        out_path = self.mkdtemp(dir=self.temp_dir)
+        with self.assertRaises(explorer.GlobalExplorerError) as context:
+            self.explorer.run_global_explorers(out_path)
+        self.assertEqual(sorted(context.exception.errors), ["broken", "failing"])
+
     def test_list_type_explorer_names(self):
         cdist_type = core.CdistType(self.local.type_path, '__test_type')
         expected = cdist_type.explorers
@@ -135,6 +164,34 @@ class ExplorerClassTestCase(test.CdistTestCase):
         destination = os.path.join(self.remote.object_path, cdist_object.parameter_path)
         self.assertEqual(sorted(os.listdir(source)), sorted(os.listdir(destination)))
 
+    def test_transfer_objects_parameters(self):
+        cdist_type = core.CdistType(self.local.type_path, '__test_type')
+        cdist_objects = []
+        for object_id in ('one', 'two/three', 'none'):
+            cdist_object = core.CdistObject(cdist_type, self.local.object_path, object_id)
+            cdist_object.create()
+            if object_id != 'none':
+                cdist_object.parameters = {'first': object_id}
+            cdist_objects.append(cdist_object)
+        self.explorer.transfer_objects_parameters(cdist_objects)
+        for cdist_object in cdist_objects[:2]:
+            destination = os.path.join(self.remote.object_path, cdist_object.parameter_path)
+            with open(os.path.join(destination, 'first')) as fd:
+                self.assertEqual(fd.read(), cdist_object.object_id + '\n')
+        self.assertFalse(os.path.exists(os.path.join(self.remote.object_path,
+            cdist_objects[2].parameter_path)))
+        self.assertFalse([name for name in os.listdir(self.remote.base_path)
+            if name.endswith('.tar')])
+
+        # Only changed parameters are transferred again
+        transferred = []
+        self.remote.transfer = lambda source, destination: transferred.append(source)
+        self.explorer.transfer_object_parameters(cdist_objects[0])
+        self.assertEqual(transferred, [])
+        cdist_objects[0].parameters['second'] = 'value'
+        self.explorer.transfer_object_parameters(cdist_objects[0])
+        self.assertEqual(len(transferred), 1)
+
     def test_run_type_explorer(self):
         cdist_type = core.CdistType(self.local.type_path, '__test_type')
         cdist_object = core.CdistObject(cdist_type, self.local.object_path, 'whatever')
@@ -148,3 +205,101 @@ class ExplorerClassTestCase(test.CdistTestCase):
         cdist_object.create()
         self.explorer.run_type_explorers(cdist_object)
         self.assertEqual(cdist_object.explorers, {'world': 'hello'})
+
+    def _script(self, content):
+        handle, script = self.mkstemp(dir=self.temp_dir)
+        with os.fdopen(handle, "w") as fd:
+            fd.write(content)
+        return script
+
+    def test_stream_output(self):
+        """Ensure multibyte characters split between chunks are decoded"""
+        script = self._script("i=0; while [ $i -lt 1000 ]; do printf '\\303\\244\\303\\266-'; i=$((i+1)); done\n")
+        self.remote.chunk_size = 7
+        output_path = os.path.join(self.temp_dir, "output")
+        self.remote.run_script(script, output_path=output_path)
+        with open(output_path, encoding="utf-8") as fd:
+            self.assertEqual(fd.read(), "\u00e4\u00f6-" * 1000)
+
+    def test_stream_output_not_utf8(self):
+        script = self._script("printf '\\377'\n")
+        output_path = os.path.join(self.temp_dir, "output")
+        with self.assertRaises(remote.DecodeError):
+            self.remote.run_script(script, output_path=output_path)
+
+    def test_stream_output_fail(self):
+        script = self._script("echo partial; exit 1\n")
+        output_path = os.path.join(self.temp_dir, "output")
+        with self.assertRaises(cdist.Error):
+            self.remote.run_script(script, output_path=output_path)
+
+    def test_ensure_newline(self):
+        path = os.path.join(self.temp_dir, "output")
+        for content, expected in (("", ""), ("hello", "hello\n"), ("hello\n", "hello\n")):
+            with open(path, "w") as fd:
+                fd.write(content)
+            explorer.ensure_newline(path)
+            with open(path) as fd:
+                self.assertEqual(fd.read(), expected)
+
+
+class KeptConfTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir           = self.mkdtemp()
+        self.local_path         = os.path.join(self.temp_dir, "local")
+        self.remote_base_path   = os.path.join(self.temp_dir, "remote")
+        os.makedirs(self.remote_base_path)
+
+        self.local = local.Local(
+            target_host=self.target_host,
+            base_path=self.local_path,
+            exec_path=test.cdist_exec_path,
+            add_conf_dirs=[conf_dir],
+            )
+        self.local.create_files_dirs()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self):
+        """Transfer the global explorers like a new run would"""
+        self.remote = remote.Remote(
+            target_host=self.target_host,
+            remote_exec=self.remote_exec,
+            remote_copy=self.remote_copy,
+            base_path=self.remote_base_path,
+            keep_conf=True)
+        self.remote.create_files_dirs()
+        explorer.Explorer(self.target_host, self.local, self.remote).transfer_global_explorers()
+        return self.remote.stats.calls[cdist.exec.stats.REMOTE_COPY]
+
+    def test_only_changed_files_are_copied(self):
+        names = os.listdir(self.local.global_explorer_path)
+        self.assertEqual(self._run(), len(names))
+        self.assertEqual(self._run(), 0)
+
+        local_explorer = os.path.join(self.local.global_explorer_path, "global")
+        changed = os.path.join(self.temp_dir, "global")
+        with open(changed, "w") as fd:
+            fd.write("echo changed\n")
+        os.remove(local_explorer)
+        os.symlink(changed, local_explorer)
+        self.assertEqual(self._run(), 1)
+        remote_explorer = os.path.join(self.remote.global_explorer_path, "global")
+        with open(remote_explorer) as fd:
+            self.assertEqual(fd.read(), "echo changed\n")
+        self.assertEqual(os.stat(remote_explorer).st_mode & 0o777, 0o700)
+
+    def test_stale_files_are_removed(self):
+        self._run()
+        os.remove(os.path.join(self.local.global_explorer_path, "foobar"))
+        self.assertEqual(self._run(), 0)
+        self.assertEqual(sorted(os.listdir(self.local.global_explorer_path)),
+            sorted(os.listdir(self.remote.global_explorer_path)))
+
+    def test_objects_are_removed(self):
+        self._run()
+        os.makedirs(os.path.join(self.remote.object_path, "__file", "old"))
+        self._run()
+        self.assertFalse(os.path.exists(self.remote.object_path))
@@ -106,6 +106,52 @@ class ManifestTestCase(test.CdistTestCase):
         self.assertEqual(output_dict['__object_id'], cdist_object.object_id)
         self.assertEqual(output_dict['__object_name'], cdist_object.name)
 
+    def _object(self, type_name, object_id):
+        cdist_type = core.CdistType(self.local.type_path, type_name)
+        return core.CdistObject(cdist_type, self.local.object_path, object_id)
+
+    def test_python_initial_manifest(self):
+        self.manifest.run_initial_manifest(os.path.join(self.local.manifest_path, "python.py"))
+        self.assertTrue(self._object('__planet', 'Saturn').exists)
+        titan = self._object('__moon', 'Titan')
+        self.assertEqual(titan.parameters, {'planet': 'Saturn'})
+        self.assertEqual(list(titan.requirements), ['__planet/Saturn'])
+        journal = core.dependency.journal_path(self.local.base_path)
+        with open(journal) as fd:
+            self.assertEqual(fd.read().splitlines(),
+                ['__planet/Saturn', '__moon/Prometheus', '__moon/Titan'])
+
+    def test_python_type_manifest(self):
+        cdist_object = self._object('__python_planet', 'Jupiter')
+        cdist_object.create()
+        self.manifest.run_type_manifest(cdist_object)
+        moon = self._object('__moon', 'Jupiter-moon')
+        self.assertEqual(moon.parameters, {'planet': 'Jupiter'})
+        self.assertEqual(list(cdist_object.autorequire), ['__moon/Jupiter-moon'])
+        with open(os.path.join(moon.absolute_path, 'stdin')) as fd:
+            self.assertEqual(fd.read(), self.target_host + '\n')
+
+    def test_python_type_manifest_explorer_and_messages(self):
+        with open(os.path.join(self.local.global_explorer_out_path, 'os'), 'w') as fd:
+            fd.write('Mercury\n')
+        cdist_object = self._object('__python_explorer', 'x')
+        cdist_object.create()
+        self.manifest.run_type_manifest(cdist_object)
+        self.assertTrue(self._object('__planet', 'Mercury').exists)
+        with open(self.local.messages_path) as fd:
+            self.assertEqual(fd.read(), '__python_explorer/x:os:Mercury\n')
+
+    def test_python_manifest_errors(self):
+        initial_manifest = os.path.join(self.temp_dir, "broken.py")
+        with open(initial_manifest, "w") as fd:
+            fd.write("define('__planet', 'Saturn')\nundefined_name\n")
+        with self.assertRaisesRegex(cdist.Error, "broken.py:2: NameError"):
+            self.manifest.run_initial_manifest(initial_manifest)
+        with open(initial_manifest, "w") as fd:
+            fd.write("define('__moon', 'Titan')\n")
+        with self.assertRaises(cdist.Error):
+            self.manifest.run_initial_manifest(initial_manifest)
+
     def test_debug_env_setup(self):
         current_level = self.log.getEffectiveLevel()
         self.log.setLevel(logging.DEBUG)
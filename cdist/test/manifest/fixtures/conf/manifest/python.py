@@ -0,0 +1,4 @@
+# Initial manifest written in python
+saturn = define("__planet", "Saturn")
+for name in ("Prometheus", "Titan"):
+    define("__moon", name, planet="Saturn", require=[saturn])
@@ -0,0 +1,5 @@
+# Type manifest written in python, using explorers and messages
+os_name = explorer("os").strip()
+define("__planet", os_name)
+with open(env["__messages_out"], "a") as fd:
+    fd.write("os:%s\n" % os_name)
@@ -0,0 +1,3 @@
+# Type manifest written in python
+define("__moon", env["__object_id"] + "-moon", planet=env["__object_id"],
+    stdin=target_host + "\n")
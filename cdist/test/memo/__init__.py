@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import fcntl
+import os
+import shutil
+import signal
+import time
+
+import cdist
+from cdist import core
+from cdist import test
+from cdist.exec import local
+from cdist.exec import remote
+from cdist.core import code
+from cdist.core import memo
+
+import os.path as op
+my_dir = op.abspath(op.dirname(__file__))
+fixtures = op.join(my_dir, 'fixtures')
+conf_dir = op.join(fixtures, 'conf')
+
+
+class GencodeMemoTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.orig_environ = os.environ
+        os.environ = os.environ.copy()
+        self.temp_dir = self.mkdtemp()
+        self.counter = os.path.join(self.temp_dir, "counter")
+        os.environ['CDIST_TEST_GENCODE_COUNTER'] = self.counter
+
+        self.memo_path = os.path.join(self.temp_dir, "memo")
+        os.mkdir(self.memo_path)
+        self.memo = memo.GencodeMemo(self.memo_path)
+
+    def tearDown(self):
+        os.environ = self.orig_environ
+        shutil.rmtree(self.temp_dir)
+
+    def _code(self, host):
+        base_path = os.path.join(self.temp_dir, host)
+        l = local.Local(
+            target_host=host,
+            base_path=base_path,
+            exec_path=cdist.test.cdist_exec_path,
+            add_conf_dirs=[conf_dir])
+        l.create_files_dirs()
+        with open(os.path.join(l.global_explorer_out_path, "os"), "w") as fd:
+            fd.write("debian\n")
+        r = remote.Remote(
+            target_host=host,
+            remote_exec=self.remote_exec,
+            remote_copy=self.remote_copy,
+            base_path=os.path.join(self.temp_dir, host + "-remote"))
+        return code.Code(host, l, r, memo=self.memo)
+
+    def _object(self, c, type_name, value):
+        cdist_type = core.CdistType(c.local.type_path, type_name)
+        cdist_object = core.CdistObject(cdist_type, c.local.object_path, 'whatever')
+        cdist_object.create()
+        cdist_object.parameters = { 'value': value }
+        return cdist_object
+
+    def _runs(self):
+        with open(self.counter) as fd:
+            return len(fd.readlines())
+
+    def test_shared(self):
+        outputs = []
+        for host in ["first", "second"]:
+            c = self._code(host)
+            outputs.append(c.run_gencode_remote(self._object(c, '__shared', 'foo')))
+        self.assertEqual(outputs, ["echo foo debian\n"] * 2)
+        self.assertEqual(self._runs(), 1)
+        self.assertEqual(self.memo.hits, 1)
+
+    def test_different_parameters(self):
+        for host, value in [("first", "foo"), ("second", "bar")]:
+            c = self._code(host)
+            c.run_gencode_remote(self._object(c, '__shared', value))
+        self.assertEqual(self._runs(), 2)
+
+    def test_different_global_explorer(self):
+        first = self._code("first")
+        first.run_gencode_remote(self._object(first, '__shared', 'foo'))
+        second = self._code("second")
+        with open(os.path.join(second.local.global_explorer_out_path, "os"), "w") as fd:
+            fd.write("freebsd\n")
+        output = second.run_gencode_remote(self._object(second, '__shared', 'foo'))
+        self.assertEqual(output, "echo foo freebsd\n")
+        self.assertEqual(self._runs(), 2)
+
+    def test_target_host_not_shared(self):
+        outputs = []
+        for host in ["first", "second"]:
+            c = self._code(host)
+            outputs.append(c.run_gencode_remote(self._object(c, '__unshared', 'foo')))
+        self.assertEqual(outputs, ["echo first\n", "echo second\n"])
+        self.assertEqual(self._runs(), 2)
+
+    def test_object_write_not_shared(self):
+        script = os.path.join(self.temp_dir, "gencode-local")
+        with open(script, "w") as fd:
+            fd.write('mkdir "$__object/files"\n')
+        self.assertIsNone(self.memo._script_info(script))
+
+    def test_lock_timeout(self):
+        self.memo.wait_max = 0.1
+        with open(os.path.join(self.memo_path, "key.lock"), "w") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.assertEqual(self.memo.get("key", lambda: "computed"), "computed")
+        self.assertEqual(self.memo.hits, 0)
+
+    def test_stale_lock(self):
+        # A host killed while computing does not make the others wait
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                fd = os.open(os.path.join(self.memo_path, "key.lock"), os.O_RDWR | os.O_CREAT)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(write_fd, b"x")
+                time.sleep(60)
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        os.read(read_fd, 1)
+        os.close(read_fd)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        start = time.time()
+        self.assertEqual(self.memo.get("key", lambda: "computed"), "computed")
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.memo.get("key", lambda: "again"), "computed")
+
+    def test_failed_compute(self):
+        def fail():
+            raise cdist.Error("gencode failed")
+        with self.assertRaises(cdist.Error):
+            self.memo.get("key", fail)
+        self.assertEqual(os.listdir(self.memo_path), ["key.lock"])
+        self.assertEqual(self.memo.get("key", lambda: "computed"), "computed")
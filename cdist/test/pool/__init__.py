@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import os
+import shutil
+
+import cdist
+from cdist import test
+import cdist.exec.local
+import cdist.exec.stats
+import cdist.exec.pool
+
+
+class ShellPoolTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.pool = cdist.exec.pool.ShellPool()
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _script(self, content):
+        handle, script = self.mkstemp(dir=self.temp_dir)
+        with os.fdopen(handle, "w") as fd:
+            fd.write(content)
+        return script
+
+    def test_output_and_environment(self):
+        script = self._script('echo "$__object_id"\necho "$HOME"\n')
+        env = dict(os.environ, __object_id="it's\nme")
+        env.pop('HOME', None)
+        self.assertEqual(self.pool.run(script, env), (0, b"it's\nme\n\n"))
+
+    def test_environment_is_per_script(self):
+        self.pool.run(self._script('FOO=bar; export BAR=baz\n'), dict(os.environ))
+        script = self._script('echo "${FOO:-unset} ${BAR:-unset}"\n')
+        self.assertEqual(self.pool.run(script, dict(os.environ)), (0, b"unset unset\n"))
+        self.assertEqual(len(self.pool._shells), 1)
+
+    def test_errexit(self):
+        script = self._script('echo before\nfalse\necho after\n')
+        self.assertEqual(self.pool.run(script, dict(os.environ)), (1, b"before\n"))
+        script = self._script('exit 3\n')
+        self.assertEqual(self.pool.run(script, dict(os.environ))[0], 3)
+        # The shell survives failing scripts
+        self.assertEqual(self.pool.run(self._script('echo ok\n'), dict(os.environ)), (0, b"ok\n"))
+
+    def test_stdin_is_not_the_pool(self):
+        script = self._script('cat\necho done\n')
+        self.assertEqual(self.pool.run(script, dict(os.environ)), (0, b"done\n"))
+
+    def test_local_run_script(self):
+        local = cdist.exec.local.Local(
+            target_host=self.target_host,
+            base_path=os.path.join(self.temp_dir, "out"),
+            exec_path=test.cdist_exec_path,
+            shell_pool=True)
+        try:
+            script = self._script('echo "$__target_host"\n')
+            self.assertEqual(local.run_script(script, return_output=True),
+                self.target_host + "\n")
+            with self.assertRaises(cdist.Error):
+                local.run_script(self._script('false\n'))
+            # Accounted apart from forked processes
+            self.assertEqual(local.stats.calls[cdist.exec.stats.LOCAL_POOL], 2)
+            self.assertEqual(local.stats.calls[cdist.exec.stats.LOCAL], 0)
+            local.run_script(self._script('true\n'), stream=True)
+            self.assertEqual(local.stats.calls[cdist.exec.stats.LOCAL], 1)
+        finally:
+            local.close()
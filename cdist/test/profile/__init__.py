@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os
+import pstats
+import shutil
+
+from cdist import test
+import cdist.profile
+
+
+def work():
+    return sum(range(100))
+
+
+def other_work():
+    return sum(range(10))
+
+
+class ProfileTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _functions(self, path):
+        return [ key[2] for key in pstats.Stats(path).stats ]
+
+    def test_host_directory(self):
+        profile = cdist.profile.Profile(self.temp_dir, "config", self.target_host)
+        with profile:
+            work()
+        self.assertEqual(os.path.dirname(profile.stats_path),
+            os.path.join(self.temp_dir, self.target_host))
+        self.assertIn("work", self._functions(profile.stats_path))
+
+    def test_nested(self):
+        outer = cdist.profile.Profile(self.temp_dir, "main")
+        inner = cdist.profile.Profile(self.temp_dir, "config", self.target_host)
+        with outer:
+            with inner:
+                work()
+            other_work()
+
+        self.assertIn("work", self._functions(inner.stats_path))
+        self.assertNotIn("other_work", self._functions(inner.stats_path))
+        self.assertIn("other_work", self._functions(outer.stats_path))
+        self.assertNotIn("work", self._functions(outer.stats_path))
+
+    def test_from_env(self):
+        env = { cdist.profile.ENV_NAME: self.temp_dir }
+        profile = cdist.profile.Profile.from_env(env, "emulator", self.target_host)
+        self.assertTrue(profile.enabled)
+        self.assertFalse(cdist.profile.Profile.from_env({}, "emulator", self.target_host).enabled)
+
+    def test_summarise(self):
+        for name in ["config", "emulator"]:
+            with cdist.profile.Profile(self.temp_dir, name, self.target_host):
+                work()
+        profile = cdist.profile.Profile(self.temp_dir, "config", self.target_host)
+        profile.summarise()
+        with open(os.path.join(self.temp_dir, self.target_host,
+                cdist.profile.SUMMARY_NAME)) as fd:
+            summary = fd.read()
+        self.assertTrue(summary.startswith("2 profile(s) of %s" % self.target_host))
+
+    def test_disabled(self):
+        profile = cdist.profile.Profile(None, "main")
+        with profile:
+            work()
+        profile.summarise()
+        self.assertEqual(os.listdir(self.temp_dir), [])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+import argparse
+
+from cdist import test
+import cdist.rollout
+
+
+class RolloutTestCase(test.CdistTestCase):
+
+    def _hosts(self, count):
+        return iter("host%d" % i for i in range(count))
+
+    def _names(self, *numbers):
+        return ["host%d" % i for i in numbers]
+
+    def _waves(self, rollout, fail=()):
+        waves = []
+        for wave in rollout:
+            hosts = list(wave)
+            waves.append(hosts)
+            rollout.failed_hosts.extend(host for host in hosts if host in fail)
+        return waves
+
+    def test_parse_amount(self):
+        self.assertEqual(cdist.rollout.parse_amount('10'), (10.0, False))
+        self.assertEqual(cdist.rollout.parse_amount('5%'), (5.0, True))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cdist.rollout.parse_amount('many')
+
+    def test_single_wave(self):
+        rollout = cdist.rollout.Rollout(self._hosts(5))
+        self.assertEqual(self._waves(rollout), [self._names(0, 1, 2, 3, 4)])
+
+    def test_fixed_size(self):
+        rollout = cdist.rollout.Rollout(self._hosts(5), (2, False))
+        self.assertEqual(self._waves(rollout), [self._names(0, 1), self._names(2, 3), self._names(4)])
+
+    def test_ramp(self):
+        rollout = cdist.rollout.Rollout(self._hosts(10), (1, False), ramp=2)
+        self.assertEqual(self._waves(rollout), [self._names(0), self._names(1, 2),
+            self._names(3, 4, 5, 6), self._names(7, 8, 9)])
+
+    def test_percentage(self):
+        rollout = cdist.rollout.Rollout(self._hosts(10), (20, True))
+        self.assertEqual(len(self._waves(rollout)), 5)
+
+    def test_failure_budget(self):
+        rollout = cdist.rollout.Rollout(self._hosts(10), (2, False),
+            max_failures=(1, False))
+        self.assertEqual(self._waves(rollout, fail=self._names(1, 2)),
+            [self._names(0, 1), self._names(2, 3)])
+        self.assertEqual(rollout.skipped, 6)
+        with self.assertRaises(cdist.rollout.FailureBudgetExceeded):
+            rollout.check()
+
+    def test_failures_within_budget(self):
+        rollout = cdist.rollout.Rollout(self._hosts(4), (2, False),
+            max_failures=(50, True))
+        self.assertEqual(self._waves(rollout, fail=self._names(1)),
+            [self._names(0, 1), self._names(2, 3)])
+        self.assertEqual(rollout.skipped, 0)
+        with self.assertRaises(cdist.Error):
+            rollout.check()
+
+    def test_failure_budget_without_waves(self):
+        rollout = cdist.rollout.Rollout(self._hosts(5), max_failures=(1, False))
+        configured = []
+        for wave in rollout:
+            for host in wave:
+                configured.append(host)
+                if host in self._names(0, 2):
+                    rollout.failed_hosts.append(host)
+        self.assertEqual(configured, self._names(0, 1, 2))
+        self.assertEqual(rollout.skipped, 2)
+        with self.assertRaises(cdist.rollout.FailureBudgetExceeded):
+            rollout.check()
+
+    def test_invalid_ramp(self):
+        with self.assertRaises(cdist.Error):
+            cdist.rollout.Rollout([], ramp=0.5)
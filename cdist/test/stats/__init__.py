@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+import os
+import shutil
+
+from cdist import test
+from cdist.exec import local
+from cdist.exec import remote
+from cdist.exec import stats
+
+
+class StatsTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.stats = stats.Stats(self.target_host)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_slowest(self):
+        for duration in [0.3, 0.1, 0.5, 0.2, 0.4, 0.6, 0.05]:
+            self.stats.record(stats.LOCAL, ["sleep", str(duration)], duration)
+        self.assertEqual([s[0] for s in self.stats.slowest], [0.6, 0.5, 0.4, 0.3, 0.2])
+        self.assertEqual(self.stats.calls[stats.LOCAL], 7)
+
+    def test_stage(self):
+        with self.stats.stage("gencode"):
+            self.stats.record(stats.LOCAL, ["gencode-local"], 0.1)
+            with self.stats.stage("transfer"):
+                self.stats.record(stats.REMOTE_COPY, ["scp"], 0.1)
+            self.stats.record(stats.LOCAL, ["gencode-remote"], 0.1)
+        self.stats.record(stats.LOCAL, ["outside"], 0.1)
+
+        self.assertEqual(self.stats.stages["gencode"][stats.LOCAL], 2)
+        self.assertEqual(self.stats.stages["gencode"][stats.REMOTE_COPY], 0)
+        self.assertEqual(self.stats.stages["transfer"][stats.REMOTE_COPY], 1)
+        self.assertEqual(self.stats.stages["gencode"]['count'], 1)
+        self.assertEqual(self.stats.calls[stats.LOCAL], 3)
+
+    def test_local_run(self):
+        l = local.Local(self.target_host, base_path=self.temp_dir, stats=self.stats)
+        l.run(['/bin/true'])
+        l.run(['/bin/echo'], return_output=True)
+        self.assertEqual(self.stats.calls[stats.LOCAL], 2)
+        self.assertEqual(self.stats.round_trips, 0)
+
+    def test_remote_round_trips(self):
+        source = os.path.join(self.temp_dir, "source")
+        with open(source, "w") as fd:
+            fd.write("12345")
+        destination = os.path.join(self.temp_dir, "destination")
+
+        r = remote.Remote(self.target_host, remote_exec=self.remote_exec,
+            remote_copy=self.remote_copy, base_path=self.temp_dir, stats=self.stats)
+        self.assertEqual(r.run(['echo', 'foobar'], return_output=True), "foobar\n")
+        r.transfer(source, destination)
+
+        # transfer: remote rm + remote copy
+        self.assertEqual(self.stats.calls[stats.REMOTE_EXEC], 2)
+        self.assertEqual(self.stats.calls[stats.REMOTE_COPY], 1)
+        self.assertEqual(self.stats.round_trips, 3)
+        self.assertEqual(self.stats.bytes_sent, 5)
+        self.assertEqual(self.stats.bytes_received, 7)
+
+    def test_write(self):
+        path = os.path.join(self.temp_dir, "stats")
+        self.stats.record(stats.REMOTE_EXEC, ["true"], 0.1)
+        self.stats.write(path)
+        other = stats.Stats("otherhost")
+        other.write(path)
+        with open(path) as fd:
+            hosts = [json.loads(line)['host'] for line in fd]
+        self.assertEqual(hosts, [self.target_host, "otherhost"])
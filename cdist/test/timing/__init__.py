@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+import os
+import shutil
+
+from cdist import test
+from cdist import core
+from cdist.core import timing
+
+
+class TimingsTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.base_path = os.path.join(self.temp_dir, "out")
+        self.cache_path = os.path.join(self.temp_dir, "cache")
+        os.mkdir(self.base_path)
+        os.mkdir(self.cache_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _previous(self, timings):
+        with open(os.path.join(self.cache_path, timing.TIMINGS_NAME), "w") as fd:
+            json.dump(timings, fd)
+        return core.Timings(self.base_path, self.cache_path)
+
+    def test_no_cache(self):
+        timings = core.Timings(self.base_path, self.cache_path)
+        self.assertEqual(timings.estimate('__file/foo'), 0.0)
+
+    def test_record_save(self):
+        timings = core.Timings(self.base_path)
+        timings.record('__file/foo', timing.PREPARE, 1.0)
+        timings.record('__file/foo', timing.RUN, 2.0)
+        timings.record('__file/foo', timing.RUN, 0.5)
+        timings.save()
+        with open(os.path.join(self.base_path, timing.TIMINGS_NAME)) as fd:
+            self.assertEqual(json.load(fd), { '__file/foo': { 'prepare': 1.0, 'run': 2.5 } })
+
+    def test_estimate(self):
+        timings = self._previous({
+            '__file/a': { 'prepare': 1.0, 'run': 3.0 },
+            '__file/b': { 'prepare': 2.0, 'run': 5.0 },
+            '__package/c': { 'prepare': 6.0, 'run': 10.0 },
+        })
+        self.assertEqual(timings.estimate('__file/a'), 4.0)
+        self.assertEqual(timings.estimate('__file/a', (timing.RUN,)), 3.0)
+        # by type
+        self.assertEqual(timings.estimate('__file/new'), 5.5)
+        # all objects
+        self.assertEqual(timings.estimate('__directory/new'), 9.0)
+
+    def test_broken_cache(self):
+        with open(os.path.join(self.cache_path, timing.TIMINGS_NAME), "w") as fd:
+            fd.write("{")
+        timings = core.Timings(self.base_path, self.cache_path)
+        self.assertEqual(timings.previous, {})
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+import os
+import shutil
+
+from cdist import test
+import cdist.trace
+
+
+class TraceTestCase(test.CdistTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "trace.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _load(self):
+        with open(self.path) as fd:
+            return json.load(fd)['traceEvents']
+
+    def test_span(self):
+        cdist.trace.Trace.start(self.path)
+        trace = cdist.trace.Trace(self.path, self.target_host)
+        with trace.span("global explorers"):
+            pass
+        with trace.span("manifest", "object", object="__file/foo"):
+            pass
+        cdist.trace.Trace.finish(self.path)
+
+        events = [e for e in self._load() if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in events], ["global explorers", "manifest"])
+        self.assertEqual(events[1]['args']['object'], "__file/foo")
+        self.assertEqual(events[1]['args']['host'], self.target_host)
+        self.assertFalse(os.path.exists(cdist.trace.Trace.spool_path(self.path)))
+
+    def test_hosts_share_file(self):
+        cdist.trace.Trace.start(self.path)
+        for host in ["first", "second"]:
+            trace = cdist.trace.Trace(self.path, host)
+            with trace.span("run"):
+                pass
+        cdist.trace.Trace.finish(self.path)
+
+        threads = [e['args']['name'] for e in self._load() if e['ph'] == 'M']
+        self.assertEqual(threads, ["first", "second"])
+
+    def test_span_on_error(self):
+        cdist.trace.Trace.start(self.path)
+        trace = cdist.trace.Trace(self.path, self.target_host)
+        with self.assertRaises(cdist.Error):
+            with trace.span("gencode"):
+                raise cdist.Error("gencode failed")
+        cdist.trace.Trace.finish(self.path)
+
+        self.assertEqual([e['name'] for e in self._load() if e['ph'] == 'X'], ["gencode"])
+
+    def test_disabled(self):
+        trace = cdist.trace.Trace(None, self.target_host)
+        with trace.span("run"):
+            pass
+        self.assertEqual(os.listdir(self.temp_dir), [])
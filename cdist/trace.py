@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import contextlib
+import json
+import logging
+import os
+import time
+import zlib
+
+import cdist
+
+log = logging.getLogger(__name__)
+
+'''
+Trace files use the Chrome trace event format and can be loaded into
+chrome://tracing or any other viewer understanding it.
+
+While cdist is running, every host process appends its events as one
+json object per line to a spool file next to the trace file. When all
+hosts are finished, the spool file is converted into the final trace.
+'''
+
+
+class Trace(object):
+    """Record timed spans of a cdist run for one target host.
+
+    A trace without a path is disabled and records nothing.
+
+    """
+    def __init__(self, path, target_host):
+        self.path = path
+        self.target_host = target_host
+        self.pid = os.getpid()
+        # Give each host its own row, even if hosts share a process
+        self.tid = zlib.crc32(target_host.encode('utf-8')) & 0x7fffffff
+        self._named = False
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @staticmethod
+    def spool_path(path):
+        return path + ".spool"
+
+    @classmethod
+    def start(cls, path):
+        """Prepare an empty spool file for the host processes"""
+        try:
+            with open(cls.spool_path(path), "w"):
+                pass
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot create trace file %s: %s" % (path, e))
+
+    @classmethod
+    def finish(cls, path):
+        """Convert the spool file into the final trace file"""
+        spool = cls.spool_path(path)
+        events = []
+        try:
+            with open(spool, "r") as fd:
+                for line in fd:
+                    line = line.strip()
+                    if line:
+                        events.append(json.loads(line))
+            with open(path, "w") as fd:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fd)
+            os.remove(spool)
+        except (EnvironmentError, ValueError) as e:
+            raise cdist.Error("Cannot write trace file %s: %s" % (path, e))
+
+        log.info("Wrote %s trace events to %s", len(events), path)
+
+    def _write(self, event):
+        line = json.dumps(event) + "\n"
+        try:
+            # O_APPEND: parallel host processes share the spool file
+            fd = os.open(self.spool_path(self.path),
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+        except EnvironmentError as e:
+            raise cdist.Error("Cannot write trace event: %s" % e)
+
+    def _name_thread(self):
+        if not self._named:
+            self._named = True
+            self._write({"name": "thread_name", "ph": "M", "pid": self.pid,
+                "tid": self.tid, "args": {"name": self.target_host}})
+
+    @contextlib.contextmanager
+    def span(self, name, category="stage", **args):
+        """Record the time spent in the with block as a complete event"""
+        if not self.enabled:
+            yield
+            return
+
+        self._name_thread()
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            args['host'] = self.target_host
+            self._write({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": int(start * 1000000),
+                "dur": int((end - start) * 1000000),
+                "pid": self.pid,
+                "tid": self.tid,
+                "args": args,
+            })
@@ -168,6 +168,22 @@ class DirectoryDict(collections.MutableMapping):
             raise cdist.Error(str(e))
 
 
+def attribute_name(name):
+    """Return the name of the instance attribute used by the property name"""
+    return '_fsproperty_%s' % name
+
+
+def slot_names(*names):
+    """Return the __slots__ entries needed by the given properties.
+
+    class Foo(object):
+        __slots__ = ('absolute_path',) + slot_names('parameters')
+        parameters = DirectoryDictProperty(lambda instance: os.path.join(instance.absolute_path, 'parameter'))
+
+    """
+    return tuple(attribute_name(name) for name in names)
+
+
 class FileBasedProperty(object):
     attribute_class = None
 
@@ -180,9 +196,9 @@ class FileBasedProperty(object):
         Usage with a sublcass:
 
         class Foo(object):
-            # note that the actual DirectoryDict is stored as __parameters on the instance
+            # note that the actual DirectoryDict is stored as _fsproperty_parameters on the instance
             parameters = DirectoryDictProperty(lambda instance: os.path.join(instance.absolute_path, 'parameter'))
-            # note that the actual DirectoryDict is stored as __other_dict on the instance
+            # note that the actual DirectoryDict is stored as _fsproperty_other_dict on the instance
             other_dict = DirectoryDictProperty('/tmp/other_dict')
 
             def __init__(self):
@@ -190,6 +206,13 @@ class FileBasedProperty(object):
 
         """
         self.path = path
+        self.name = None
+        self.attribute_name = None
+
+    def __set_name__(self, owner, name):
+        # Called on class creation by python >= 3.6
+        self.name = name
+        self.attribute_name = attribute_name(name)
 
     def _get_path(self, instance):
         path = self.path
@@ -198,18 +221,27 @@ class FileBasedProperty(object):
         return path
 
     def _get_property_name(self, owner):
-        for name, prop in owner.__dict__.items():
-            if self == prop:
-                return name
+        if self.name is None:
+            for cls in owner.__mro__:
+                for name, prop in cls.__dict__.items():
+                    if self is prop:
+                        self.__set_name__(owner, name)
+        return self.name
+
+    def _get_attribute_name(self, owner):
+        if self.attribute_name is None:
+            self._get_property_name(owner)
+        return self.attribute_name
 
     def _get_attribute(self, instance, owner):
-        name = self._get_property_name(owner)
-        attribute_name = '__%s' % name
-        if not hasattr(instance, attribute_name):
+        attribute_name = self._get_attribute_name(owner)
+        try:
+            return getattr(instance, attribute_name)
+        except AttributeError:
             path = self._get_path(instance)
             attribute_instance = self.attribute_class(path)
             setattr(instance, attribute_name, attribute_instance)
-        return getattr(instance, attribute_name)
+            return attribute_instance
 
     def __get__(self, instance, owner):
         if instance is None:
@@ -275,11 +307,25 @@ class FileBooleanProperty(FileBasedProperty):
 
 class FileStringProperty(FileBasedProperty):
     """A string property which stores its value in a file.
+
+    With cache=True the value is only read again if the inode, size
+    or mtime of the file changed, which costs a stat instead of
+    reading the file. Writes through other instances or processes
+    are seen as well.
     """
-    # Descriptor Protocol
-    def __get__(self, instance, owner):
-        if instance is None:
-            return self
+    def __init__(self, path, cache=False):
+        super().__init__(path)
+        self.cache = cache
+
+    @staticmethod
+    def _stat_key(path):
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _read(self, instance):
         path = self._get_path(instance)
         value = ""
         try:
@@ -289,6 +335,21 @@ class FileStringProperty(FileBasedProperty):
             pass
         return value
 
+    # Descriptor Protocol
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if not self.cache:
+            return self._read(instance)
+        attribute_name = self._get_attribute_name(owner)
+        key = self._stat_key(self._get_path(instance))
+        cached = getattr(instance, attribute_name, None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = self._read(instance)
+        setattr(instance, attribute_name, (key, value))
+        return value
+
     def __set__(self, instance, value):
         path = self._get_path(instance)
         if value:
@@ -305,3 +366,6 @@ class FileStringProperty(FileBasedProperty):
                 os.remove(path)
             except EnvironmentError:
                 pass
+        if self.cache:
+            setattr(instance, self._get_attribute_name(instance.__class__),
+                (self._stat_key(path), str(value).rstrip('\n') if value else ""))
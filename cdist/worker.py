@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# 2015 Nico Schottelius (nico-cdist at schottelius.org)
+#
+# This file is part of cdist.
+#
+# cdist is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cdist is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cdist. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+
+'''
+Host processes of parallel runs.
+
+They are started from a forkserver that imports this module, and thereby
+everything a host process needs, once. Every host process is a fork of
+that small server instead of a fresh interpreter or a fork of the main
+process that grows with the number of hosts.
+
+'''
+
+import logging
+
+import cdist.log
+
+# Before the imports below create their loggers
+logging.setLoggerClass(cdist.log.Log)
+
+import cdist.config
+import cdist.core
+import cdist.emulator
+import cdist.exec.local
+import cdist.exec.remote
+import cdist.message
+import cdist.profile
+import cdist.trace
+
+# Used later on by every host process
+import concurrent.futures
+import hashlib
+import json
+import subprocess
+import tempfile
+
+# Modules imported by the forkserver
+PRELOAD = [__name__]
+
+
+def context():
+    """Return the multiprocessing context to start host processes with"""
+    import multiprocessing
+    try:
+        forkserver = multiprocessing.get_context("forkserver")
+    except ValueError:
+        # Not available on this platform: fork the main process
+        return multiprocessing.get_context()
+    forkserver.set_forkserver_preload(PRELOAD)
+    return forkserver
+
+
+def onehost(host, args, log_level):
+    """Configure host in a process of its own"""
+    if not logging.root.handlers:
+        # Forked from the forkserver, which did not set up logging
+        logging.basicConfig(format='%(levelname)s: %(message)s')
+    logging.root.setLevel(log_level)
+    cdist.config.Config.onehost(host, args, True)
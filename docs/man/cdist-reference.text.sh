@@ -195,7 +195,7 @@ The following environment variables are exported by cdist:
 
 __explorer::
     Directory that contains all global explorers.
-    Available for: initial manifest, explorer, type explorer, shell
+    Available for: initial manifest, type manifest, explorer, type explorer, shell
 __manifest::
     Directory that contains the initial manifest.
     Available for: initial manifest, type manifest, shell